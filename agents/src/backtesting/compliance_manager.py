@@ -1,4 +1,9 @@
-from typing import List, Dict
+from typing import List, Dict, Any, Optional, Union
+
+import numpy as np
+import polars as pl
+
+from backtesting.risk_rules import RiskPolicy
 
 class ComplianceManager:
     """
@@ -12,17 +17,36 @@ class ComplianceManager:
         Minimum market cap required to consider a token as a viable investment.
     volume_threshold : float
         Minimum trading volume within the last 24 hours for liquidity assessment.
+    policy : Optional[RiskPolicy]
+        Compiled per agent risk policy, replaces the three thresholds above when provided.
 
     Methods
     -------
     evaluate_risk(token_stats: List[Dict[str, float]]) -> Dict[str, List[str]]
         Evaluates the risk level of each token and categorizes them as 'risky' or 'safe'.
+    screen_tokens(token_stats: TokenStatsInput, top_k: int) -> Dict[str, pl.DataFrame]
+        Columnar screen of a whole token universe, returns safe/risky partitions and ranked candidates.
     """
 
-    def __init__(self, volatility_threshold: float = 20, marketcap_min: float = 1000000, volume_threshold: float = 500000):
+    TOKEN_STATS_SCHEMA: Dict[str, Any] = {
+        "symbol": pl.Utf8,
+        "coinmarketcap_id": pl.Int64,
+        "price_usd": pl.Float64,
+        "percent_change_24h": pl.Float64,
+        "market_cap": pl.Float64,
+        "volume_24h": pl.Float64,
+        "token_address": pl.Utf8,
+    }
+
+    def __init__(self, volatility_threshold: float = 20, marketcap_min: float = 1000000, volume_threshold: float = 500000, policy: Optional[RiskPolicy] = None):
         self.volatility_threshold = volatility_threshold
         self.marketcap_min = marketcap_min
         self.volume_threshold = volume_threshold
+        self.policy = policy or RiskPolicy.from_thresholds(
+            volatility_threshold=volatility_threshold,
+            marketcap_min=marketcap_min,
+            volume_threshold=volume_threshold,
+        )
 
     def evaluate_risk(self, token_stats: List[Dict[str, float]]) -> Dict[str, List[str]]:
         """
@@ -38,44 +62,117 @@ class ComplianceManager:
         Dict[str, List[str]]
             A dictionary with 'safe' and 'risky' tokens categorized by their symbols.
         """
-        safe_tokens = []
-        risky_tokens = []
-
-        for token in token_stats:
-            
-            symbol = token["symbol"]
-            coinmarketcap_id = token["coinmarketcap_id"]
-            price_usd = token["price_usd"]
-            percent_change_24h = token["percent_change_24h"]
-            market_cap = token.get("marketcap") or 0 
-            volume_24h = token["volume_24h"]
-            # token_address = token["token_address"]
-            token_address = "0x0"
-
-            token_id_dict = {
-                "symbol": symbol,
-                "coinmarketcap_id": coinmarketcap_id,
-                "price_usd": price_usd,
-                "market_cap": market_cap, 
-                "token_address": token_address
-            }
-
-            if (abs(percent_change_24h) > self.volatility_threshold or
-                market_cap < self.marketcap_min or
-                volume_24h < self.volume_threshold):
-                risky_tokens.append(token_id_dict)
-            else:
-                safe_tokens.append(token_id_dict)
-
-        evaluated_tokens_dict = {
-            "safe": safe_tokens,
-            "risky": risky_tokens
-        }
+        screened_tokens = self.screen_tokens(token_stats=token_stats, top_k=1)
+
+        # best_fit_token = screened_tokens["top_by_market_cap"]
+        best_fit_token = screened_tokens["lowest_market_cap"]
+        if best_fit_token.is_empty():
+            return {}
+
+        return best_fit_token.select("symbol", "coinmarketcap_id", "price_usd", "market_cap", "token_address").row(0, named=True)
+
+    def to_token_stats_frame(self, token_stats: "TokenStatsInput") -> pl.DataFrame:
+        """
+        Normalize token stats into the columnar layout used by the screen.
+
+        Parameters
+        ----------
+        token_stats : TokenStatsInput
+            A list of TokenPrices token stats dicts, a polars DataFrame, or a dict of NumPy arrays keyed by column.
+
+        Returns
+        -------
+        pl.DataFrame
+            A frame with the TOKEN_STATS_SCHEMA columns followed by any other stats columns (used by
+            policy rules), missing market caps are treated as 0.
+        """
+        if isinstance(token_stats, pl.DataFrame):
+            frame = token_stats
+        elif isinstance(token_stats, dict):
+            frame = pl.DataFrame({column: np.asarray(values) for column, values in token_stats.items()})
+        elif token_stats:
+            frame = pl.DataFrame(token_stats, infer_schema_length=None)
+        else:
+            return pl.DataFrame(schema=self.TOKEN_STATS_SCHEMA)
+
+        if "market_cap" not in frame.columns:
+            frame = frame.rename({"marketcap": "market_cap"}) if "marketcap" in frame.columns else frame.with_columns(pl.lit(None).alias("market_cap"))
+
+        # TODO use token_stats token_address once TokenPrices returns real addresses
+        frame = frame.with_columns(pl.lit("0x0").alias("token_address"))
+
+        extra_columns = [column for column in frame.columns if column not in self.TOKEN_STATS_SCHEMA]
+        return frame.select(
+            *[pl.col(column).cast(dtype, strict=False) if column in frame.columns else pl.lit(None, dtype=dtype).alias(column) for column, dtype in self.TOKEN_STATS_SCHEMA.items()],
+            *extra_columns,
+        ).with_columns(pl.col("market_cap").fill_null(0.0))
+
+    def risk_expression(self) -> pl.Expr:
+        """
+        Vectorized risk mask, a token is risky when it fails any rule of the policy or is missing the metric.
+
+        Returns
+        -------
+        pl.Expr
+            Boolean expression that is True for risky tokens.
+        """
+        return ~self.policy.expression
 
-        # best_fit_token = self.get_highest_market_cap_safe_token(token_data=evaluated_tokens_dict)
-        best_fit_token = self.get_lowest_market_cap_safe_token(token_data=evaluated_tokens_dict)
+    def composite_score_expression(self) -> pl.Expr:
+        """
+        Composite score in [0, 1] that rewards size, liquidity and calm price action equally.
+
+        Market cap and volume contribute their percentile rank in the screened universe, volatility
+        contributes 1 - |percent_change_24h| / volatility_threshold.
+
+        Returns
+        -------
+        pl.Expr
+            Float expression with the composite score of each token.
+        """
+        token_count = pl.len().cast(pl.Float64)
+        market_cap_rank = pl.col("market_cap").rank(method="average") / token_count
+        volume_rank = pl.col("volume_24h").rank(method="average") / token_count
+        calmness = (1 - pl.col("percent_change_24h").abs() / self.volatility_threshold).clip(lower_bound=0.0)
+        return ((market_cap_rank + volume_rank + calmness) / 3).fill_null(0.0)
+
+    def screen_tokens(self, token_stats: "TokenStatsInput", top_k: int = 10) -> Dict[str, pl.DataFrame]:
+        """
+        Screens a whole token universe with vectorized threshold masks.
+
+        Parameters
+        ----------
+        token_stats : TokenStatsInput
+            Token stats for any number of tokens, see to_token_stats_frame().
+        top_k : int, optional
+            Number of candidates kept in the ranked outputs, by default 10.
 
-        return best_fit_token
+        Returns
+        -------
+        Dict[str, pl.DataFrame]
+            'safe' and 'risky' partitions, 'top_by_market_cap' (top_k safe tokens by market cap),
+            'lowest_market_cap' (the safe token with the lowest market cap) and 'ranked' (top_k safe
+            tokens by composite_score).
+        """
+        frame = self.to_token_stats_frame(token_stats).with_columns(self.risk_expression().alias("is_risky"))
+
+        safe_tokens = frame.filter(~pl.col("is_risky")).drop("is_risky")
+        risky_tokens = frame.filter(pl.col("is_risky")).drop("is_risky")
+
+        if safe_tokens.is_empty():
+            lowest_market_cap = safe_tokens
+        else:
+            lowest_market_cap = safe_tokens.slice(safe_tokens.get_column("market_cap").arg_min(), 1)
+
+        return {
+            "safe": safe_tokens,
+            "risky": risky_tokens,
+            "top_by_market_cap": safe_tokens.sort("market_cap", descending=True, maintain_order=True).head(top_k),
+            "lowest_market_cap": lowest_market_cap,
+            "ranked": safe_tokens.with_columns(self.composite_score_expression().alias("composite_score"))
+            .sort("composite_score", descending=True, maintain_order=True)
+            .head(top_k),
+        }
     
     def get_highest_market_cap_safe_token(self, token_data: dict) -> dict:
         """
@@ -119,4 +216,6 @@ class ComplianceManager:
 
         # Find the token with the maximum market cap in 'safe' tokens
         highest_market_cap_token = min(token_data['safe'], key=lambda x: x['market_cap'])
-        return highest_market_cap_token
\ No newline at end of file
+        return highest_market_cap_token
+
+TokenStatsInput = Union[List[Dict[str, Any]], pl.DataFrame, Dict[str, np.ndarray]]
@@ -0,0 +1,171 @@
+import os
+import itertools
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+from typing_extensions import List
+
+import polars as pl
+
+from config.config import Backtester
+from backtesting.price_store import PriceStore
+from backtesting.risk_rules import RiskPolicy
+from backtesting.signal_backtester import SignalBacktester
+
+
+# frames shared by every backtest of a worker process, set once by _init_worker()
+_worker_signals: Optional[pl.DataFrame] = None
+_worker_bars: Optional[pl.DataFrame] = None
+
+
+def _init_worker(signals_path: str, bars_path: str) -> None:
+    global _worker_signals, _worker_bars
+    # memory mapped Arrow files, every worker reads the same pages instead of unpickling its own copy
+    _worker_signals = pl.read_ipc(signals_path, memory_map=True)
+    _worker_bars = pl.read_ipc(bars_path, memory_map=True)
+
+
+def _run_worker(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    return ParameterSweep.run_parameters(parameters=parameters, signals=_worker_signals, bars=_worker_bars)
+
+
+class ParameterSweep:
+    """
+    Backtests a grid of strategy parameters over the same signals and bars in a process pool.
+
+    Every combination of the grid values is replayed with SignalBacktester, with no LLM call or
+    Mongo write, so a whole grid runs in the time a single live cycle used to take. Signals and bars
+    are written once to Arrow IPC files that every worker memory maps.
+
+    Parameters
+    ----------
+    price_store : Optional[PriceStore]
+        Store the bars are read from when run() is not given bars.
+    max_workers : Optional[int]
+        Size of the process pool, by default os.cpu_count(). 1 runs every backtest in process.
+
+    Methods
+    -------
+    expand_grid(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]
+        Every combination of the grid values.
+    run(signals: pl.DataFrame, grid: Dict[str, List[Any]], bars: Optional[pl.DataFrame]) -> pl.DataFrame
+        Backtests every combination, one row of parameters and stats per combination.
+    """
+
+    # grid keys and the values used when a key is missing from the grid
+    DEFAULT_PARAMETERS: Dict[str, Any] = {
+        "volatility_threshold": None,
+        "volume_threshold": None,
+        "position_size": Backtester.POSITION_SIZE,
+        "holding_days": Backtester.HOLDING_DAYS,
+    }
+
+    def __init__(self, price_store: Optional[PriceStore] = None, max_workers: Optional[int] = None) -> None:
+        self.price_store = price_store
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    @classmethod
+    def expand_grid(cls, grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+        """
+        Expand a grid into the list of parameter combinations.
+
+        Parameters
+        ----------
+        grid : Dict[str, List[Any]]
+            Values to sweep keyed by parameter name, any key of DEFAULT_PARAMETERS.
+
+        Returns
+        -------
+        List[Dict[str, Any]]
+            One dict of every parameter per combination.
+        """
+        unknown_parameters = set(grid) - set(cls.DEFAULT_PARAMETERS)
+        if unknown_parameters:
+            raise ValueError(f"Unknown sweep parameters: {sorted(unknown_parameters)}, expected {list(cls.DEFAULT_PARAMETERS)}")
+
+        names = list(cls.DEFAULT_PARAMETERS)
+        values = [grid.get(name, [cls.DEFAULT_PARAMETERS[name]]) for name in names]
+        return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+    @staticmethod
+    def build_policy(volatility_threshold: Optional[float], volume_threshold: Optional[float]) -> Optional[RiskPolicy]:
+        """
+        The ComplianceManager thresholds that can be rebuilt from stored bars, as a RiskPolicy.
+        """
+        rules = []
+        if volatility_threshold is not None:
+            rules.append({"type": "max_abs", "field": "percent_change_24h", "value": volatility_threshold})
+        if volume_threshold is not None:
+            rules.append({"type": "min", "field": "volume_24h", "value": volume_threshold})
+        return RiskPolicy(rules=rules, name="sweep") if rules else None
+
+    @classmethod
+    def run_parameters(cls, parameters: Dict[str, Any], signals: pl.DataFrame, bars: pl.DataFrame) -> Dict[str, Any]:
+        """
+        Backtest a single parameter combination.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The parameters followed by the SignalBacktester stats.
+        """
+        backtester = SignalBacktester(
+            holding_days=parameters["holding_days"],
+            position_size=parameters["position_size"],
+            policy=cls.build_policy(
+                volatility_threshold=parameters["volatility_threshold"],
+                volume_threshold=parameters["volume_threshold"],
+            ),
+        )
+        result = backtester.run(signals=signals, bars=bars)
+        return {**parameters, **result["stats"]}
+
+    def run(self, signals: pl.DataFrame, grid: Dict[str, List[Any]], bars: Optional[pl.DataFrame] = None) -> pl.DataFrame:
+        """
+        Backtest every combination of the grid.
+
+        Parameters
+        ----------
+        signals : pl.DataFrame
+            Signals as returned by SignalBacktester.load_signals().
+        grid : Dict[str, List[Any]]
+            Values to sweep keyed by parameter name, e.g.
+            {"volatility_threshold": [10, 20], "position_size": [0.05, 0.1], "holding_days": [1, 7, 30]}.
+        bars : Optional[pl.DataFrame]
+            Bars to replay against, by default read from the price store.
+
+        Returns
+        -------
+        pl.DataFrame
+            One row per combination with the parameters and the backtest stats, best sharpe ratio first.
+        """
+        combinations = self.expand_grid(grid)
+
+        if bars is None and signals.is_empty():
+            bars = pl.DataFrame(schema=PriceStore.BAR_SCHEMA)
+        elif bars is None:
+            bars = (self.price_store or PriceStore.shared()).load(
+                assets=signals.get_column("asset").unique().to_list(),
+                start=SignalBacktester.history_start(signals),
+            )
+
+        if self.max_workers == 1 or len(combinations) == 1:
+            results = [self.run_parameters(parameters=parameters, signals=signals, bars=bars) for parameters in combinations]
+        else:
+            with tempfile.TemporaryDirectory() as shared_dir:
+                signals_path = os.path.join(shared_dir, "signals.arrow")
+                bars_path = os.path.join(shared_dir, "bars.arrow")
+                signals.write_ipc(signals_path)
+                bars.write_ipc(bars_path)
+
+                # spawn, forking a process that already started the polars thread pool can deadlock
+                with ProcessPoolExecutor(
+                    max_workers=min(self.max_workers, len(combinations)),
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(signals_path, bars_path),
+                ) as executor:
+                    results = list(executor.map(_run_worker, combinations))
+
+        return pl.DataFrame(results).sort("sharpe_ratio", descending=True, nulls_last=True)
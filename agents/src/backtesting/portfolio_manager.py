@@ -61,3 +61,9 @@ class PortfolioManager:
         """
         self.strategy_starter.update_portfolio_metrics()
 
+    def close(self) -> None:
+        """
+        Flush the pending portfolio writes and release the portfolio state of the strategy generator.
+        """
+        self.strategy_starter.close()
+
@@ -0,0 +1,190 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+from typing_extensions import List
+
+import polars as pl
+
+
+class PortfolioMetricsEngine:
+    """
+    Computes portfolio performance metrics for every holding in one vectorized polars pass.
+
+    The portfolio (as stored in agent_portfolio.portfolioDetails) and one batch of Coinmarketcap
+    quotes are turned into DataFrames, joined on the Coinmarketcap id, and PnL, cumulative/daily
+    return, volatility, sharpe ratio and drawdown are evaluated as column expressions.
+
+    Parameters
+    ----------
+    timestamp_format : str, optional
+        Format of the holdings signal_timestamp field, by default "%Y-%m-%d %H:%M:%S".
+
+    Methods
+    -------
+    calculate(portfolio: Dict, token_stats_by_id: Dict[str, Dict], current_time: Optional[datetime]) -> pl.DataFrame
+        Returns a DataFrame with one row of metrics per holding.
+    calculate_records(portfolio: Dict, token_stats_by_id: Dict[str, Dict], current_time: Optional[datetime]) -> List[Dict[str, Any]]
+        Same as calculate() but returned as the list of per symbol records stored in Mongo.
+    """
+
+    # number of synthetic daily returns rebuilt from the 7 day percent change
+    RETURN_DAYS: int = 7
+
+    METRIC_COLUMNS: List[str] = [
+        "symbol",
+        "signal_price",
+        "last_price",
+        "token_amount",
+        "PnL",
+        "cumulative_return",
+        "daily_return",
+        "volatility",
+        "sharpe_ratio",
+        "max_drawdown",
+        "holding_duration_days",
+    ]
+
+    def __init__(self, timestamp_format: str = "%Y-%m-%d %H:%M:%S") -> None:
+        self.timestamp_format = timestamp_format
+
+    @staticmethod
+    def normalize_token_id(token_id: Any) -> str:
+        """
+        Coinmarketcap ids are stored as ints, floats or strings, normalize them to the string keys used by TokenPrices.
+        """
+        if isinstance(token_id, float) and token_id.is_integer():
+            return str(int(token_id))
+        return str(token_id)
+
+    def portfolio_to_frame(self, portfolio: Dict) -> pl.DataFrame:
+        """
+        Convert a portfolioDetails mapping of symbol -> holding into a DataFrame.
+
+        Parameters
+        ----------
+        portfolio : Dict
+            Holdings keyed by token symbol.
+
+        Returns
+        -------
+        pl.DataFrame
+            One row per holding.
+        """
+        return pl.DataFrame(
+            {
+                "symbol": list(portfolio.keys()),
+                "token_id": [self.normalize_token_id(holding["token_id"]) for holding in portfolio.values()],
+                "amount": [float(holding["amount"]) for holding in portfolio.values()],
+                "signal_price": [float(holding["signal_price"]) for holding in portfolio.values()],
+                "last_price": [float(holding["last_price"]) for holding in portfolio.values()],
+                "signal_timestamp": [holding["signal_timestamp"] for holding in portfolio.values()],
+            },
+            schema={
+                "symbol": pl.Utf8,
+                "token_id": pl.Utf8,
+                "amount": pl.Float64,
+                "signal_price": pl.Float64,
+                "last_price": pl.Float64,
+                "signal_timestamp": pl.Utf8,
+            },
+        )
+
+    @staticmethod
+    def quotes_to_frame(token_stats_by_id: Dict[str, Dict]) -> pl.DataFrame:
+        """
+        Convert TokenPrices.get_coinmarketcap_quotes() id results into a DataFrame.
+
+        Parameters
+        ----------
+        token_stats_by_id : Dict[str, Dict]
+            Token stats keyed by Coinmarketcap id.
+
+        Returns
+        -------
+        pl.DataFrame
+            One row per quoted token with the latest price and 7 day percent change.
+        """
+        return pl.DataFrame(
+            {
+                "token_id": list(token_stats_by_id.keys()),
+                "latest_price": [stats.get("price_usd") for stats in token_stats_by_id.values()],
+                "percent_change_7d": [stats.get("percent_change_7d") for stats in token_stats_by_id.values()],
+            },
+            schema={"token_id": pl.Utf8, "latest_price": pl.Float64, "percent_change_7d": pl.Float64},
+        )
+
+    def calculate(self, portfolio: Dict, token_stats_by_id: Dict[str, Dict], current_time: Optional[datetime] = None) -> pl.DataFrame:
+        """
+        Calculate performance metrics for every holding.
+
+        The 7 day return series is the same synthetic geometric path used by TokenPrices.get_weekly_returns(),
+        built as list expressions so the whole portfolio is evaluated at once.
+
+        Parameters
+        ----------
+        portfolio : Dict
+            Holdings keyed by token symbol.
+        token_stats_by_id : Dict[str, Dict]
+            Latest token stats keyed by Coinmarketcap id.
+        current_time : Optional[datetime]
+            Time the holding durations are measured against, by default datetime.now().
+
+        Returns
+        -------
+        pl.DataFrame
+            A DataFrame with the METRIC_COLUMNS for each holding.
+        """
+        if not portfolio:
+            return pl.DataFrame(schema={column: pl.Float64 for column in self.METRIC_COLUMNS}).with_columns(
+                pl.col("symbol").cast(pl.Utf8), pl.col("holding_duration_days").cast(pl.Int64)
+            )
+
+        current_time = current_time or datetime.now()
+        days = self.RETURN_DAYS
+
+        # daily growth factor implied by the 7 day change, price k days ago = latest / growth^k
+        growth = (1 + pl.col("percent_change_7d") / 100).pow(1 / days)
+        path_prices = [pl.col("latest_price") / growth.pow(days - day) for day in range(days + 1)]
+        daily_returns = pl.concat_list([path_prices[day] / path_prices[day - 1] - 1 for day in range(1, days + 1)])
+
+        holding_days = (
+            (pl.lit(current_time) - pl.col("signal_timestamp").str.strptime(pl.Datetime, self.timestamp_format))
+            .dt.total_days()
+            .clip(lower_bound=1)
+        )
+        cumulative_return = (pl.col("last_price") - pl.col("signal_price")) / pl.col("signal_price") * pl.col("amount").sign()
+        max_price = pl.max_horizontal("signal_price", "last_price")
+        min_price = pl.min_horizontal("signal_price", "last_price")
+
+        metrics_df = (
+            self.portfolio_to_frame(portfolio)
+            .join(self.quotes_to_frame(token_stats_by_id), on="token_id", how="left")
+            .with_columns(
+                daily_returns.alias("returns"),
+                cumulative_return.alias("cumulative_return"),
+                holding_days.alias("holding_duration_days"),
+            )
+            .with_columns(
+                pl.col("returns").list.mean().fill_null(0.0).fill_nan(0.0).alias("returns_mean"),
+                pl.col("returns").list.std().fill_null(0.0).fill_nan(0.0).alias("volatility"),
+            )
+            .select(
+                "symbol",
+                "signal_price",
+                "last_price",
+                pl.col("amount").alias("token_amount"),
+                ((pl.col("last_price") - pl.col("signal_price")) * pl.col("amount")).alias("PnL"),
+                "cumulative_return",
+                (pl.col("cumulative_return") / pl.col("holding_duration_days")).alias("daily_return"),
+                "volatility",
+                pl.when(pl.col("volatility") != 0)
+                .then(pl.col("returns_mean") / pl.col("volatility"))
+                .otherwise(0.0)
+                .alias("sharpe_ratio"),
+                ((max_price - min_price) / max_price).alias("max_drawdown"),
+                "holding_duration_days",
+            )
+        )
+        return metrics_df
+
+    def calculate_records(self, portfolio: Dict, token_stats_by_id: Dict[str, Dict], current_time: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        return self.calculate(portfolio=portfolio, token_stats_by_id=token_stats_by_id, current_time=current_time).to_dicts()
@@ -0,0 +1,289 @@
+import atexit
+import threading
+import weakref
+from typing import Any, Dict, Optional
+
+from bson.objectid import ObjectId
+
+from config.config import PortfolioStateConsts
+from rag.mongodb_handler import MongoDBHandler
+
+
+class PortfolioState:
+    """
+    In memory portfolio of one agent, written back to Mongo behind the agent's cycles.
+
+    The holdings are read from Mongo once and every mutation (add_to_token_holding,
+    remove_from_token_holding, update_portfolio_metrics) is applied to the local copy and recorded
+    as pending. Pending holdings are flushed with MongoDBHandler.write_portfolio_holdings(), one
+    bulk write of dotted $set/$inc upserts, every FLUSH_INTERVAL_SECONDS, when the state is closed
+    and when the process exits. A change stream on agent_portfolio replaces the local copy with the
+    stored document whenever it is written (by this agent's flushes or by anyone else), pending
+    mutations are re-applied on top of it.
+
+    Parameters
+    ----------
+    agent_id : str
+        The _id of the agent (as a string).
+    mongo_db_handler : MongoDBHandler
+        Handler used to read and write the agent_portfolio collection.
+    portfolio_state_consts : Optional[PortfolioStateConsts]
+        Flush interval and change stream settings, by default PortfolioStateConsts().
+
+    Methods
+    -------
+    for_agent(agent_id: str, mongo_db_handler: MongoDBHandler) -> PortfolioState
+        Returns the process wide state of an agent, shared by everything writing its portfolio.
+    holdings() -> Dict[str, Dict[str, Any]]
+        Copy of the current holdings keyed by symbol.
+    update(symbol: str, fields: Optional[Dict[str, Any]], increments: Optional[Dict[str, float]]) -> None
+        Sets and increments fields of a holding.
+    set_metrics(portfolio_metrics: Any) -> None
+        Replaces the portfolio metrics.
+    flush() -> bool
+        Writes the pending mutations to Mongo.
+    start() -> None
+        Starts the flush and change stream threads.
+    close() -> None
+        Flushes, the last user of a shared state also stops its threads.
+    """
+
+    _instances: "weakref.WeakSet[PortfolioState]" = weakref.WeakSet()
+    _instances_lock = threading.RLock()
+    _atexit_registered = False
+    # one state per agent, every StrategyGenerator of an agent writes the same portfolio document
+    _by_agent: Dict[str, "PortfolioState"] = {}
+
+    def __init__(self, agent_id: str, mongo_db_handler: MongoDBHandler, portfolio_state_consts: Optional[PortfolioStateConsts] = None) -> None:
+        portfolio_state_consts = portfolio_state_consts or PortfolioStateConsts()
+        self.agent_id = str(agent_id)
+        self.mongo_db_handler = mongo_db_handler
+        self.flush_interval = portfolio_state_consts.FLUSH_INTERVAL_SECONDS
+        self.watch_changes = portfolio_state_consts.WATCH_CHANGES
+        self._holdings: Optional[Dict[str, Dict[str, Any]]] = None
+        self._pending_fields: Dict[str, Dict[str, Any]] = {}
+        self._pending_increments: Dict[str, Dict[str, float]] = {}
+        self._pending_metrics: Optional[Any] = None
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._threads: Dict[str, threading.Thread] = {}
+        self._users = 0
+
+        with self._instances_lock:
+            self._instances.add(self)
+            # registered after MongoClientRegistry's own hook (the handler already opened its clients),
+            # atexit runs hooks last in first out so pending writes are flushed before the clients close
+            if not PortfolioState._atexit_registered:
+                atexit.register(PortfolioState.flush_all)
+                PortfolioState._atexit_registered = True
+
+    @classmethod
+    def for_agent(cls, agent_id: str, mongo_db_handler: MongoDBHandler, portfolio_state_consts: Optional[PortfolioStateConsts] = None) -> "PortfolioState":
+        """
+        Return the started state of an agent, created on first use and shared until every user closed it.
+
+        Parameters
+        ----------
+        agent_id : str
+            The _id of the agent (as a string).
+        mongo_db_handler : MongoDBHandler
+            Handler used when the state is created.
+        portfolio_state_consts : Optional[PortfolioStateConsts]
+            Settings used when the state is created, by default PortfolioStateConsts().
+
+        Returns
+        -------
+        PortfolioState
+            The agent's state, close() it once it is no longer used.
+        """
+        with cls._instances_lock:
+            portfolio_state = cls._by_agent.get(str(agent_id))
+            if portfolio_state is None:
+                portfolio_state = cls(agent_id=agent_id, mongo_db_handler=mongo_db_handler, portfolio_state_consts=portfolio_state_consts)
+                cls._by_agent[portfolio_state.agent_id] = portfolio_state
+            portfolio_state._users += 1
+        portfolio_state.start()
+        return portfolio_state
+
+    @property
+    def dirty(self) -> bool:
+        with self._lock:
+            return bool(self._pending_fields or self._pending_increments or self._pending_metrics is not None)
+
+    def holdings(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Copy of the agent's holdings keyed by symbol, read from Mongo only on first use or after invalidate().
+
+        Returns
+        -------
+        Dict[str, Dict[str, Any]]
+            The holdings including mutations that are not flushed yet.
+        """
+        with self._lock:
+            if self._holdings is None:
+                stored_holdings = self.mongo_db_handler.get_portfolio_details(agent_id=self.agent_id)
+                holdings = self._with_pending(stored_holdings or {})
+                # a failed read is not cached, the next call tries again
+                if stored_holdings is None:
+                    return holdings
+                self._holdings = holdings
+            return {symbol: dict(holding) for symbol, holding in self._holdings.items()}
+
+    def update(self, symbol: str, fields: Optional[Dict[str, Any]] = None, increments: Optional[Dict[str, float]] = None) -> None:
+        """
+        Set and increment fields of a holding, the holding is created when missing.
+
+        Parameters
+        ----------
+        symbol : str
+            The symbol of the token (e.g., 'BTC', 'ETH').
+        fields : Optional[Dict[str, Any]]
+            Fields to set, e.g. {"last_price": 2700.0}.
+        increments : Optional[Dict[str, float]]
+            Fields to increment, e.g. {"amount": 0.1}, a missing field starts at 0.
+        """
+        fields = {field: value for field, value in (fields or {}).items() if field not in (increments or {})}
+        increments = increments or {}
+        with self._lock:
+            holdings = self._holdings if self._holdings is not None else {}
+            self._apply(holdings=holdings, symbol=symbol, fields=fields, increments=increments)
+
+            pending_fields = self._pending_fields.setdefault(symbol, {})
+            pending_increments = self._pending_increments.setdefault(symbol, {})
+            for field, value in fields.items():
+                pending_fields[field] = value
+                # a set overrides the increments recorded before it
+                pending_increments.pop(field, None)
+            for field, value in increments.items():
+                if field in pending_fields:
+                    pending_fields[field] = (pending_fields[field] or 0) + value
+                else:
+                    pending_increments[field] = pending_increments.get(field, 0) + value
+            if not pending_increments:
+                del self._pending_increments[symbol]
+
+    def set_metrics(self, portfolio_metrics: Any) -> None:
+        with self._lock:
+            self._pending_metrics = portfolio_metrics
+
+    def flush(self) -> bool:
+        """
+        Write the pending mutations to Mongo in one bulk write, they stay pending when the write fails.
+
+        Returns
+        -------
+        bool
+            True when nothing is left pending.
+        """
+        with self._lock:
+            if not self.dirty:
+                return True
+            try:
+                self.mongo_db_handler.write_portfolio_holdings(
+                    agent_id=self.agent_id,
+                    holdings=self._pending_fields,
+                    increments=self._pending_increments,
+                    portfolio_metrics=self._pending_metrics,
+                )
+            except Exception as e:
+                print(f"failed to flush portfolio of agent {self.agent_id}: {e}")
+                return False
+            self._pending_fields = {}
+            self._pending_increments = {}
+            self._pending_metrics = None
+            return True
+
+    def invalidate(self) -> None:
+        """
+        Drop the local holdings, the next holdings() call reads them again. Pending mutations are kept.
+        """
+        with self._lock:
+            self._holdings = None
+
+    def handle_change(self, change: Dict[str, Any]) -> None:
+        """
+        Replace the local holdings with the portfolio document of an agent_portfolio change stream event.
+        """
+        full_document = change.get("fullDocument")
+        if full_document is None:
+            self.invalidate()
+            return
+        with self._lock:
+            self._holdings = self._with_pending(full_document.get("portfolioDetails") or {})
+
+    def start(self) -> None:
+        """
+        Start (once) the daemon threads flushing every flush_interval seconds and watching agent_portfolio.
+        Nothing is started without an agent id, there is no portfolio to write.
+        """
+        if not self.agent_id:
+            return
+        with self._lock:
+            self._stop_event.clear()
+            targets = {"flush": self._flush_periodically}
+            if self.watch_changes:
+                targets["watch"] = self._watch_portfolio
+            for name, target in targets.items():
+                thread = self._threads.get(name)
+                if thread is None or not thread.is_alive():
+                    self._threads[name] = threading.Thread(target=target, name=f"PortfolioState-{name}-{self.agent_id}", daemon=True)
+                    self._threads[name].start()
+
+    def close(self) -> None:
+        with self._instances_lock:
+            self._users = max(self._users - 1, 0)
+            last_user = self._users == 0
+            if last_user and self._by_agent.get(self.agent_id) is self:
+                del self._by_agent[self.agent_id]
+        if last_user:
+            self._stop_event.set()
+        self.flush()
+
+    @classmethod
+    def flush_all(cls) -> None:
+        """
+        Flush every portfolio state of the process, registered with atexit.
+        """
+        with cls._instances_lock:
+            instances = list(cls._instances)
+        for portfolio_state in instances:
+            portfolio_state.flush()
+
+    def _flush_periodically(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def _watch_portfolio(self) -> None:
+        resume_token = None
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}, "fullDocument.agentId": ObjectId(self.agent_id)}}]
+        while not self._stop_event.is_set():
+            try:
+                with self.mongo_db_handler.agent_portfolio.watch(pipeline, full_document="updateLookup", resume_after=resume_token, max_await_time_ms=1000) as stream:
+                    while not self._stop_event.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self.handle_change(change)
+                        resume_token = stream.resume_token
+            except Exception as e:
+                print(f"portfolio change stream error for agent {self.agent_id}: {e}, retrying in 5 seconds")
+                # events may have been missed, read the stored portfolio again on next use
+                self.invalidate()
+                self._stop_event.wait(5)
+
+    def _with_pending(self, stored_holdings: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        holdings = {symbol: dict(holding) for symbol, holding in stored_holdings.items()}
+        for symbol in dict.fromkeys([*self._pending_fields, *self._pending_increments]):
+            self._apply(
+                holdings=holdings,
+                symbol=symbol,
+                fields=self._pending_fields.get(symbol, {}),
+                increments=self._pending_increments.get(symbol, {}),
+            )
+        return holdings
+
+    @staticmethod
+    def _apply(holdings: Dict[str, Dict[str, Any]], symbol: str, fields: Dict[str, Any], increments: Dict[str, float]) -> None:
+        holding = holdings.setdefault(symbol, {"symbol": symbol})
+        holding.update(fields)
+        for field, value in increments.items():
+            holding[field] = (holding.get(field) or 0) + value
@@ -0,0 +1,376 @@
+import os
+import glob
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from typing_extensions import List
+
+import polars as pl
+from requests import Session
+from requests.exceptions import ConnectionError, Timeout, TooManyRedirects, RetryError
+
+from config.config import DataProviders
+from backtesting.token_prices import TokenPrices
+
+
+class PriceStore:
+    """
+    A local columnar OHLCV store backed by Parquet files partitioned by asset and day.
+
+    Files are laid out as <root_path>/asset=<SYMBOL>/day=<YYYY-MM-DD>/bars.parquet and read lazily
+    with pl.scan_parquet (memory mapped, only the partitions matching the asset/time filters are
+    touched), so replaying months of history does not hit any API.
+
+    The store is filled incrementally: update_from_coinmetrics() only requests the days after the
+    last stored bar of every asset, and record_coinmarketcap_snapshot() appends the quotes that
+    TokenPrices already fetched during a cycle as intraday bars.
+
+    Parameters
+    ----------
+    root_path : Optional[str]
+        Root directory of the store, by default DataProviders.PRICE_STORE_PATH.
+    session : Optional[Session]
+        HTTP session used for Coinmetrics, by default the shared Coinmetrics session, see get_session().
+
+    Methods
+    -------
+    shared(root_path: Optional[str]) -> PriceStore
+        Returns the process wide store of a root directory.
+    write_bars(bars: pl.DataFrame) -> int
+        Merges bars into their asset/day partitions, returns the number of rows written.
+    scan(assets: Optional[List[str]], start: Optional[datetime], end: Optional[datetime]) -> pl.LazyFrame
+        Lazily reads bars, filtered by asset and time.
+    update_from_coinmetrics(assets: List[str]) -> Dict[str, int]
+        Fetches the missing daily history of every asset.
+    record_coinmarketcap_snapshot(token_stats: List[Dict], timestamp: Optional[datetime]) -> int
+        Stores Coinmarketcap quotes as bars.
+    """
+
+    BAR_SCHEMA: Dict[str, pl.DataType] = {
+        "asset": pl.Utf8,
+        "timestamp": pl.Datetime("us"),
+        "open": pl.Float64,
+        "high": pl.Float64,
+        "low": pl.Float64,
+        "close": pl.Float64,
+        "volume": pl.Float64,
+        "source": pl.Utf8,
+    }
+
+    BAR_FILE_NAME: str = "bars.parquet"
+
+    # Coinmetrics community metrics only carry a daily reference price, so open/high/low/close are all PriceUSD
+    COINMETRICS_METRICS: str = "PriceUSD,volume_reported_spot_usd_1d"
+
+    # one keep-alive Coinmetrics session per process, without the Coinmarketcap API key of TokenPrices' session
+    _session: Optional[Session] = None
+    _session_lock = threading.Lock()
+    # stores and partition write locks are process wide, every writer of a partition takes the same lock
+    _stores: Dict[str, "PriceStore"] = {}
+    _partition_locks: Dict[str, threading.Lock] = {}
+    _locks_lock = threading.Lock()
+
+    def __init__(self, root_path: Optional[str] = None, session: Optional[Session] = None) -> None:
+        self.data_providers = DataProviders()
+        self.root_path = root_path or self.data_providers.PRICE_STORE_PATH
+        self.session = session or self.get_session(data_providers=self.data_providers)
+        self.request_timeout = self.data_providers.HTTP_TIMEOUT_SECONDS
+        os.makedirs(self.root_path, exist_ok=True)
+
+    @classmethod
+    def shared(cls, root_path: Optional[str] = None) -> "PriceStore":
+        """
+        Return the process wide store of a root directory, by default DataProviders.PRICE_STORE_PATH.
+        """
+        root_path = os.path.abspath(root_path or DataProviders().PRICE_STORE_PATH)
+        with cls._locks_lock:
+            if root_path not in cls._stores:
+                cls._stores[root_path] = cls(root_path=root_path)
+            return cls._stores[root_path]
+
+    @classmethod
+    def partition_lock(cls, path: str) -> threading.Lock:
+        path = os.path.abspath(path)
+        with cls._locks_lock:
+            return cls._partition_locks.setdefault(path, threading.Lock())
+
+    @classmethod
+    def get_session(cls, data_providers: Optional[DataProviders] = None) -> Session:
+        """
+        Return the process wide Coinmetrics session, pooled and retrying like TokenPrices.get_session().
+        """
+        with cls._session_lock:
+            if cls._session is None:
+                cls._session = TokenPrices.build_session(data_providers=data_providers or DataProviders(), headers={"Accepts": "application/json"})
+            return cls._session
+
+    @staticmethod
+    def normalize_asset(asset: str) -> str:
+        return str(asset).strip().upper()
+
+    def partition_path(self, asset: str, day: str) -> str:
+        return os.path.join(self.root_path, f"asset={self.normalize_asset(asset)}", f"day={day}", self.BAR_FILE_NAME)
+
+    def assets(self) -> List[str]:
+        """
+        Returns the assets that have at least one stored bar.
+        """
+        return sorted(
+            os.path.basename(path).split("=", 1)[1]
+            for path in glob.glob(os.path.join(self.root_path, "asset=*"))
+            if os.path.isdir(path)
+        )
+
+    def write_bars(self, bars: pl.DataFrame) -> int:
+        """
+        Merge bars into their asset/day partitions.
+
+        Bars already stored for the same asset and timestamp are replaced by the new ones, so
+        re-running a fill is idempotent.
+
+        Parameters
+        ----------
+        bars : pl.DataFrame
+            Bars with (at least) the asset, timestamp and close columns of BAR_SCHEMA.
+
+        Returns
+        -------
+        int
+            Number of new or replaced rows.
+        """
+        if bars.is_empty():
+            return 0
+
+        bars = self._conform(bars).with_columns(pl.col("timestamp").dt.strftime("%Y-%m-%d").alias("day"))
+
+        for (asset, day), partition in bars.group_by(["asset", "day"]):
+            path = self.partition_path(asset=asset, day=day)
+            partition = partition.drop("day")
+            with self.partition_lock(path):
+                if os.path.exists(path):
+                    partition = pl.concat([pl.read_parquet(path), partition])
+                partition = partition.unique(subset=["timestamp"], keep="last", maintain_order=True).sort("timestamp")
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # write to a unique file next to the partition then rename, readers never see a half written file
+                file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                os.close(file_descriptor)
+                try:
+                    partition.write_parquet(temporary_path)
+                    os.replace(temporary_path, path)
+                except Exception:
+                    if os.path.exists(temporary_path):
+                        os.remove(temporary_path)
+                    raise
+
+        return bars.height
+
+    def scan(self, assets: Optional[List[str]] = None, start: Optional[datetime] = None, end: Optional[datetime] = None) -> pl.LazyFrame:
+        """
+        Lazily read bars from the store.
+
+        Parameters
+        ----------
+        assets : Optional[List[str]]
+            Assets to read, by default every stored asset.
+        start : Optional[datetime]
+            Inclusive lower bound of the bar timestamps.
+        end : Optional[datetime]
+            Inclusive upper bound of the bar timestamps.
+
+        Returns
+        -------
+        pl.LazyFrame
+            Bars with the BAR_SCHEMA columns, sorted by asset and timestamp once collected.
+        """
+        if assets is None:
+            assets = self.assets()
+
+        paths = [
+            path
+            for asset in {self.normalize_asset(asset) for asset in assets}
+            for path in glob.glob(os.path.join(self.root_path, f"asset={asset}", "day=*", self.BAR_FILE_NAME))
+            if self._day_in_range(path=path, start=start, end=end)
+        ]
+        if not paths:
+            return pl.LazyFrame(schema=self.BAR_SCHEMA)
+
+        bars = pl.scan_parquet(paths, hive_partitioning=False)
+        if start is not None:
+            bars = bars.filter(pl.col("timestamp") >= start)
+        if end is not None:
+            bars = bars.filter(pl.col("timestamp") <= end)
+        return bars.select(list(self.BAR_SCHEMA)).sort(["asset", "timestamp"])
+
+    def load(self, assets: Optional[List[str]] = None, start: Optional[datetime] = None, end: Optional[datetime] = None) -> pl.DataFrame:
+        return self.scan(assets=assets, start=start, end=end).collect()
+
+    def last_timestamp(self, asset: str, source: Optional[str] = None) -> Optional[datetime]:
+        """
+        Returns the timestamp of the latest stored bar of an asset, of one source ("coinmetrics" or
+        "coinmarketcap") when given, None when nothing is stored.
+        """
+        days = sorted(glob.glob(os.path.join(self.root_path, f"asset={self.normalize_asset(asset)}", "day=*", self.BAR_FILE_NAME)))
+        for day in reversed(days):
+            bars = pl.read_parquet(day, columns=["timestamp", "source"])
+            if source is not None:
+                bars = bars.filter(pl.col("source") == source)
+            if not bars.is_empty():
+                return bars.get_column("timestamp").max()
+        return None
+
+    def update_from_coinmetrics(self, assets: List[str], start_time: Optional[str] = None) -> Dict[str, int]:
+        """
+        Fetch the daily Coinmetrics history missing from the store.
+
+        Every asset resumes from the day after its latest stored bar, the first fill starts at
+        start_time (DataProviders.COINMETRICS_START_TIME by default).
+
+        Parameters
+        ----------
+        assets : List[str]
+            Coinmetrics asset codes, e.g. ["btc", "LINK", "UNI"].
+        start_time : Optional[str]
+            First day to fetch when the asset is not stored yet, formatted as YYYY-MM-DD.
+
+        Returns
+        -------
+        Dict[str, int]
+            Number of bars written per asset.
+        """
+        start_time = start_time or self.data_providers.COINMETRICS_START_TIME
+        written = {}
+
+        for asset in assets:
+            # Coinmarketcap snapshot bars of today do not mean the daily history is complete
+            last_timestamp = self.last_timestamp(asset, source="coinmetrics")
+            asset_start_time = (last_timestamp + timedelta(days=1)).strftime("%Y-%m-%d") if last_timestamp else start_time
+            if asset_start_time > datetime.now(timezone.utc).strftime("%Y-%m-%d"):
+                written[self.normalize_asset(asset)] = 0
+                continue
+
+            rows = self._fetch_coinmetrics_rows(asset=asset, start_time=asset_start_time)
+            written[self.normalize_asset(asset)] = self.write_bars(self.coinmetrics_rows_to_bars(rows)) if rows else 0
+
+        print(f"Price store Coinmetrics update: {written}")
+        return written
+
+    def coinmetrics_rows_to_bars(self, rows: List[Dict]) -> pl.DataFrame:
+        """
+        Convert Coinmetrics asset-metrics rows into bars.
+
+        Parameters
+        ----------
+        rows : List[Dict]
+            Rows of the Coinmetrics "data" field, metric values are strings.
+
+        Returns
+        -------
+        pl.DataFrame
+            Daily bars, rows without a price are dropped.
+        """
+        frame = pl.DataFrame(
+            {
+                "asset": [row.get("asset") for row in rows],
+                "time": [row.get("time") for row in rows],
+                "PriceUSD": [row.get("PriceUSD") for row in rows],
+                "volume": [row.get("volume_reported_spot_usd_1d") for row in rows],
+            },
+            schema={"asset": pl.Utf8, "time": pl.Utf8, "PriceUSD": pl.Utf8, "volume": pl.Utf8},
+        )
+        price = pl.col("PriceUSD").cast(pl.Float64, strict=False)
+        return frame.select(
+            pl.col("asset").str.to_uppercase(),
+            pl.col("time").str.slice(0, 19).str.strptime(pl.Datetime("us"), "%Y-%m-%dT%H:%M:%S").alias("timestamp"),
+            price.alias("open"),
+            price.alias("high"),
+            price.alias("low"),
+            price.alias("close"),
+            pl.col("volume").cast(pl.Float64, strict=False),
+            pl.lit("coinmetrics").alias("source"),
+        ).drop_nulls(["close"])
+
+    def record_coinmarketcap_snapshot(self, token_stats: List[Dict], timestamp: Optional[datetime] = None) -> int:
+        """
+        Store Coinmarketcap quotes (TokenPrices._format_token_stats() records) as bars.
+
+        Parameters
+        ----------
+        token_stats : List[Dict]
+            Token stats with symbol, price_usd and volume_24h.
+        timestamp : Optional[datetime]
+            Time of the snapshot, by default now (UTC).
+
+        Returns
+        -------
+        int
+            Number of bars written.
+        """
+        token_stats = [stats for stats in token_stats if stats and stats.get("price_usd") is not None]
+        if not token_stats:
+            return 0
+
+        timestamp = (timestamp or datetime.now(timezone.utc)).replace(tzinfo=None)
+        prices = [float(stats["price_usd"]) for stats in token_stats]
+        bars = pl.DataFrame(
+            {
+                "asset": [self.normalize_asset(stats["symbol"]) for stats in token_stats],
+                "timestamp": [timestamp] * len(token_stats),
+                "open": prices,
+                "high": prices,
+                "low": prices,
+                "close": prices,
+                "volume": [stats.get("volume_24h") for stats in token_stats],
+                "source": ["coinmarketcap"] * len(token_stats),
+            },
+            schema=self.BAR_SCHEMA,
+        )
+        return self.write_bars(bars)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.root_path, ignore_errors=True)
+        os.makedirs(self.root_path, exist_ok=True)
+
+    def _fetch_coinmetrics_rows(self, asset: str, start_time: str) -> List[Dict]:
+        params = {
+            "assets": asset.lower(),
+            "metrics": self.COINMETRICS_METRICS,
+            "frequency": "1d",
+            "start_time": start_time,
+            "paging_from": "start",
+            "page_size": str(self.data_providers.COINMETRICS_PAGE_SIZE),
+            "api_key": self.data_providers.COINMETRICS_API_KEY,
+        }
+        rows = []
+        next_page_url = self.data_providers.COINMETRICS_ASSET_METRICS_URL
+        first_page = True
+        try:
+            while next_page_url:
+                response = self.session.get(next_page_url, params=params if first_page else None, timeout=self.request_timeout)
+                data = response.json()
+                if "error" in data:
+                    print(f"PriceStore Coinmetrics API encountered error for {asset}: {data['error']}")
+                    break
+                rows.extend(data.get("data", []))
+                next_page_url = data.get("next_page_url")
+                first_page = False
+        except (ConnectionError, Timeout, TooManyRedirects, RetryError) as e:
+            print(f"PriceStore Coinmetrics request failed for {asset}: {e}")
+        return rows
+
+    def _conform(self, bars: pl.DataFrame) -> pl.DataFrame:
+        return bars.select(
+            pl.col(column).cast(dtype, strict=False) if column in bars.columns else pl.lit(None, dtype=dtype).alias(column)
+            for column, dtype in self.BAR_SCHEMA.items()
+        ).with_columns(pl.col("asset").str.to_uppercase())
+
+    @staticmethod
+    def _day_in_range(path: str, start: Optional[datetime], end: Optional[datetime]) -> bool:
+        day = os.path.basename(os.path.dirname(path)).split("=", 1)[1]
+        if start is not None and day < start.strftime("%Y-%m-%d"):
+            return False
+        if end is not None and day > end.strftime("%Y-%m-%d"):
+            return False
+        return True
@@ -0,0 +1,188 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from typing_extensions import List
+
+from config.config import DataProviders
+
+
+class QuoteCache:
+    """
+    A TTL + LRU cache of Coinmarketcap token stats keyed by Coinmarketcap id.
+
+    One instance is shared by every TokenPrices in the process (see QuoteCache.shared()), so agents
+    refreshing the same holdings inside the TTL window reuse a single paid quotes/latest call.
+    When sqlite_path is set entries are also written to SQLite and reloaded on start up, so a
+    restarted Diana process starts warm.
+
+    Parameters
+    ----------
+    ttl_seconds : float
+        How long a quote stays fresh.
+    max_entries : int
+        Maximum number of quotes held in memory, least recently used quotes are evicted first.
+    sqlite_path : str, optional
+        Path of the SQLite file backing the cache, by default "" (memory only).
+    clock : Callable[[], float], optional
+        Wall clock used for expiry, by default time.time.
+
+    Attributes
+    ----------
+    hits : int
+        Number of quotes served from the cache.
+    misses : int
+        Number of quotes that had to be fetched from Coinmarketcap.
+    """
+
+    _shared: Optional["QuoteCache"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, ttl_seconds: float, max_entries: int, sqlite_path: str = "", clock: Callable[[], float] = time.time) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.sqlite_path = sqlite_path
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+        if self.sqlite_path:
+            self._connection = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS quotes (coinmarketcap_id TEXT PRIMARY KEY, fetched_at REAL NOT NULL, stats TEXT NOT NULL)"
+            )
+            self._connection.commit()
+            self._load_from_disk()
+
+    @classmethod
+    def shared(cls) -> "QuoteCache":
+        """
+        Return the process wide quote cache, built from DataProviders settings on first use.
+
+        Returns
+        -------
+        QuoteCache
+            The shared cache instance.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                data_providers = DataProviders()
+                cls._shared = cls(
+                    ttl_seconds=data_providers.COINMARKET_CAP_QUOTE_CACHE_TTL_SECONDS,
+                    max_entries=data_providers.COINMARKET_CAP_QUOTE_CACHE_MAX_ENTRIES,
+                    sqlite_path=data_providers.COINMARKET_CAP_QUOTE_CACHE_PATH,
+                )
+            return cls._shared
+
+    def get_many(self, ids_list: List[str]) -> Tuple[Dict[str, Dict], List[str]]:
+        """
+        Look up many ids at once.
+
+        Parameters
+        ----------
+        ids_list : List[str]
+            Coinmarketcap ids to look up.
+
+        Returns
+        -------
+        Tuple[Dict[str, Dict], List[str]]
+            Fresh token stats keyed by id, and the ids that are missing or expired.
+        """
+        found: Dict[str, Dict] = {}
+        missing: List[str] = []
+        now = self.clock()
+
+        with self._lock:
+            for token_id in ids_list:
+                token_id = str(token_id)
+                entry = self._entries.get(token_id)
+                if entry is not None and now - entry[0] <= self.ttl_seconds:
+                    self._entries.move_to_end(token_id)
+                    found[token_id] = entry[1]
+                    self.hits += 1
+                else:
+                    if entry is not None:
+                        del self._entries[token_id]
+                    missing.append(token_id)
+                    self.misses += 1
+
+        return found, missing
+
+    def get(self, token_id: str) -> Optional[Dict]:
+        found, _ = self.get_many([token_id])
+        return found.get(str(token_id))
+
+    def set_many(self, stats_by_id: Dict[str, Dict]) -> None:
+        """
+        Store freshly fetched token stats.
+
+        Parameters
+        ----------
+        stats_by_id : Dict[str, Dict]
+            Token stats keyed by Coinmarketcap id.
+        """
+        if not stats_by_id:
+            return
+
+        fetched_at = self.clock()
+        with self._lock:
+            for token_id, stats in stats_by_id.items():
+                token_id = str(token_id)
+                self._entries[token_id] = (fetched_at, stats)
+                self._entries.move_to_end(token_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            if self._connection is not None:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO quotes (coinmarketcap_id, fetched_at, stats) VALUES (?, ?, ?)",
+                    [(str(token_id), fetched_at, json.dumps(stats)) for token_id, stats in stats_by_id.items()],
+                )
+                self._connection.execute("DELETE FROM quotes WHERE fetched_at < ?", (fetched_at - self.ttl_seconds,))
+                self._connection.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Hit/miss counters, every hit is a paid Coinmarketcap quote that was not requested.
+
+        Returns
+        -------
+        Dict[str, float]
+            hits, misses, hit_rate and the current number of cached quotes.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM quotes")
+                self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _load_from_disk(self) -> None:
+        oldest_fresh = self.clock() - self.ttl_seconds
+        rows = self._connection.execute(
+            "SELECT coinmarketcap_id, fetched_at, stats FROM quotes WHERE fetched_at >= ? ORDER BY fetched_at DESC LIMIT ?",
+            (oldest_fresh, self.max_entries),
+        ).fetchall()
+        # oldest first so the most recent quotes end up most recently used
+        for token_id, fetched_at, stats in reversed(rows):
+            self._entries[token_id] = (fetched_at, json.loads(stats))
@@ -0,0 +1,181 @@
+import json
+import hashlib
+import threading
+from typing import Any, Callable, Dict
+from typing_extensions import List
+
+import polars as pl
+
+from config.config import Backtester
+
+
+class RiskPolicy:
+    """
+    A per agent risk policy compiled once into a single vectorized polars predicate.
+
+    Policies are declared as a list of rule dicts, either in config (HubPull.RISK_POLICY) or in the
+    agent's Mongo agent_settings document under "riskPolicy". Supported rules:
+
+        {"type": "max_abs", "field": "percent_change_1h", "value": 5}
+        {"type": "min", "field": "volume_30d", "value": 1000000}
+        {"type": "max", "field": "percent_change_24h", "value": 30}
+        {"type": "min_ratio", "numerator": "volume_24h", "denominator": "market_cap", "value": 0.01}
+        {"type": "denylist", "field": "symbol", "values": ["LUNA"]}
+        {"type": "allowlist", "field": "coinmarketcap_id", "values": ["1975", "7083"]}
+        {"type": "allowlist", "field": "coinmarketcap_id", "source": "unichain_sepolia"}
+
+    A token passes the policy when it passes every rule, tokens missing a field fail that rule.
+
+    Parameters
+    ----------
+    rules : List[Dict[str, Any]]
+        The rule declarations.
+    name : str, optional
+        Name of the policy (usually the agent id), by default "default".
+
+    Attributes
+    ----------
+    expression : pl.Expr
+        The compiled predicate, True for tokens that pass the policy.
+    """
+
+    RULE_TYPES = ("max_abs", "min", "max", "min_ratio", "allowlist", "denylist")
+
+    _cache: Dict[str, "RiskPolicy"] = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, rules: List[Dict[str, Any]], name: str = "default") -> None:
+        self.rules = rules
+        self.name = name
+        self.expression = self._compile(rules)
+
+    @classmethod
+    def from_thresholds(cls, volatility_threshold: float, marketcap_min: float, volume_threshold: float, name: str = "default") -> "RiskPolicy":
+        """
+        Build the policy equivalent to the ComplianceManager thresholds.
+        """
+        return cls(
+            rules=[
+                {"type": "max_abs", "field": "percent_change_24h", "value": volatility_threshold},
+                {"type": "min", "field": "market_cap", "value": marketcap_min},
+                {"type": "min", "field": "volume_24h", "value": volume_threshold},
+            ],
+            name=name,
+        )
+
+    @classmethod
+    def cached(cls, agent_id: str, rules: List[Dict[str, Any]]) -> "RiskPolicy":
+        """
+        Return the compiled policy of an agent, recompiling only when its rules change.
+
+        Parameters
+        ----------
+        agent_id : str
+            The agent the policy belongs to.
+        rules : List[Dict[str, Any]]
+            The agent's current rule declarations.
+
+        Returns
+        -------
+        RiskPolicy
+            The cached compiled policy.
+        """
+        fingerprint = cls.fingerprint(rules)
+        cache_key = f"{agent_id}:{fingerprint}"
+        with cls._cache_lock:
+            policy = cls._cache.get(cache_key)
+            if policy is None:
+                # drop the agent's stale policies before caching the new one
+                for stale_key in [key for key in cls._cache if key.startswith(f"{agent_id}:")]:
+                    del cls._cache[stale_key]
+                policy = cls(rules=rules, name=agent_id)
+                cls._cache[cache_key] = policy
+            return policy
+
+    @staticmethod
+    def fingerprint(rules: List[Dict[str, Any]]) -> str:
+        return hashlib.sha256(json.dumps(rules, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def evaluate(self, token_stats: pl.DataFrame) -> pl.DataFrame:
+        """
+        Evaluate the policy for every token in one pass.
+
+        Returns
+        -------
+        pl.DataFrame
+            token_stats with a boolean "passes_policy" column.
+        """
+        return token_stats.with_columns(self.expression.alias("passes_policy"))
+
+    @classmethod
+    def _compile(cls, rules: List[Dict[str, Any]]) -> pl.Expr:
+        if not rules:
+            return pl.lit(True)
+
+        predicates = []
+        for rule in rules:
+            if rule.get("type") not in cls.RULE_TYPES:
+                raise ValueError(f"Unsupported risk rule type: {rule.get('type')}, expected one of {list(cls.RULE_TYPES)}")
+            compiler: Callable[[Dict[str, Any]], pl.Expr] = getattr(cls, f"_{rule['type']}")
+            predicates.append(compiler(rule).fill_null(False))
+
+        return pl.all_horizontal(predicates)
+
+    @staticmethod
+    def _max_abs(rule: Dict[str, Any]) -> pl.Expr:
+        return pl.col(rule["field"]).cast(pl.Float64).abs() <= rule["value"]
+
+    @staticmethod
+    def _min(rule: Dict[str, Any]) -> pl.Expr:
+        return pl.col(rule["field"]).cast(pl.Float64) >= rule["value"]
+
+    @staticmethod
+    def _max(rule: Dict[str, Any]) -> pl.Expr:
+        return pl.col(rule["field"]).cast(pl.Float64) <= rule["value"]
+
+    @staticmethod
+    def _min_ratio(rule: Dict[str, Any]) -> pl.Expr:
+        denominator = pl.col(rule["denominator"]).cast(pl.Float64)
+        ratio = pl.when(denominator > 0).then(pl.col(rule["numerator"]).cast(pl.Float64) / denominator)
+        return ratio >= rule["value"]
+
+    @staticmethod
+    def _list_values(rule: Dict[str, Any]) -> List[str]:
+        if rule.get("source") == "unichain_sepolia":
+            allowlisted_assets = Backtester.get_unichain_sepolia_allowlisted_assets()
+            if rule.get("field", "coinmarketcap_id") == "symbol":
+                return [asset["symbol"] for asset in allowlisted_assets.values()]
+            return list(allowlisted_assets.keys())
+        return [str(value) for value in rule.get("values", [])]
+
+    @classmethod
+    def _allowlist(cls, rule: Dict[str, Any]) -> pl.Expr:
+        return pl.col(rule.get("field", "coinmarketcap_id")).cast(pl.Utf8).is_in(cls._list_values(rule))
+
+    @classmethod
+    def _denylist(cls, rule: Dict[str, Any]) -> pl.Expr:
+        return ~pl.col(rule.get("field", "symbol")).cast(pl.Utf8).is_in(cls._list_values(rule))
+
+
+def evaluate_policies(token_stats: pl.DataFrame, policies: Dict[str, RiskPolicy]) -> pl.DataFrame:
+    """
+    Score many agents against one shared token stats frame.
+
+    Every compiled policy becomes one boolean column, all evaluated in a single with_columns call so
+    polars runs one pass per policy over the shared frame.
+
+    Parameters
+    ----------
+    token_stats : pl.DataFrame
+        Shared token stats for the cycle.
+    policies : Dict[str, RiskPolicy]
+        Compiled policies keyed by agent id.
+
+    Returns
+    -------
+    pl.DataFrame
+        token_stats with one boolean column per agent id.
+    """
+    if not policies:
+        return token_stats
+    return token_stats.with_columns([policy.expression.alias(agent_id) for agent_id, policy in policies.items()])
@@ -0,0 +1,280 @@
+import glob
+import json
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from typing_extensions import List
+
+import polars as pl
+
+from config.config import Backtester, GeneratedTradesFilePaths
+from backtesting.price_store import PriceStore
+from backtesting.risk_rules import RiskPolicy
+
+
+class SignalBacktester:
+    """
+    Replays the trade signals saved by StrategyGenerator against the local PriceStore.
+
+    Every buy/sell signal opens a position at the first bar at or after the signal time and closes
+    it after holding_days at the first bar at or after that time (both found with join_asof, so no
+    future price leaks into the entry). Positions are marked to market on every stored bar, giving
+    a portfolio return path from which the equity curve, drawdown path and Sharpe ratio follow.
+
+    When a RiskPolicy is given, signals are screened first against the stats known at signal time
+    (percent_change_24h and volume_24h rebuilt from the stored bars), like ComplianceManager does live.
+
+    Parameters
+    ----------
+    price_store : Optional[PriceStore]
+        Store holding the bars of the traded assets, only needed when run() is not given bars.
+    holding_days : float, optional
+        How long each position is held, by default Backtester.HOLDING_DAYS.
+    position_size : float, optional
+        Fraction of equity allocated to each position, by default Backtester.POSITION_SIZE.
+    periods_per_year : int, optional
+        Number of bars per year used to annualize the Sharpe ratio, by default 365 (daily bars).
+    policy : Optional[RiskPolicy]
+        Risk policy signals must pass to be traded, by default every signal is traded.
+
+    Methods
+    -------
+    load_signals(paths: Optional[List[str]]) -> pl.DataFrame
+        Flattens generated_trades_for_testing-*.json files into one signal per row.
+    run(signals: pl.DataFrame) -> Dict[str, Any]
+        Replays the signals and returns trades, the return path and summary statistics.
+    """
+
+    DIRECTIONS: Dict[str, int] = {"buy": 1, "sell": -1}
+
+    SIGNAL_SCHEMA: Dict[str, pl.DataType] = {
+        "signal_time": pl.Datetime("us"),
+        "agent_id": pl.Utf8,
+        "asset": pl.Utf8,
+        "direction": pl.Int8,
+        "confidence_level": pl.Utf8,
+    }
+
+    def __init__(
+        self,
+        price_store: Optional[PriceStore] = None,
+        holding_days: float = Backtester.HOLDING_DAYS,
+        position_size: float = Backtester.POSITION_SIZE,
+        periods_per_year: int = 365,
+        policy: Optional[RiskPolicy] = None,
+    ) -> None:
+        self.price_store = price_store
+        self.holding_days = holding_days
+        self.position_size = position_size
+        self.periods_per_year = periods_per_year
+        self.policy = policy
+
+    def load_signals(self, paths: Optional[List[str]] = None) -> pl.DataFrame:
+        """
+        Flatten saved trade generations into a signal frame.
+
+        Each file holds a list of {timestamp: {"agent_trade_<agent id>": [trade, ...], ...}} entries,
+        "hold" and unknown directions are skipped.
+
+        Parameters
+        ----------
+        paths : Optional[List[str]]
+            Files to load, by default every file matching GeneratedTradesFilePaths.GENERATED_TRADES_GLOB.
+
+        Returns
+        -------
+        pl.DataFrame
+            One row per buy/sell signal with the SIGNAL_SCHEMA columns, sorted by signal_time.
+        """
+        if paths is None:
+            paths = sorted(glob.glob(GeneratedTradesFilePaths.GENERATED_TRADES_GLOB))
+
+        rows = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as file:
+                try:
+                    generations = json.load(file)
+                except json.JSONDecodeError:
+                    print(f"Skipping unreadable signals file {path}")
+                    continue
+
+            for generation in generations:
+                for timestamp, agent_trades in generation.items():
+                    for key, trades in agent_trades.items():
+                        if not key.startswith("agent_trade_"):
+                            continue
+                        for trade in trades:
+                            direction = self.DIRECTIONS.get(str(trade.get("direction", "")).strip().lower())
+                            if direction is None or not trade.get("token_symbol"):
+                                continue
+                            rows.append(
+                                {
+                                    "signal_time": datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S"),
+                                    "agent_id": key[len("agent_trade_"):],
+                                    "asset": PriceStore.normalize_asset(trade["token_symbol"]),
+                                    "direction": direction,
+                                    "confidence_level": trade.get("confidence_level"),
+                                }
+                            )
+
+        return pl.DataFrame(rows, schema=self.SIGNAL_SCHEMA).sort("signal_time")
+
+    def run(self, signals: pl.DataFrame, bars: Optional[pl.DataFrame] = None) -> Dict[str, Any]:
+        """
+        Replay signals against stored bars.
+
+        Parameters
+        ----------
+        signals : pl.DataFrame
+            Signals as returned by load_signals().
+        bars : Optional[pl.DataFrame]
+            Bars to replay against, by default read from the price store for the signalled assets
+            from the day before the first signal onwards.
+
+        Returns
+        -------
+        Dict[str, Any]
+            trades: one row per position with entry/exit prices and return,
+            returns: per bar portfolio return, equity and drawdown path,
+            stats: total_return, sharpe_ratio, max_drawdown, trade counts and hit rate.
+        """
+        holding_period = timedelta(days=self.holding_days)
+
+        if bars is None:
+            if signals.is_empty():
+                bars = pl.DataFrame(schema=PriceStore.BAR_SCHEMA)
+            else:
+                # no upper bound, exits are the first bar at or after the holding period ends
+                bars = self.price_store.load(assets=signals.get_column("asset").unique().to_list(), start=self.history_start(signals))
+
+        if self.policy is not None:
+            signals = self.screen_signals(signals=signals, bars=bars)
+
+        prices = bars.select("asset", "timestamp", "close").drop_nulls().sort(["asset", "timestamp"])
+        trades = self._match_trades(signals=signals, prices=prices, holding_period=holding_period)
+        returns = self._return_path(trades=trades, prices=prices)
+
+        return {
+            "trades": trades,
+            "returns": returns,
+            "stats": self._summary(signals=signals, trades=trades, returns=returns),
+        }
+
+    @staticmethod
+    def history_start(signals: pl.DataFrame) -> datetime:
+        """
+        First bar time needed to replay signals, midnight of the day before the first signal so
+        percent_change_24h can be rebuilt for the earliest signals.
+        """
+        first_day = (signals.get_column("signal_time").min() - timedelta(days=1)).date()
+        return datetime(first_day.year, first_day.month, first_day.day)
+
+    def signal_stats(self, signals: pl.DataFrame, bars: pl.DataFrame) -> pl.DataFrame:
+        """
+        Attach the market stats known at signal time to every signal.
+
+        Parameters
+        ----------
+        signals : pl.DataFrame
+            Signals as returned by load_signals().
+        bars : pl.DataFrame
+            Stored bars of the signalled assets.
+
+        Returns
+        -------
+        pl.DataFrame
+            signals with price_usd, percent_change_24h and volume_24h columns, null when no bar
+            precedes the signal.
+        """
+        bars = bars.select("asset", "timestamp", "close", "volume").filter(pl.col("close").is_not_null()).sort("timestamp")
+        latest_bars = bars.rename({"timestamp": "stats_time", "close": "price_usd", "volume": "volume_24h"})
+        day_old_bars = bars.select("asset", pl.col("timestamp").alias("day_old_time"), pl.col("close").alias("day_old_price"))
+
+        return (
+            signals.sort("signal_time")
+            .join_asof(latest_bars, left_on="signal_time", right_on="stats_time", by="asset", strategy="backward")
+            .with_columns((pl.col("signal_time") - timedelta(days=1)).alias("day_old_target"))
+            .sort("day_old_target")
+            .join_asof(day_old_bars, left_on="day_old_target", right_on="day_old_time", by="asset", strategy="backward")
+            .with_columns(((pl.col("price_usd") / pl.col("day_old_price") - 1) * 100).alias("percent_change_24h"))
+            .drop("stats_time", "day_old_target", "day_old_time", "day_old_price")
+            .sort("signal_time")
+        )
+
+    def screen_signals(self, signals: pl.DataFrame, bars: pl.DataFrame) -> pl.DataFrame:
+        """
+        Keep the signals that pass the risk policy at signal time.
+        """
+        screened = self.signal_stats(signals=signals, bars=bars).filter(self.policy.expression)
+        return screened.select(signals.columns)
+
+    def _match_trades(self, signals: pl.DataFrame, prices: pl.DataFrame, holding_period: timedelta) -> pl.DataFrame:
+        prices = prices.sort("timestamp")
+        entry_prices = prices.rename({"timestamp": "entry_time", "close": "entry_price"})
+        exit_prices = prices.rename({"timestamp": "exit_time", "close": "exit_price"})
+
+        trades = (
+            signals.sort("signal_time")
+            .join_asof(entry_prices, left_on="signal_time", right_on="entry_time", by="asset", strategy="forward")
+            .with_columns((pl.col("signal_time") + holding_period).alias("target_exit_time"))
+            .sort("target_exit_time")
+            .join_asof(exit_prices, left_on="target_exit_time", right_on="exit_time", by="asset", strategy="forward")
+            # positions still open at the end of the data are closed on the latest bar
+            .join(
+                prices.group_by("asset").agg(pl.col("timestamp").last().alias("last_time"), pl.col("close").last().alias("last_price")),
+                on="asset",
+                how="left",
+            )
+            .with_columns(
+                pl.col("exit_time").fill_null(pl.col("last_time")),
+                pl.col("exit_price").fill_null(pl.col("last_price")),
+            )
+            .drop("target_exit_time", "last_time", "last_price")
+            .filter(pl.col("entry_price").is_not_null() & (pl.col("exit_time") > pl.col("entry_time")))
+            .with_columns((pl.col("direction") * (pl.col("exit_price") / pl.col("entry_price") - 1)).alias("trade_return"))
+            .sort("signal_time")
+            .with_row_index("trade_id")
+        )
+        return trades
+
+    def _return_path(self, trades: pl.DataFrame, prices: pl.DataFrame) -> pl.DataFrame:
+        bar_returns = prices.with_columns((pl.col("close") / pl.col("close").shift(1).over("asset") - 1).alias("bar_return"))
+
+        # mark every open position to market on each bar between its entry and exit
+        position_returns = (
+            trades.select("trade_id", "asset", "direction", "entry_time", "exit_time")
+            .join(bar_returns, on="asset", how="inner")
+            .filter((pl.col("timestamp") > pl.col("entry_time")) & (pl.col("timestamp") <= pl.col("exit_time")))
+            .with_columns((pl.col("direction") * pl.col("bar_return") * self.position_size).alias("position_return"))
+        )
+
+        return (
+            position_returns.group_by("timestamp")
+            .agg(
+                pl.col("position_return").sum().alias("portfolio_return"),
+                pl.col("trade_id").n_unique().alias("open_positions"),
+            )
+            .sort("timestamp")
+            .with_columns((1 + pl.col("portfolio_return")).cum_prod().alias("equity"))
+            .with_columns((pl.col("equity") / pl.col("equity").cum_max() - 1).alias("drawdown"))
+        )
+
+    def _summary(self, signals: pl.DataFrame, trades: pl.DataFrame, returns: pl.DataFrame) -> Dict[str, Any]:
+        if returns.is_empty():
+            total_return = sharpe_ratio = max_drawdown = 0.0
+        else:
+            portfolio_returns = returns.get_column("portfolio_return")
+            volatility = portfolio_returns.std() or 0.0
+            total_return = returns.get_column("equity")[-1] - 1
+            sharpe_ratio = portfolio_returns.mean() / volatility * math.sqrt(self.periods_per_year) if volatility else 0.0
+            max_drawdown = returns.get_column("drawdown").min()
+
+        return {
+            "signals": signals.height,
+            "trades": trades.height,
+            "unmatched_signals": signals.height - trades.height,
+            "hit_rate": (trades.get_column("trade_return") > 0).mean() if trades.height else 0.0,
+            "total_return": total_return,
+            "sharpe_ratio": sharpe_ratio,
+            "max_drawdown": max_drawdown,
+        }
@@ -18,17 +18,22 @@ import quantstats as qs
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
 from langchain_core.documents import Document
-from langchain_openai import OpenAIEmbeddings
 from sklearn.metrics.pairwise import cosine_similarity
 
 from rag.embedding_model import EmbeddingModel
+from rag.embedding_service import EmbeddingService
 from twitter.twitter_api import TwitterAPI
 from rag.rag_chroma_client import ChromaVectorStoreManager
 from config.config import OpenAiConsts, Backtester, HubPull
 from backtesting.structured_output_formatters import ResponseFormatter
 from backtesting.token_prices import TokenPrices
+from backtesting.portfolio_metrics import PortfolioMetricsEngine
+from backtesting.portfolio_state import PortfolioState
+from backtesting.price_store import PriceStore
 from rag.mongodb_handler import MongoDBHandler
+from rag.token_id_resolver import TokenIdResolver
 from backtesting.compliance_manager import ComplianceManager
+from backtesting.risk_rules import RiskPolicy
 
 class StrategyGenerator:
     """
@@ -65,12 +70,12 @@ class StrategyGenerator:
         self.api_key = ""
         self._load_api_key()
         open_ai_consts = OpenAiConsts()
-        self.open_ai_embedding_function = OpenAIEmbeddings(model=open_ai_consts.DEFAULT_EMBEDDING_MODEL)
+        self.open_ai_embedding_function = EmbeddingService.shared().as_langchain()
         llm = ChatOpenAI(model=open_ai_consts.DEFAULT_MODEL_NAME)
         self.model_with_structure = llm.with_structured_output(schema=ResponseFormatter)
         self.llm = ChatOpenAI(model=open_ai_consts.DEFAULT_MODEL_NAME)
         self.mongo_db_handler = MongoDBHandler(collection_name=collection_name)
-        self.compliance_manager = ComplianceManager()
+        self.compliance_manager = ComplianceManager(policy=RiskPolicy.cached(agent_id=hub_pull.AGENT_OBJECT_ID, rules=hub_pull.RISK_POLICY)) if hub_pull.RISK_POLICY else ComplianceManager()
 
         # since chroma is only going to be used for short term data which diana class gets from nfa database and market data ChromaVectorStoreManager collection name is DIANA
         self.manager = ChromaVectorStoreManager("DIANA")
@@ -84,6 +89,7 @@ class StrategyGenerator:
         print(backtester_settings.BACKTEST_PROMPT)
 
         self.backtest_clmm_prompt = PromptTemplate.from_template(backtester_settings.BACKTEST_CLMM_PROMPT)
+        self.position_size = backtester_settings.POSITION_SIZE
 
         # hub_pull = HubPull()
         hub_pull = hub_pull
@@ -92,7 +98,18 @@ class StrategyGenerator:
         self.double_down_flag = hub_pull.DOUBLE_DOWN
 
         self.token_prices = TokenPrices()
-        self.portfolio: Dict[str, TokenHolding] = {}
+        # symbol -> Coinmarketcap ids of the NFA tokens collection, held in memory by the whole process
+        self.token_id_resolver = TokenIdResolver.shared()
+        self.portfolio_metrics_engine = PortfolioMetricsEngine()
+        self.price_store = PriceStore.shared()
+        # holdings are kept in memory for the agent's lifetime and written back to mongodb behind the cycles, one state per agent
+        self.portfolio_state = PortfolioState.for_agent(agent_id=self.joey_agent_object_id, mongo_db_handler=self.mongo_db_handler)
+
+    def close(self) -> None:
+        """
+        Flush the agent's pending portfolio writes and release its portfolio state.
+        """
+        self.portfolio_state.close()
 
     def _load_api_key(self) -> None:
         """
@@ -131,17 +148,16 @@ class StrategyGenerator:
         Parameters
         ----------
         num_docs : int, optional
-            The number of random documents to retrieve, by default 5.
+            The number of documents to retrieve, by default 50.
 
         Returns
         -------
         List[Document]
-            A list of randomly selected documents.
+            The relevant and mutually diverse documents, picked by maximal marginal relevance among the 200 nearest.
         """
-        search_results = self.manager.similarity_search(query, k=200, filters={"source": similarity_search_filter})
-        # sampled_results = random.sample(search_results, min(num_docs, len(search_results)))
-    
-        return search_results
+        search_hits = self.manager.search(query, k=num_docs, source=similarity_search_filter, mmr=True, fetch_k=200)
+
+        return self.manager.fetch_documents([hit.id for hit in search_hits])
 
     def add_to_token_holding(self, symbol: str, token_address:str, amount: float, price: float, signal_timestamp:str, token_id: float) -> None:
         """
@@ -166,7 +182,6 @@ class StrategyGenerator:
 
             print(f"Accumulating {symbol} \n")
             current_holding = portfolio[symbol]
-            amount = amount
             new_total_amount = current_holding['amount'] + amount
 
             if new_total_amount > 0:
@@ -174,15 +189,13 @@ class StrategyGenerator:
             else:
                 average_price = price
 
-            portfolio[symbol]['token_address'] = token_address
-            portfolio[symbol]['amount'] = new_total_amount
-            portfolio[symbol]['last_price'] = average_price
+            holding = {"token_address": token_address, "last_price": average_price}
         else:
             print(f"1.  adding new token {symbol}\n")
-            amount = amount # for dev test
-            portfolio[symbol] = TokenHolding(symbol=symbol, token_address=token_address, amount=amount, signal_price=price, signal_timestamp=signal_timestamp,last_price=price, token_id=token_id)
+            holding = TokenHolding(symbol=symbol, token_address=token_address, amount=amount, signal_price=price, signal_timestamp=signal_timestamp,last_price=price, token_id=token_id)
 
-        self.save_portfolio(portfolio=portfolio)
+        # the amount is flushed as an increment, a concurrent write to the same holding is not lost
+        self.portfolio_state.update(symbol=symbol, fields=holding, increments={"amount": amount})
 
     def remove_from_token_holding(self, symbol: str, token_address:str, amount: float, price: float, signal_timestamp:str, token_id: float) -> None:
         """
@@ -203,9 +216,8 @@ class StrategyGenerator:
         """
         
         try: 
-            portfolio = self.load_portfolio()
-            portfolio[symbol] = TokenHolding(symbol=symbol, token_address=token_address, amount=0.0, signal_price=price, signal_timestamp=signal_timestamp,last_price=price, token_id=token_id)
-            self.save_portfolio(portfolio=portfolio)
+            holding = TokenHolding(symbol=symbol, token_address=token_address, amount=0.0, signal_price=price, signal_timestamp=signal_timestamp,last_price=price, token_id=token_id)
+            self.save_portfolio(portfolio={symbol: holding})
         except Exception as e: 
             print(f"failed to close positon and remove: {symbol}")
         pass 
@@ -271,12 +283,14 @@ class StrategyGenerator:
         print(f"Agent is searching NFA database for metadata on: {symbol} \n")
 
         try:
-            symbol_id_list = self.mongo_db_handler.get_cmc_ids_by_symbols(symbol=symbol)
+            symbol_id_list = self.token_id_resolver.resolve(symbol)
 
             if len(symbol_id_list) < 1:
                 print(f"NFA database does not have symbol id for {symbol}\n")
                 symbol_id_list = self.token_prices.get_coinmarketcap_ids_by_symbol(slugs_list=[symbol])
                 print(f"{symbol} has an id:{symbol_id_list} souce: cmc api\n")
+                # the next signal on this symbol does not call the cmc api again
+                self.token_id_resolver.remember(symbol=symbol, ids=symbol_id_list)
                 
             token_data_list = self.token_prices.get_coinmarketcap_latest_token_stats(ids_list=symbol_id_list)
             allowlist_tokens = self.compliance_manager.evaluate_risk(token_stats=token_data_list)
@@ -284,9 +298,9 @@ class StrategyGenerator:
             token_address = allowlist_tokens["token_address"]
             token_id = allowlist_tokens["coinmarketcap_id"]
             if response_direction.lower() == "sell":
-                amount = -0.1 # test amount    
+                amount = -self.position_size
             else: 
-                amount = 0.1 # test amount
+                amount = self.position_size
             signal_price = allowlist_tokens["price_usd"]
 
             self.add_to_token_holding(symbol=symbol, token_address=token_address, amount=amount, price=signal_price, signal_timestamp=signal_timestamp, token_id=token_id)
@@ -387,13 +401,17 @@ class StrategyGenerator:
         portfolio = self.load_portfolio()
 
         portfolio_metrics = []
+
+        # one batched quotes request for every holding instead of one request per token
+        token_stats_by_id, _ = self.token_prices.get_coinmarketcap_quotes(ids_list=[self.portfolio_metrics_engine.normalize_token_id(holding["token_id"]) for holding in portfolio.values()])
+        # keep the quotes we already paid for as bars in the local price store used by SignalBacktester
+        self.price_store.record_coinmarketcap_snapshot(token_stats=list(token_stats_by_id.values()))
         
         for symbol, holding in portfolio.items():
             current_holding = portfolio[symbol]
 
             token_id = holding["token_id"]
-            token_data_list = self.token_prices.get_coinmarketcap_latest_token_stats(ids_list=[str(token_id)])
-            last_price = token_data_list[0]["price_usd"]
+            last_price = token_stats_by_id.get(self.portfolio_metrics_engine.normalize_token_id(token_id), {}).get("price_usd", holding.get('last_price'))
 
             current_holding.update({
                 "symbol": symbol,
@@ -406,144 +424,60 @@ class StrategyGenerator:
             })
 
 
-        portfolio_metrics = self.calculate_portfolio_metrics()
+        portfolio_metrics = self.calculate_portfolio_metrics(portfolio=portfolio, token_stats_by_id=token_stats_by_id)
 
-        # TODO find a way to use update_or_create_portfolio_v2() for the other updates 
-        self.mongo_db_handler.update_or_create_portfolio_v2(agent_id=self.joey_agent_object_id, portfolio_updates=portfolio, portfolio_metrics=portfolio_metrics)
+        # only the refreshed prices are written, holdings changed by another cycle meanwhile keep their amounts
+        self.save_portfolio(portfolio={symbol: {"last_price": holding["last_price"]} for symbol, holding in portfolio.items()}, portfolio_metrics=portfolio_metrics)
        
-    def save_portfolio(self, portfolio: Dict, portfolio_metrics: Optional[dict] = None):
-        existing_data = self.load_portfolio()
-        new_data = []
+    def save_portfolio(self, portfolio: Dict, portfolio_metrics: Optional[List[Any]] = None) -> None:
+        """
+        Apply the given holding fields (and metrics) to the in memory portfolio.
 
-        for symbol, holding in portfolio.items():
-            if symbol in existing_data:
-
-                current_holding = existing_data[symbol]
-                current_amount = current_holding['amount']
-                updated_amount = current_holding['amount']
-                if updated_amount > 0:
-
-                    # TODO check if average price is really needed here, this should be done in add_to_token_holding
-                    average_price = (
-                        (current_holding['amount'] * current_holding['last_price'] +
-                        holding['amount'] * holding['last_price']) / updated_amount
-                    )
-                    current_holding.update({
-                        "amount": updated_amount,
-                        # "last_price": average_price,
-                        "last_price": holding['last_price'],
-                        "signal_price": holding.get('signal_price', current_holding['signal_price']),
-                        "signal_timestamp": holding.get('signal_timestamp', current_holding['signal_timestamp']),
-                    })
-                    
-                else:
-                    # del existing_data[symbol]
-                    # new logic for selling 
-                    current_holding.update({
-                        "amount": updated_amount,
-                        # "last_price": average_price,
-                        "last_price": holding['last_price'],
-                        "signal_price": holding.get('signal_price', current_holding['signal_price']),
-                        "signal_timestamp": holding.get('signal_timestamp', current_holding['signal_timestamp']),
-                    })
-
-            # elif holding['amount'] > 0:
-            #     # Add new token if it doesn't already exist
-            #     existing_data[symbol] = {
-            #         "symbol": symbol,
-            #         "token_address": holding['token_address'],
-            #         "token_id": holding['token_id'],
-            #         "amount": holding['amount'],
-            #         "signal_price": holding['signal_price'],
-            #         "signal_timestamp": holding['signal_timestamp'],
-            #         "last_price": holding['last_price'],
-            #     }
-        
-            else:
-                # Add new token if it doesn't already exist
-                existing_data[symbol] = {
-                    "symbol": symbol,
-                    "token_address": holding['token_address'],
-                    "token_id": holding['token_id'],
-                    "amount": holding['amount'],
-                    "signal_price": holding['signal_price'],
-                    "signal_timestamp": holding['signal_timestamp'],
-                    "last_price": holding['last_price'],
-                }
+        Only the symbols and fields in portfolio are changed, PortfolioState writes them to mongodb
+        with the next flush.
 
-        self.mongo_db_handler.update_or_create_portfolio(agent_id=self.joey_agent_object_id, portfolio_updates=existing_data)
+        Parameters
+        ----------
+        portfolio : Dict
+            Fields to set keyed by symbol, full TokenHolding records or partial updates.
+        portfolio_metrics : Optional[List[Any]]
+            Portfolio performance metrics, left untouched when None.
+        """
+        for symbol, holding in portfolio.items():
+            self.portfolio_state.update(symbol=symbol, fields=holding)
+        if portfolio_metrics is not None:
+            self.portfolio_state.set_metrics(portfolio_metrics)
 
     def load_portfolio(self) -> Dict:
-        portfolio_holdings = self.mongo_db_handler.get_portfolio_details(agent_id=str(self.joey_agent_object_id))
-        return portfolio_holdings
+        return self.portfolio_state.holdings()
 
-    def calculate_portfolio_metrics(self) -> List[Any]:
+    def calculate_portfolio_metrics(self, portfolio: Optional[Dict] = None, token_stats_by_id: Optional[Dict[str, Dict]] = None) -> List[Any]:
         """
         Calculate and return portfolio performance metrics.
+
+        Parameters
+        ----------
+        portfolio : Optional[Dict]
+            Holdings keyed by symbol, loaded from mongodb when not provided.
+        token_stats_by_id : Optional[Dict[str, Dict]]
+            Latest token stats keyed by Coinmarketcap id, fetched in one batched request when not provided.
         
         Returns
         -------
-        metrics_df : pl.DataFrame
-            A DataFrame containing performance metrics for each token.
+        List[Any]
+            A list of performance metric records, one per token.
         """
-        metrics_list = []
-
-        current_time = datetime.now()
-
-        portfolio = self.load_portfolio()
-
-        for symbol, holding in portfolio.items():
-            amount = holding['amount']
-            signal_price = holding['signal_price']
-            last_price = holding['last_price']
-            signal_timestamp = datetime.strptime(holding['signal_timestamp'], "%Y-%m-%d %H:%M:%S")
-
-            # cumulative_return = (last_price - signal_price) / signal_price
-            cumulative_return = ((last_price - signal_price) / signal_price) * np.sign(amount)
-
-            holding_days = max((current_time - signal_timestamp).days, 1)  # Avoid division by zero
-            daily_return = cumulative_return / holding_days
-
-            token_id = holding["token_id"]
-            token_data_list = self.token_prices.get_coinmarketcap_latest_token_stats(ids_list=[str(token_id)])
-            latest_price = float(token_data_list[0]["price_usd"])
-
-            percent_change_7d = float(token_data_list[0]["percent_change_7d"])
-            token_returns = self.token_prices.get_weekly_returns(current_price=latest_price, percent_change_7d=percent_change_7d)
-            returns = token_returns.pct_change().drop_nulls()
-            returns_mean = returns.mean() if not returns.is_empty() else 0.0
-            volatility = returns.std() if not returns.is_empty() else 0.0
-
-            returns_mean = returns_mean if returns_mean is not None else 0.0
-            volatility = volatility if volatility is not None else 0.0
-
-            sharpe_ratio = returns_mean / volatility if volatility != 0 else 0.0
-
-            max_price = max(signal_price, last_price)
-            min_price = min(signal_price, last_price)
-            max_drawdown = (max_price - min_price) / max_price
-
-            pnl = (last_price - signal_price) * amount
+        if portfolio is None:
+            portfolio = self.load_portfolio()
 
-            metrics_list.append({
-                "symbol": symbol,
-                "signal_price": signal_price,
-                "last_price": last_price,
-                "token_amount": amount,
-                "PnL": pnl,
-                "cumulative_return": cumulative_return,
-                "daily_return": daily_return,
-                "volatility": volatility,
-                "sharpe_ratio": sharpe_ratio,
-                "max_drawdown": max_drawdown,
-                "holding_duration_days": holding_days
-            })
+        if token_stats_by_id is None:
+            token_stats_by_id, _ = self.token_prices.get_coinmarketcap_quotes(ids_list=[self.portfolio_metrics_engine.normalize_token_id(holding["token_id"]) for holding in portfolio.values()])
 
-        metrics_df = pl.DataFrame(metrics_list)
+        metrics_df = self.portfolio_metrics_engine.calculate(portfolio=portfolio, token_stats_by_id=token_stats_by_id)
         print(metrics_df)
         metrics_df.write_csv("portfolio_metrics.csv")
 
-        return metrics_list
+        return metrics_df.to_dicts()
 
     def save_model_trade_generation_process(self, content: Dict) -> None:
         current_date = datetime.now()
@@ -1,22 +1,119 @@
 import random
 import math
 import json
-from typing import Dict
+import threading
+from typing import Dict, Optional, Tuple
 from typing_extensions import List
 
+import numpy as np
 import polars as pl
+from numpy.typing import ArrayLike
 from requests import Request, Session
-from requests.exceptions import ConnectionError, Timeout, TooManyRedirects
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout, TooManyRedirects, RetryError
+from urllib3.util.retry import Retry
 
 from config.config import DataProviders
+from backtesting.quote_cache import QuoteCache
 
 class TokenPrices:
+    # one keep-alive session per process, shared by every TokenPrices instance
+    _session: Optional[Session] = None
+    _session_lock = threading.Lock()
+
+    # horizon -> (number of steps in the implied price path, length of a step in days)
+    RETURN_HORIZONS: Dict[str, Tuple[int, float]] = {
+        "1h": (1, 1 / 24),
+        "24h": (24, 1 / 24),
+        "7d": (7, 1),
+        "30d": (30, 1),
+    }
+
     def __init__(self):
         self.data_providers = DataProviders()
         self.coinmarketcap_api_key = self.data_providers.COINMARKET_CAP_API_KEY
+        self.quotes_url = self.data_providers.COINMARKET_CAP_QUOTES_URL
+        self.max_quotes_per_request = self.data_providers.COINMARKET_CAP_MAX_QUOTES_PER_REQUEST
+        self.request_timeout = self.data_providers.HTTP_TIMEOUT_SECONDS
+        self.session = self.get_session(data_providers=self.data_providers)
+        self.quote_cache = QuoteCache.shared()
     
     # def get_token_address(self) -> str:
     #     return "0x"
+
+    @classmethod
+    def get_session(cls, data_providers: Optional[DataProviders] = None) -> Session:
+        """
+        Return the process wide Coinmarketcap session, creating it on first use.
+
+        The session keeps connections alive in a pool of HTTP_POOL_SIZE connections and retries
+        429/5xx responses with exponential backoff (honouring Retry-After), so repeated quote
+        requests reuse the same TCP+TLS connection instead of paying a new handshake each time.
+
+        Parameters
+        ----------
+        data_providers : Optional[DataProviders]
+            Settings used to build the session, defaults to DataProviders().
+
+        Returns
+        -------
+        Session
+            The shared requests session.
+        """
+        with cls._session_lock:
+            if cls._session is None:
+                settings = data_providers or DataProviders()
+                cls._session = cls.build_session(data_providers=settings, headers={
+                    'Accepts': 'application/json',
+                    'X-CMC_PRO_API_KEY': settings.COINMARKET_CAP_API_KEY,
+                })
+            return cls._session
+
+    @staticmethod
+    def build_session(data_providers: DataProviders, headers: Optional[Dict[str, str]] = None) -> Session:
+        """
+        Build a keep-alive session with a pool of HTTP_POOL_SIZE connections retrying 429/5xx GETs with backoff.
+
+        Parameters
+        ----------
+        data_providers : DataProviders
+            Pool and retry settings.
+        headers : Optional[Dict[str, str]]
+            Default headers of every request, provider API keys only go to the session of their provider.
+
+        Returns
+        -------
+        Session
+            The new session.
+        """
+        retry = Retry(
+            total=data_providers.HTTP_MAX_RETRIES,
+            backoff_factor=data_providers.HTTP_BACKOFF_FACTOR,
+            status_forcelist=data_providers.HTTP_RETRY_STATUS_CODES,
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=data_providers.HTTP_POOL_SIZE,
+            pool_maxsize=data_providers.HTTP_POOL_SIZE,
+            max_retries=retry,
+        )
+        session = Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(headers or {})
+        return session
+
+    @classmethod
+    def close_session(cls) -> None:
+        """
+        Close the shared session and release its pooled connections.
+        """
+        with cls._session_lock:
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
     
     def get_weekly_returns(self, current_price: float, percent_change_7d: float) -> pl.Series:
         """
@@ -35,152 +132,222 @@ class TokenPrices:
         pl.Series
             A polars Series of daily prices from 7 days ago to the current day.
         """
-        
-        daily_percent_change = (math.pow(1 + percent_change_7d / 100, 1/7) - 1) * 100
-        
-        daily_prices = [current_price]
-        for _ in range(7):
-            prev_price = daily_prices[-1]
-            new_price = prev_price / (1 + daily_percent_change / 100)
-            daily_prices.append(new_price)
-        
-        return pl.Series("daily_prices", list(reversed(daily_prices)))
-    
-    def get_coinmarketcap_latest_token_stats(self, ids_list:List[str]) -> List[Dict]:
-        
-        # url = 'https://sandbox-api.coinmarketcap.com/v2/cryptocurrency/quotes/latest'
-        url = 'https://pro-api.coinmarketcap.com/v2/cryptocurrency/quotes/latest'
+        daily_prices, _ = self.get_implied_price_paths(current_prices=[current_price], percent_changes=[percent_change_7d], horizon="7d")
+        return pl.Series("daily_prices", daily_prices[0])
 
-        token_id_list_to_str = ",".join(ids_list)
-        # token_id_list_to_str = ",".join(f"{int(token_id)}" for token_id in ids_list)
+    def get_implied_price_paths(self, current_prices: ArrayLike, percent_changes: ArrayLike, horizon: str = "7d") -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Build the implied price path of many tokens at once from their latest price and percent change.
 
-        parameters = {
-            "id": token_id_list_to_str
-        }
+        Each path is the closed form geometric progression price_k = current_price * growth^(k - periods),
+        where growth = (1 + percent_change / 100)^(1 / periods), so no per token Python loop is needed.
 
-        headers = {
-            'Accepts': 'application/json',
-            'X-CMC_PRO_API_KEY': self.coinmarketcap_api_key,
+        Parameters
+        ----------
+        current_prices : ArrayLike
+            Latest price of each token.
+        percent_changes : ArrayLike
+            Percent change of each token over the horizon (the CMC percent_change_<horizon> field).
+        horizon : str, optional
+            One of RETURN_HORIZONS ("1h", "24h", "7d", "30d"), by default "7d". 1h and 24h paths are
+            built with hourly steps, 7d and 30d paths with daily steps.
+
+        Returns
+        -------
+        Tuple[np.ndarray, Dict[str, np.ndarray]]
+            A (tokens, periods + 1) matrix of prices ordered from the start of the horizon to now, and
+            per token return statistics: period_return, total_return, daily_return, annualized_return.
+        """
+        if horizon not in self.RETURN_HORIZONS:
+            raise ValueError(f"Unsupported horizon {horizon}, expected one of {list(self.RETURN_HORIZONS)}")
+
+        periods, period_days = self.RETURN_HORIZONS[horizon]
+        current_prices = np.asarray(current_prices, dtype=np.float64)
+        total_return = np.asarray(percent_changes, dtype=np.float64) / 100
+
+        growth = np.power(1 + total_return, 1 / periods)
+        exponents = np.arange(-periods, 1, dtype=np.float64)
+        prices = current_prices[:, np.newaxis] * np.power(growth[:, np.newaxis], exponents[np.newaxis, :])
+
+        horizon_days = periods * period_days
+        return_stats = {
+            "period_return": growth - 1,
+            "total_return": total_return,
+            "daily_return": np.power(1 + total_return, 1 / horizon_days) - 1,
+            "annualized_return": np.power(1 + total_return, 365 / horizon_days) - 1,
         }
+        return prices, return_stats
 
-        session = Session()
+    def get_horizon_return_statistics(self, token_stats: pl.DataFrame) -> pl.DataFrame:
+        """
+        Derive return statistics for many tokens from all the horizons in the CMC payload.
 
-        session.headers.update(headers)
+        Every percent_change_<horizon> column is converted into an implied daily log return; their mean
+        is the expected daily return and their dispersion across horizons is used as a volatility proxy,
+        since a single closed form path has no variance of its own.
 
-        token_stats_list = []
+        Parameters
+        ----------
+        token_stats : pl.DataFrame
+            Token stats with percent_change_1h, percent_change_24h, percent_change_7d and percent_change_30d columns.
 
-        try:
-            response = session.get(url, params=parameters)
-            data = json.loads(response.text)
-            if data["status"]["error_code"] == 0:
-                for token_id in range(len(ids_list)):
-                    token_stats_dict = {
-                        "coinmarketcap_id": data["data"][ids_list[token_id]]["id"],
-                        "symbol": data["data"][ids_list[token_id]]["symbol"],
-                        "price_usd": data["data"][ids_list[token_id]]["quote"]["USD"]["price"],
-                        "volume_24h": data["data"][ids_list[token_id]]["quote"]["USD"]["volume_24h"],
-                        "volume_change_24h": data["data"][ids_list[token_id]]["quote"]["USD"]["volume_change_24h"],
-                        "percent_change_1h": data["data"][ids_list[token_id]]["quote"]["USD"]["percent_change_1h"],
-                        "percent_change_24h": data["data"][ids_list[token_id]]["quote"]["USD"]["percent_change_24h"],
-                        "percent_change_7d": data["data"][ids_list[token_id]]["quote"]["USD"]["percent_change_7d"],
-                        "percent_change_30d": data["data"][ids_list[token_id]]["quote"]["USD"]["percent_change_30d"],
-                        "marketcap": data["data"][ids_list[token_id]]["quote"]["USD"]["market_cap"],
-                        # TODO add token address to token_stats_dict
-                        "token_address": "0x333"
-                    }
-                    token_stats_list.append(token_stats_dict)
-            else:
-                print(f"get_coinmarketcap_latest_token_stats() Coinmetrics API encountered error: {data["status"]["error_message"]}")
-        except (ConnectionError, Timeout, TooManyRedirects) as e:
-            print(f"Failed to load prices from Coinmarketcap endpoint v2/cryptocurrency/quotes/latest: {e} \n")
+        Returns
+        -------
+        pl.DataFrame
+            token_stats with daily_return_<horizon>, mean_daily_return, volatility and sharpe_ratio columns added.
+        """
+        horizon_columns = []
+        for horizon, (periods, period_days) in self.RETURN_HORIZONS.items():
+            column = f"percent_change_{horizon}"
+            if column not in token_stats.columns:
+                continue
+            horizon_days = periods * period_days
+            horizon_columns.append(f"daily_return_{horizon}")
+            token_stats = token_stats.with_columns(
+                ((1 + pl.col(column).cast(pl.Float64) / 100).log() / horizon_days).alias(f"daily_return_{horizon}")
+            )
 
+        if not horizon_columns:
+            raise ValueError("token_stats has no percent_change_<horizon> columns")
+
+        return token_stats.with_columns(
+            pl.mean_horizontal(horizon_columns).alias("mean_daily_return"),
+            pl.concat_list(horizon_columns).list.std().fill_null(0.0).alias("volatility"),
+        ).with_columns(
+            pl.when(pl.col("volatility") != 0)
+            .then(pl.col("mean_daily_return") / pl.col("volatility"))
+            .otherwise(0.0)
+            .alias("sharpe_ratio")
+        )
     
-        return token_stats_list
-    
-    def get_coinmarketcap_latest_token_stats_by_slug(self, slugs_list:List[str]) -> List[Dict]:
-        
-        # url = 'https://sandbox-api.coinmarketcap.com/v2/cryptocurrency/quotes/latest'
-        url = 'https://pro-api.coinmarketcap.com/v2/cryptocurrency/quotes/latest'
+    def get_coinmarketcap_quotes(self, ids_list: Optional[List[str]] = None, symbols_list: Optional[List[str]] = None) -> Tuple[Dict[str, Dict], Dict[str, List[Dict]]]:
+        """
+        Fetch latest quotes for many ids and symbols with as few quotes/latest requests as possible.
 
-        token_slug_list_to_str = ",".join(slugs_list)
+        Coinmarketcap accepts either an id list or a symbol list per request, so ids and symbols are
+        de-duplicated and sent as (at most) one comma separated request each, split into chunks of
+        COINMARKET_CAP_MAX_QUOTES_PER_REQUEST. Ids still fresh in the shared QuoteCache are not requested
+        again, and every fetched quote (including symbol lookups) is written back to the cache.
 
-        parameters = {
-            "symbol": token_slug_list_to_str
-        }
+        Parameters
+        ----------
+        ids_list : Optional[List[str]]
+            Coinmarketcap ids to quote.
+        symbols_list : Optional[List[str]]
+            Token symbols to quote.
 
-        headers = {
-            'Accepts': 'application/json',
-            'X-CMC_PRO_API_KEY': self.coinmarketcap_api_key,
-        }
+        Returns
+        -------
+        Tuple[Dict[str, Dict], Dict[str, List[Dict]]]
+            Token stats keyed by coinmarketcap id, and lists of token stats keyed by symbol
+            (a symbol can map to several Coinmarketcap listings).
+        """
+        stats_by_id: Dict[str, Dict] = {}
+        stats_by_symbol: Dict[str, List[Dict]] = {}
 
-        session = Session()
+        unique_ids = list(dict.fromkeys(str(token_id) for token_id in ids_list or []))
+        unique_symbols = list(dict.fromkeys(symbols_list or []))
 
-        session.headers.update(headers)
+        cached_stats, missing_ids = self.quote_cache.get_many(unique_ids)
+        stats_by_id.update(cached_stats)
+        fetched_stats: Dict[str, Dict] = {}
 
-        token_stats_list = []
+        for chunk in self._chunk(missing_ids):
+            data = self._request_quotes(parameters={"id": ",".join(chunk)}, caller="get_coinmarketcap_quotes()")
+            for token_id, token in data.items():
+                fetched_stats[str(token_id)] = self._format_token_stats(token=token, token_address="0x333")
 
-        try:
-            response = session.get(url, params=parameters)
-            data = json.loads(response.text)
-            if data["status"]["error_code"] == 0:
-                for token_id in range(len(slugs_list)):
-                    token_stats_dict = {
-                        "coinmarketcap_id": data["data"][slugs_list[token_id]]["id"],
-                        "symbol": data["data"][slugs_list[token_id]]["symbol"],
-                        "price_usd": data["data"][slugs_list[token_id]]["quote"]["USD"]["price"],
-                        "volume_24h": data["data"][slugs_list[token_id]]["quote"]["USD"]["volume_24h"],
-                        "volume_change_24h": data["data"][slugs_list[token_id]]["quote"]["USD"]["volume_change_24h"],
-                        "percent_change_1h": data["data"][slugs_list[token_id]]["quote"]["USD"]["percent_change_1h"],
-                        "percent_change_24h": data["data"][slugs_list[token_id]]["quote"]["USD"]["percent_change_24h"],
-                        "percent_change_7d": data["data"][slugs_list[token_id]]["quote"]["USD"]["percent_change_7d"],
-                        "percent_change_30d": data["data"][slugs_list[token_id]]["quote"]["USD"]["percent_change_30d"],
-                        "marketcap": data["data"][slugs_list[token_id]]["quote"]["USD"]["market_cap"],
-                        # TODO add token address to token_stats_dict
-                        "token_address": "0x"
-                    }
-                    token_stats_list.append(token_stats_dict)
-            else:
-                print(f"get_coinmarketcap_latest_token_stats_by_slug() Coinmetrics API encountered error: {data["status"]["error_message"]}")
-        except (ConnectionError, Timeout, TooManyRedirects) as e:
-            print(f"Failed to load prices from Coinmarketcap endpoint v2/cryptocurrency/quotes/latest: {e} \n")
+        for chunk in self._chunk(unique_symbols):
+            data = self._request_quotes(parameters={"symbol": ",".join(chunk)}, caller="get_coinmarketcap_quotes()")
+            for symbol, tokens in data.items():
+                # v2 returns a list of listings per symbol, v1 a single listing
+                tokens = tokens if isinstance(tokens, list) else [tokens]
+                stats_by_symbol[symbol] = [self._format_token_stats(token=token, token_address="0x") for token in tokens]
+                for token_stats in stats_by_symbol[symbol]:
+                    fetched_stats.setdefault(str(token_stats["coinmarketcap_id"]), token_stats)
+
+        self.quote_cache.set_many(fetched_stats)
+        stats_by_id.update({token_id: fetched_stats[token_id] for token_id in missing_ids if token_id in fetched_stats})
+
+        return stats_by_id, stats_by_symbol
 
+    def get_coinmarketcap_latest_token_stats(self, ids_list:List[str]) -> List[Dict]:
+        stats_by_id, _ = self.get_coinmarketcap_quotes(ids_list=ids_list)
+        return [stats_by_id[str(token_id)] for token_id in ids_list if str(token_id) in stats_by_id]
     
-        return token_stats_list
+    def get_coinmarketcap_latest_token_stats_by_slug(self, slugs_list:List[str]) -> List[Dict]:
+        _, stats_by_symbol = self.get_coinmarketcap_quotes(symbols_list=slugs_list)
+        return [stats_by_symbol[slug][0] for slug in slugs_list if stats_by_symbol.get(slug)]
     
     def get_coinmarketcap_ids_by_symbol(self, slugs_list:List[str]) -> List[str]:
-        
-        # url = 'https://sandbox-api.coinmarketcap.com/v2/cryptocurrency/quotes/latest'
-        url = 'https://pro-api.coinmarketcap.com/v2/cryptocurrency/quotes/latest'
+        _, stats_by_symbol = self.get_coinmarketcap_quotes(symbols_list=slugs_list)
+        return [str(token["coinmarketcap_id"]) for tokens in stats_by_symbol.values() for token in tokens]
 
-        token_slug_list_to_str = ",".join(slugs_list)
+    def _chunk(self, values: List[str]) -> List[List[str]]:
+        size = max(int(self.max_quotes_per_request), 1)
+        return [values[i:i + size] for i in range(0, len(values), size)]
 
-        parameters = {
-            "symbol": token_slug_list_to_str
-        }
-
-        headers = {
-            'Accepts': 'application/json',
-            'X-CMC_PRO_API_KEY': self.coinmarketcap_api_key,
-        }
+    def get_coinmarketcap_listings_frame(self, limit: int = 5000) -> pl.DataFrame:
+        """
+        Fetch the latest Coinmarketcap listing in one request, used to screen the whole token universe.
 
-        session = Session()
+        Parameters
+        ----------
+        limit : int, optional
+            Number of listings to fetch ordered by market cap, by default 5000.
 
-        session.headers.update(headers)
+        Returns
+        -------
+        pl.DataFrame
+            One row of token stats per listing, same fields as get_coinmarketcap_latest_token_stats().
+        """
+        data = self._request_quotes(
+            parameters={"limit": str(limit), "convert": "USD"},
+            caller="get_coinmarketcap_listings_frame()",
+            url=self.data_providers.COINMARKET_CAP_LISTINGS_URL,
+        )
+        token_stats_list = [self._format_token_stats(token=token, token_address="0x") for token in data or []]
+        stats_by_id = {str(token_stats["coinmarketcap_id"]): token_stats for token_stats in token_stats_list}
+        self.quote_cache.set_many(stats_by_id)
+        return pl.DataFrame(token_stats_list, infer_schema_length=None)
 
-        coinmarket_cap_id_list = []
+    def _request_quotes(self, parameters: Dict[str, str], caller: str, url: Optional[str] = None) -> Dict:
+        """
+        Send one quotes/latest (or listings/latest) request over the shared session.
 
+        Returns
+        -------
+        Dict
+            The "data" payload of the response, empty if the request failed.
+        """
         try:
-            response = session.get(url, params=parameters)
+            response = self.session.get(url or self.quotes_url, params=parameters, timeout=self.request_timeout)
             data = json.loads(response.text)
             if data["status"]["error_code"] == 0:
-                for symbol, tokens in data["data"].items():
-                    for token in tokens:
-                        coinmarket_cap_id_list.append(str(token["id"]))
-            else:
-                print(f"get_coinmarketcap_latest_token_stats_by_symbol() Coinmetrics API encountered error: {data["status"]["error_message"]}")
-        except (ConnectionError, Timeout, TooManyRedirects) as e:
+                return data["data"]
+            print(f"{caller} Coinmetrics API encountered error: {data['status']['error_message']}")
+        except (ConnectionError, Timeout, TooManyRedirects, RetryError) as e:
             print(f"Failed to load prices from Coinmarketcap endpoint v2/cryptocurrency/quotes/latest: {e} \n")
+        except (ValueError, KeyError) as e:
+            print(f"{caller} unable to parse Coinmarketcap response: {e} \n")
+        return {}
 
-    
-        return coinmarket_cap_id_list
-    
\ No newline at end of file
+    @staticmethod
+    def _format_token_stats(token: Dict, token_address: str) -> Dict:
+        usd_quote = token["quote"]["USD"]
+        return {
+            "coinmarketcap_id": token["id"],
+            "symbol": token["symbol"],
+            "price_usd": usd_quote["price"],
+            "volume_24h": usd_quote["volume_24h"],
+            "volume_change_24h": usd_quote["volume_change_24h"],
+            "volume_7d": usd_quote.get("volume_7d"),
+            "volume_30d": usd_quote.get("volume_30d"),
+            "percent_change_1h": usd_quote["percent_change_1h"],
+            "percent_change_24h": usd_quote["percent_change_24h"],
+            "percent_change_7d": usd_quote["percent_change_7d"],
+            "percent_change_30d": usd_quote["percent_change_30d"],
+            "marketcap": usd_quote["market_cap"],
+            # TODO add token address to token_stats_dict
+            "token_address": token_address
+        }
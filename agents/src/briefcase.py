@@ -6,18 +6,25 @@ if __name__ == "__main__":
 
     listener_process = diana.start_listener()
 
+    # runs every scheduled agent on its own interval, the loop below only refreshes which agents are scheduled
+    diana.start_scheduler()
+
+    # NFA tweets, opportunities and tokens reach the knowledge base as soon as they are written
+    knowledge_ingestion = diana.start_knowledge_ingestion()
+
+    # market data expires from the short term memory, expired documents are deleted in the background
+    memory_compactor = diana.start_memory_compactor()
+
     while True:
         try:
             diana.api_cool_down()
             if not listener_process.is_alive():
                 listener_process = diana.start_listener()
 
-            chroma_db_doc_ids = diana.update_knowledge_base()
+            diana.update_knowledge_base()
     
             diana.start()
 
-            diana.clean_agent_workspace(content=chroma_db_doc_ids)
-
             diana.api_cool_down()
 
         except Exception as e:
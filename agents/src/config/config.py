@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 @dataclass
 class TwitterApiConsts: 
@@ -51,6 +51,8 @@ class KnowledgeBaseFilePaths:
 @dataclass
 class GeneratedTradesFilePaths:
     SAMPLE_TRADE:str = ""
+    # signals written by StrategyGenerator.save_model_trade_generation_process(), replayed by SignalBacktester
+    GENERATED_TRADES_GLOB:str = "generated_trades_for_testing-*.json"
     
     @classmethod
     def get_generated_trades_file_paths(cls) -> List[str]:
@@ -70,6 +72,42 @@ class OpenAiConsts:
     OPEN_AI_SECRET_KEY:str = ""
     DEFAULT_EMBEDDING_MODEL:str = "text-embedding-3-small" 
     DEFAULT_MODEL_NAME:str = "gpt-4o-mini"
+    # backend of rag.embedding_service, "openai" (DEFAULT_EMBEDDING_MODEL) or "onnx" (LocalEmbeddingConsts)
+    # the backends' vectors differ in size, chroma collections embedded with one fail to open with the other and have to be re-embedded after a switch
+    EMBEDDING_BACKEND:str = "openai"
+
+@dataclass
+class LocalEmbeddingConsts:
+    MODEL_NAME:str = "all-MiniLM-L6-v2"
+    # directory with model.onnx and tokenizer.json, "" uses the MODEL_NAME export chromadb downloads to ~/.cache/chroma
+    MODEL_DIRECTORY:str = ""
+    BATCH_SIZE:int = 64
+    MAX_SEQ_LENGTH:int = 256
+    # onnxruntime threads per batch, 0 uses every core
+    INTRA_OP_THREADS:int = 0
+    # int8 dynamic quantization of the weights, requires the onnx package
+    QUANTIZE_INT8:bool = False
+
+@dataclass
+class EmbeddingServiceConsts:
+    # request coalescing of rag.embedding_service, texts submitted within COALESCE_WINDOW_SECONDS share one request
+    COALESCE_WINDOW_SECONDS:float = 0.01
+    # OpenAI limits of a single embeddings request, tokens are estimated at 4 characters per token
+    MAX_BATCH_INPUTS:int = 2048
+    MAX_BATCH_TOKENS:int = 250000
+    MAX_CONCURRENT_REQUESTS:int = 4
+    # SchedulerConsts.RATE_LIMITS bucket every OpenAI embeddings request draws from
+    RATE_LIMIT_PROVIDER:str = "openai_embeddings"
+
+@dataclass
+class EmbeddingCacheConsts:
+    # embeddings of rag.embedding_service keyed by (model, sha256 of the text), set PATH to "" to keep them in memory only
+    ENABLED:bool = True
+    PATH:str = "./embedding_cache.sqlite3"
+    # size cap of the stored float32 vectors, least recently used vectors are evicted first
+    MAX_BYTES:int = 1024 * 1024 * 1024
+    # most recently used vectors also held in memory
+    MEMORY_ENTRIES:int = 10000
 
 @dataclass 
 class MFAMongodbConsts: 
@@ -87,6 +125,72 @@ class PrivexMongodbConsts:
     DB_NAME:str = ""
     PRIVEX_MONGDB_URI:str = ""
 
+@dataclass
+class MongoClientConsts:
+    # pool settings of the process wide clients shared by every MongoDBHandler, see rag.mongo_client_registry
+    MAX_POOL_SIZE:int = 50
+    MIN_POOL_SIZE:int = 0
+    MAX_IDLE_TIME_MS:int = 300000
+    CONNECT_TIMEOUT_MS:int = 10000
+    SERVER_SELECTION_TIMEOUT_MS:int = 10000
+
+@dataclass
+class PortfolioStateConsts:
+    # write-behind settings of the in memory agent portfolios, see backtesting.portfolio_state
+    FLUSH_INTERVAL_SECONDS:float = 30
+    WATCH_CHANGES:bool = True
+
+@dataclass
+class NfaIngestionConsts:
+    # high-water marks of the incremental NFA ingestion, see rag.ingestion_checkpoint
+    CHECKPOINT_COLLECTION_NAME:str = "ingestion_checkpoints"
+    BATCH_SIZE:int = 500
+
+@dataclass
+class ChromaConsts:
+    # directory of the persistent chroma store, opened once per process by rag.chroma_registry
+    PERSIST_DIRECTORY:str = "./chroma_langchain_db"
+
+@dataclass
+class ShortTermMemoryConsts:
+    # TTL tagged market memory, see ChromaVectorStoreManager.remember(), searches stop returning a document once it expired
+    TTL_SECONDS:float = 30 * 60
+    # rag.memory_compactor deletes the expired documents of COLLECTION_NAMES (every collection when empty) in bulk every COMPACTION_INTERVAL_SECONDS
+    COLLECTION_NAMES:List[str] = field(default_factory=list)
+    COMPACTION_INTERVAL_SECONDS:float = 5 * 60
+    COMPACTION_BATCH_SIZE:int = 1000
+
+@dataclass
+class KnowledgeIngestionConsts:
+    # NFA collections streamed into chroma by rag.knowledge_ingestion, and the chroma "source" metadata of each
+    SOURCES:Dict[str, str] = field(default_factory=lambda: {
+        "twitterposts": "twitter_posts",
+        "opportunities": "nfa_opportunities",
+        "tokens": "nfa_tokens",
+    })
+    CHROMA_COLLECTION_NAME:str = "DIANA"
+    # documents embedded per request, a partial batch is embedded after BATCH_WAIT_SECONDS
+    BATCH_SIZE:int = 64
+    BATCH_WAIT_SECONDS:float = 2
+
+@dataclass
+class ChangeStreamConsts:
+    # resumable change stream listeners, see rag.change_stream_listener
+    RESUME_TOKENS_COLLECTION_NAME:str = "change_stream_resume_tokens"
+    # worker threads shared by every subscription of a listener
+    MAX_WORKERS:int = 4
+    # batches of a subscription handed to the workers but not finished yet, the stream is not read further while at the limit
+    MAX_IN_FLIGHT_BATCHES:int = 4
+    BATCH_SIZE:int = 32
+    BATCH_WAIT_SECONDS:float = 1
+    RETRY_SECONDS:float = 5
+    # calls of handle_batch per batch before the stream is reopened from the last handled batch, waiting HANDLE_RETRY_SECONDS doubled after each failure
+    HANDLE_ATTEMPTS:int = 3
+    HANDLE_RETRY_SECONDS:float = 1
+    # reopenings from the same resume token before the failing batch is moved to DEAD_LETTERS_COLLECTION_NAME and skipped
+    MAX_BATCH_REDELIVERIES:int = 3
+    DEAD_LETTERS_COLLECTION_NAME:str = "change_stream_dead_letters"
+
 
 # Use these prompts as examples on how to set up your agent
 @dataclass
@@ -216,6 +320,10 @@ class HubPull:
     GENERATE_TRADES_CALL_LIMIT: float = 6
     DOUBLE_DOWN:bool = False
 
+    # risk rules compiled by backtesting.risk_rules.RiskPolicy, overridden by agent_settings "riskPolicy"
+    # an empty list uses the default ComplianceManager thresholds
+    RISK_POLICY:List[Dict] = field(default_factory=list)
+
     @classmethod
     def get_agent_tasks(cls) -> List[str]:
         """
@@ -249,6 +357,11 @@ class Backtester:
     Answer:
     """
     OPPORTUNITY_SEARCH_PROMPT:str = "what tokens are trending? what are some good tokens to buy ,sell, or continue holding?"
+
+    # size of the position opened for every generated trade (negative for sells), and how long
+    # replayed positions are held by SignalBacktester, both swept by backtesting.parameter_sweep
+    POSITION_SIZE:float = 0.1
+    HOLDING_DAYS:float = 7
     
     @classmethod
     def get_agent_47_protocol_index_cmc_ids(cls) -> List[str]:
@@ -346,6 +459,52 @@ class Backtester:
 @dataclass
 class DataProviders:
     COINMARKET_CAP_API_KEY:str = ""
+    COINMARKET_CAP_QUOTES_URL:str = "https://pro-api.coinmarketcap.com/v2/cryptocurrency/quotes/latest"
+    COINMARKET_CAP_LISTINGS_URL:str = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/listings/latest"
+    # max ids/symbols per quotes/latest request, larger lists are split into chunks of this size
+    COINMARKET_CAP_MAX_QUOTES_PER_REQUEST:int = 100
+
+    # process wide quote cache shared by every agent, set COINMARKET_CAP_QUOTE_CACHE_PATH to a sqlite file to keep quotes across restarts
+    COINMARKET_CAP_QUOTE_CACHE_TTL_SECONDS:float = 60
+    COINMARKET_CAP_QUOTE_CACHE_MAX_ENTRIES:int = 5000
+    COINMARKET_CAP_QUOTE_CACHE_PATH:str = ""
+
+    # shared HTTP session settings used by TokenPrices
+    HTTP_POOL_SIZE:int = 20
+    HTTP_MAX_RETRIES:int = 3
+    HTTP_BACKOFF_FACTOR:float = 0.5
+    HTTP_RETRY_STATUS_CODES:tuple = (429, 500, 502, 503, 504)
+    HTTP_TIMEOUT_SECONDS:float = 10
+
+    # daily Coinmetrics history used to fill the local price store
+    COINMETRICS_API_KEY:str = ""
+    COINMETRICS_ASSET_METRICS_URL:str = "https://api.coinmetrics.io/v4/timeseries/asset-metrics"
+    COINMETRICS_PAGE_SIZE:int = 900
+    COINMETRICS_START_TIME:str = "2025-01-01"
+
+    # root directory of the parquet price store, partitioned as asset=<SYMBOL>/day=<YYYY-MM-DD>
+    PRICE_STORE_PATH:str = "price_store"
+
+@dataclass
+class SchedulerConsts:
+    # number of agent cycles Diana runs at the same time
+    MAX_CONCURRENT_AGENTS:int = 4
+    # minimum time between the end of an agent's cycle and the start of its next one
+    AGENT_CYCLE_INTERVAL_SECONDS:float = 60
+
+    # per provider token buckets shared by every agent: provider -> (tokens refilled per second, bucket size)
+    RATE_LIMITS:Dict[str, Tuple[float, float]] = field(default_factory=lambda: {
+        "openai": (0.5, 10),
+        "openai_embeddings": (50, 100),
+        "twitter": (1 / 60, 3),
+        "coinmarketcap": (0.5, 10),
+    })
+    # budget reserved from every provider bucket before an agent cycle is started
+    CYCLE_COST:Dict[str, float] = field(default_factory=lambda: {
+        "openai": 4,
+        "twitter": 1,
+        "coinmarketcap": 2,
+    })
 
 # These credentials are for Unichain sepolia testnet funds
 @dataclass
@@ -76,7 +76,7 @@ class TheAgent:
         self.tweet_generator = TweetGenerator(collection_name=self.collection_name, hub_pull=hub_pull, twitter_api_consts=twitter_api_consts)
         self.backtesting_strategy_generator = StrategyGenerator(collection_name=self.collection_name, hub_pull=hub_pull, strategy_generator=strategy_generator)
         self.portfolio_manager = PortfolioManager(hub_pull=hub_pull)
-        self.pipeline = RagPipeline(collection_name=self.collection_name)
+        self.pipeline = RagPipeline(collection_name=self.collection_name, agent_id=agent_info.AGENT_OBJECT_ID or None)
         self.model = ChatOpenAI(model=self.open_ai_consts.DEFAULT_MODEL_NAME)
 
         # Define and bind tools
@@ -88,6 +88,23 @@ class TheAgent:
         # Initialize the thread lock
         self.lock = threading.Lock()
 
+    def reset_cycle_state(self) -> None:
+        """
+        Reset the per cycle tool counters and flags, so a pooled agent starts every cycle like a freshly built one.
+        """
+        self.stop_flag = False
+        self.tool_function_calls = 0
+        self.generate_trades_flag = False
+        self.generate_trades_function_call_counter = 0
+
+    def close(self) -> None:
+        """
+        Flush the agent's pending portfolio writes and stop its background threads, called when the agent is evicted.
+        """
+        # both share the agent's PortfolioState, its threads stop once both released it
+        self.backtesting_strategy_generator.close()
+        self.portfolio_manager.close()
+
     def create_agent(self) -> CompiledGraph:
         self.agent_executor = create_react_agent(self.model, self.tools)
         return self.agent_executor
@@ -382,19 +399,10 @@ class TheAgent:
         self.portfolio_manager.update_portfolio_metrics()
         return new_document_ids
 
-    def clean_agent_workspace(self, content: List[str]) -> None:
+    def clean_agent_workspace(self) -> None:
         """
-        Process the models ToolCall and uses a predefined tool.
-
-        Parameters
-        ----------
-        content : List[str]
-            List of the new knowledgebase document IDs.
-
-        Returns
-        -------
-        str
-            The response after posting the tweet.
+        Resets the tool call counters of the agent for the next cycle. The knowledge base documents of
+        the cycle are short term memory that expires on its own, see rag.memory_compactor.
         """
         self.stop_flag = False
         self.tool_function_calls = 0
@@ -403,8 +411,6 @@ class TheAgent:
         # self.generate_trades_flag = False
         # self.generate_trades_function_call_counter = 0
 
-        self.chroma_client.delete_documents(document_ids=content)
-
     @staticmethod
     def api_cool_down() -> None:
         seconds_to_cool_down:float = 60
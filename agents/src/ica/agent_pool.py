@@ -0,0 +1,235 @@
+import json
+import time
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from pymongo.collection import Collection
+
+from config.config import PrivexMongodbConsts
+from rag.mongo_client_registry import MongoClientRegistry
+from ica.agent_47 import TheAgent
+from ica.logger_config import LoggerConfig
+
+
+@dataclass
+class PooledAgent:
+    agent: TheAgent
+    fingerprint: str
+    created_at: float
+    cycles: int = 0
+    stale: bool = False
+
+
+class AgentPool:
+    """
+    Keeps one warm TheAgent per agent id across Diana cycles.
+
+    Building TheAgent creates its Chroma managers, TweetGenerator, StrategyGenerator, PortfolioManager,
+    RagPipeline, Mongo clients, OpenAI models and the compiled react graph, so the pool builds it once
+    and only rebuilds it when the agent's settings change. A change is detected either from the
+    settings fingerprint passed to acquire() or pushed by the agent_settings change stream watcher,
+    which evicts the agent as soon as its document is updated, replaced or deleted.
+
+    acquire() holds the agent's lock until release(), so a cycle owns its agent from start to end.
+    An agent evicted while its cycle runs is only marked stale and closed when the cycle releases
+    it, its portfolio state keeps flushing the trades of that cycle.
+
+    Parameters
+    ----------
+    settings_collection : Optional[Callable[[], Collection]]
+        Returns the agent_settings collection watched for changes, by default built from PrivexMongodbConsts.
+
+    Methods
+    -------
+    acquire(agent_id: str, fingerprint: str, build: Callable[[], TheAgent]) -> TheAgent
+        Returns the pooled agent, building it when missing or stale, and holds it until release().
+    release(agent_id: str) -> None
+        Ends the cycle of an acquired agent, closing it when it was evicted meanwhile.
+    invalidate(agent_id: str) -> None
+        Evicts an agent, the next acquire() rebuilds it.
+    start_watcher() -> threading.Thread
+        Starts the change stream watcher thread.
+    """
+
+    # fields written back by MongoDBHandler.process_new_document(), they do not change how the agent behaves
+    IGNORED_SETTINGS_FIELDS = ("embedded_persona", "embedded_knowledgeBase")
+
+    def __init__(self, settings_collection: Optional[Callable[[], Collection]] = None) -> None:
+        self.settings_collection = settings_collection or self._privex_agent_settings
+        self.agents: Dict[str, PooledAgent] = {}
+        self._lock = threading.Lock()
+        self._agent_locks: Dict[str, threading.Lock] = {}
+        self._stop_event = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self.logger = LoggerConfig.setup_logger(self.__class__.__name__)
+
+    @classmethod
+    def fingerprint(cls, agent_settings: Dict[str, Any]) -> str:
+        """
+        Hash of the agent settings document, a different hash means the pooled agent is stale.
+
+        Parameters
+        ----------
+        agent_settings : Dict[str, Any]
+            The agent's agent_settings document.
+
+        Returns
+        -------
+        str
+            sha256 hex digest of the settings.
+        """
+        settings = {key: value for key, value in agent_settings.items() if key not in cls.IGNORED_SETTINGS_FIELDS}
+        return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def acquire(self, agent_id: str, fingerprint: str, build: Callable[[], TheAgent]) -> TheAgent:
+        """
+        Return the pooled agent, building it when it is missing or its settings changed.
+
+        The returned agent has its per cycle counters reset and its react graph compiled. It is held
+        until release(agent_id) is called, which must follow even when the cycle fails.
+
+        Parameters
+        ----------
+        agent_id : str
+            Id of the agent.
+        fingerprint : str
+            AgentPool.fingerprint() of the agent's current settings.
+        build : Callable[[], TheAgent]
+            Builds a new agent from the current settings.
+
+        Returns
+        -------
+        TheAgent
+            The warm agent.
+        """
+        # one build and one cycle per agent at a time, other agents are not blocked meanwhile
+        agent_lock = self._agent_lock(agent_id)
+        agent_lock.acquire()
+        try:
+            with self._lock:
+                pooled_agent = self.agents.get(agent_id)
+
+            if pooled_agent is None or pooled_agent.stale or pooled_agent.fingerprint != fingerprint:
+                if pooled_agent is not None:
+                    self.logger.info(f"agent {agent_id} settings changed, rebuilding pooled agent")
+                    self._close(pooled_agent.agent)
+                agent = build()
+                agent.create_agent()
+                pooled_agent = PooledAgent(agent=agent, fingerprint=fingerprint, created_at=time.time())
+                with self._lock:
+                    self.agents[agent_id] = pooled_agent
+
+            pooled_agent.cycles += 1
+            pooled_agent.agent.reset_cycle_state()
+            return pooled_agent.agent
+        except BaseException:
+            agent_lock.release()
+            raise
+
+    def release(self, agent_id: str) -> None:
+        """
+        End the cycle of an agent returned by acquire(), closing it when it was evicted during the cycle.
+        """
+        try:
+            self._close_if_stale(agent_id)
+        finally:
+            self._agent_lock(agent_id).release()
+
+    def invalidate(self, agent_id: str) -> None:
+        """
+        Mark an agent stale, it is closed now when idle or else when its running cycle releases it.
+        """
+        with self._lock:
+            pooled_agent = self.agents.get(agent_id)
+            if pooled_agent is None:
+                return
+            pooled_agent.stale = True
+        self.logger.info(f"evicted pooled agent {agent_id}")
+        agent_lock = self._agent_lock(agent_id)
+        if agent_lock.acquire(blocking=False):
+            try:
+                self._close_if_stale(agent_id)
+            finally:
+                agent_lock.release()
+
+    def clear(self) -> None:
+        with self._lock:
+            agent_ids = list(self.agents)
+        for agent_id in agent_ids:
+            self.invalidate(agent_id)
+
+    def _agent_lock(self, agent_id: str) -> threading.Lock:
+        with self._lock:
+            return self._agent_locks.setdefault(agent_id, threading.Lock())
+
+    def _close_if_stale(self, agent_id: str) -> None:
+        # called with the agent's lock held, no cycle is using the agent
+        with self._lock:
+            pooled_agent = self.agents.get(agent_id)
+            if pooled_agent is None or not pooled_agent.stale:
+                return
+            del self.agents[agent_id]
+        self._close(pooled_agent.agent)
+
+    def _close(self, agent: TheAgent) -> None:
+        # flushes the agent's write-behind portfolio, a failure must not stop the eviction
+        try:
+            agent.close()
+        except Exception as e:
+            self.logger.error(f"failed to close pooled agent: {e}")
+
+    def start_watcher(self) -> threading.Thread:
+        """
+        Start (once) the daemon thread evicting agents whose agent_settings document changes.
+
+        Returns
+        -------
+        threading.Thread
+            The watcher thread.
+        """
+        with self._lock:
+            if self._watcher is None or not self._watcher.is_alive():
+                self._stop_event.clear()
+                self._watcher = threading.Thread(target=self._watch_settings, name="AgentPoolWatcher", daemon=True)
+                self._watcher.start()
+            return self._watcher
+
+    def stop_watcher(self) -> None:
+        self._stop_event.set()
+
+    def handle_change(self, change: Dict[str, Any]) -> None:
+        """
+        Evict the agent of an agent_settings change stream event.
+        """
+        agent_id = change.get("documentKey", {}).get("_id")
+        if agent_id is None:
+            return
+        updated_fields = change.get("updateDescription", {}).get("updatedFields", {})
+        if change.get("operationType") == "update" and updated_fields and set(updated_fields) <= set(self.IGNORED_SETTINGS_FIELDS):
+            return
+        self.invalidate(str(agent_id))
+
+    def _watch_settings(self) -> None:
+        resume_token = None
+        settings_collection = None
+        pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+        while not self._stop_event.is_set():
+            try:
+                if settings_collection is None:
+                    settings_collection = self.settings_collection()
+                with settings_collection.watch(pipeline, resume_after=resume_token, max_await_time_ms=1000) as stream:
+                    while not self._stop_event.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self.handle_change(change)
+                        resume_token = stream.resume_token
+            except Exception as e:
+                self.logger.error(f"agent pool change stream error: {e}, retrying in 5 seconds")
+                self._stop_event.wait(5)
+
+    @staticmethod
+    def _privex_agent_settings() -> Collection:
+        privex_mongodb = PrivexMongodbConsts()
+        return MongoClientRegistry.get_database(privex_mongodb.PRIVEX_MONGDB_URI, privex_mongodb.DB_NAME)["agent_settings"]
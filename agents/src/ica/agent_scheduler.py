@@ -0,0 +1,268 @@
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+from typing_extensions import List
+
+from config.config import SchedulerConsts
+from ica.rate_limiter import RateLimiter
+from ica.logger_config import LoggerConfig
+
+
+@dataclass
+class ScheduledAgent:
+    agent_id: str
+    job: Callable[[], Any]
+    interval: float
+    next_run: float
+    running: bool = False
+    cycles: int = 0
+    last_duration: float = 0.0
+
+
+class AgentScheduler:
+    """
+    Runs many agents' cycles concurrently with asyncio, bounded by a semaphore.
+
+    Every agent has its own next-run time kept in a heap, so an agent is only started again once
+    its interval has passed since its previous cycle ended. Due agents are dispatched in next-run
+    order (ties in registration order), one at a time, which gives fair FIFO queueing: a slow or
+    busy agent never holds back agents that became due before it. Before a cycle starts its
+    provider budget (SchedulerConsts.CYCLE_COST) is reserved from the shared per provider
+    RateLimiter token buckets. Agent jobs are blocking (LLM, Twitter, Coinmarketcap calls) and run
+    in worker threads through asyncio.to_thread.
+
+    start() runs run_forever() on its own event loop thread, which starts every agent as soon as it
+    is due instead of waiting for the other running cycles, and is woken up by finished cycles and
+    newly scheduled agents. schedule() and unschedule() may be called from any thread meanwhile.
+
+    Parameters
+    ----------
+    scheduler_consts : Optional[SchedulerConsts]
+        Concurrency, interval, rate limit and cycle cost settings, by default SchedulerConsts().
+    rate_limiters : Optional[Dict[str, RateLimiter]]
+        Limiters keyed by provider, by default the process wide RateLimiter.for_provider() limiters.
+    clock : Callable[[], float], optional
+        Monotonic clock used for next-run times, by default time.monotonic.
+
+    Methods
+    -------
+    schedule(agent_id: str, job: Callable[[], Any], interval: Optional[float]) -> None
+        Registers an agent or replaces its job, keeping its next-run time.
+    unschedule(agent_id: str) -> None
+        Removes an agent.
+    run_due() -> Dict[str, Any]
+        Runs every agent that is due once and returns each agent's result or exception.
+    run_forever(stop_event: Optional[asyncio.Event]) -> None
+        Keeps running agents as they become due until stop_event is set or stop() is called.
+    start() -> threading.Thread
+        Runs run_forever() on a daemon event loop thread.
+    stop(timeout: Optional[float]) -> None
+        Stops run_forever() once the running cycles finished.
+    """
+
+    def __init__(self, scheduler_consts: Optional[SchedulerConsts] = None, rate_limiters: Optional[Dict[str, RateLimiter]] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        self.scheduler_consts = scheduler_consts or SchedulerConsts()
+        self.max_concurrency = self.scheduler_consts.MAX_CONCURRENT_AGENTS
+        self.default_interval = self.scheduler_consts.AGENT_CYCLE_INTERVAL_SECONDS
+        self.cycle_cost = self.scheduler_consts.CYCLE_COST
+        self.rate_limiters = rate_limiters or {
+            provider: RateLimiter.for_provider(provider=provider, scheduler_consts=self.scheduler_consts)
+            for provider in self.cycle_cost
+        }
+        self.clock = clock
+        self.agents: Dict[str, ScheduledAgent] = {}
+        self._queue: List[Tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        # guards agents and the heap, schedule() is called from other threads than the event loop's
+        self._lock = threading.RLock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.logger = LoggerConfig.setup_logger(self.__class__.__name__)
+
+    def schedule(self, agent_id: str, job: Callable[[], Any], interval: Optional[float] = None) -> None:
+        """
+        Register an agent, or replace the job of an agent that is already scheduled.
+
+        Parameters
+        ----------
+        agent_id : str
+            Id of the agent.
+        job : Callable[[], Any]
+            Blocking callable running one cycle of the agent.
+        interval : Optional[float]
+            Seconds between the end of a cycle and the next one, by default AGENT_CYCLE_INTERVAL_SECONDS.
+        """
+        interval = self.default_interval if interval is None else interval
+        with self._lock:
+            scheduled_agent = self.agents.get(agent_id)
+            if scheduled_agent is not None:
+                scheduled_agent.job = job
+                scheduled_agent.interval = interval
+                return
+
+            self.agents[agent_id] = ScheduledAgent(agent_id=agent_id, job=job, interval=interval, next_run=self.clock())
+            self._push(agent_id)
+        self._wake()
+
+    def unschedule(self, agent_id: str) -> None:
+        # the heap entry is dropped lazily when it is popped
+        with self._lock:
+            self.agents.pop(agent_id, None)
+
+    def next_run_in(self) -> Optional[float]:
+        """
+        Seconds until the next agent is due, None when no agent is waiting.
+        """
+        with self._lock:
+            self._drop_stale_entries()
+            if not self._queue:
+                return None
+            return max(0.0, self._queue[0][0] - self.clock())
+
+    async def run_due(self) -> Dict[str, Any]:
+        """
+        Run every agent that is due now, at most max_concurrency at a time.
+
+        Returns
+        -------
+        Dict[str, Any]
+            Result (or raised exception) of each agent that ran, keyed by agent id.
+        """
+        results: Dict[str, Any] = {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = []
+
+        for scheduled_agent in self._pop_due():
+            await semaphore.acquire()
+            await self._reserve_budget()
+            tasks.append(asyncio.create_task(self._run_cycle(scheduled_agent=scheduled_agent, semaphore=semaphore, results=results)))
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        return results
+
+    async def run_forever(self, stop_event: Optional[asyncio.Event] = None) -> None:
+        """
+        Run agents as they become due until stop_event is set or stop() is called.
+
+        Unlike run_due() an agent is started as soon as it is due, a slow cycle only holds back the
+        agents that are due while every one of the max_concurrency slots is taken.
+
+        Parameters
+        ----------
+        stop_event : Optional[asyncio.Event]
+            Event that stops the loop once the running cycles finished, by default run until stop().
+        """
+        stop_event = stop_event or asyncio.Event()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks: set = set()
+        # latest result of each agent, nobody waits for them
+        results: Dict[str, Any] = {}
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+        try:
+            while not stop_event.is_set() and not self._stopped.is_set():
+                self._wakeup.clear()
+                for scheduled_agent in self._pop_due():
+                    await semaphore.acquire()
+                    await self._reserve_budget()
+                    task = asyncio.create_task(self._run_cycle(scheduled_agent=scheduled_agent, semaphore=semaphore, results=results))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                wait_seconds = self.next_run_in()
+                waiters = [asyncio.ensure_future(stop_event.wait()), asyncio.ensure_future(self._wakeup.wait())]
+                await asyncio.wait(waiters, timeout=self.default_interval if wait_seconds is None else wait_seconds, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in waiters:
+                    waiter.cancel()
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks)
+            with self._lock:
+                self._loop = None
+                self._wakeup = None
+
+    def start(self) -> threading.Thread:
+        """
+        Start (once) the daemon thread running run_forever() on its own event loop.
+
+        Returns
+        -------
+        threading.Thread
+            The scheduler thread.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=asyncio.run, args=(self.run_forever(),), name="AgentScheduler", daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopped.set()
+        self._wake()
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=timeout)
+
+    def _wake(self) -> None:
+        # run_forever() reconsiders the next due agent right away
+        with self._lock:
+            loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # the loop closed meanwhile
+                pass
+
+    async def _run_cycle(self, scheduled_agent: ScheduledAgent, semaphore: asyncio.Semaphore, results: Dict[str, Any]) -> None:
+        started_at = self.clock()
+        try:
+            results[scheduled_agent.agent_id] = await asyncio.to_thread(scheduled_agent.job)
+        except Exception as e:
+            self.logger.error(f"agent {scheduled_agent.agent_id} cycle failed: {e}")
+            results[scheduled_agent.agent_id] = e
+        finally:
+            finished_at = self.clock()
+            scheduled_agent.running = False
+            scheduled_agent.cycles += 1
+            scheduled_agent.last_duration = finished_at - started_at
+            scheduled_agent.next_run = finished_at + scheduled_agent.interval
+            with self._lock:
+                if self.agents.get(scheduled_agent.agent_id) is scheduled_agent:
+                    self._push(scheduled_agent.agent_id)
+            semaphore.release()
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def _reserve_budget(self) -> None:
+        for provider, tokens in self.cycle_cost.items():
+            await self.rate_limiters[provider].aacquire(tokens=tokens)
+
+    def _pop_due(self) -> List[ScheduledAgent]:
+        now = self.clock()
+        due_agents = []
+        with self._lock:
+            while self._queue and self._queue[0][0] <= now:
+                _, _, agent_id = heapq.heappop(self._queue)
+                scheduled_agent = self.agents.get(agent_id)
+                if scheduled_agent is None or scheduled_agent.running:
+                    continue
+                scheduled_agent.running = True
+                due_agents.append(scheduled_agent)
+        return due_agents
+
+    def _push(self, agent_id: str) -> None:
+        heapq.heappush(self._queue, (self.agents[agent_id].next_run, next(self._sequence), agent_id))
+
+    def _drop_stale_entries(self) -> None:
+        while self._queue and self._queue[0][2] not in self.agents:
+            heapq.heappop(self._queue)
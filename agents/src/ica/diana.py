@@ -1,17 +1,21 @@
 import time
+import threading
 from typing import List
 from datetime import datetime
+from functools import partial
 from dataclasses import replace
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Process
 
 from config.config import HubPull, TwitterApiConsts, Backtester
 from rag.mongodb_handler import MongoDBHandler
-from rag.rag_chroma_client import ChromaVectorStoreManager
 from ica.logger_config import LoggerConfig
 from ica.agent_47 import TheAgent
+from ica.agent_scheduler import AgentScheduler
+from ica.agent_pool import AgentPool
 from rag.rag_pipeline import RagPipeline
+from rag.knowledge_ingestion import KnowledgeIngestionDaemon
+from rag.memory_compactor import MemoryCompactor
 from backtesting.portfolio_manager import PortfolioManager
 
 class Diana:
@@ -20,6 +24,10 @@ class Diana:
         try:
             self.logger = LoggerConfig.setup_logger(self.__class__.__name__)
             self.all_agents_list = []
+            # kept across start() calls so every agent keeps its own next-run time
+            self.scheduler = AgentScheduler()
+            # warm TheAgent instances, rebuilt only when an agent's settings change
+            self.agent_pool = AgentPool()
         except Exception as e:
             print(f"failed to initialize Diana()")
 
@@ -39,6 +47,8 @@ class Diana:
             print(f"failed to get all agents: {e}")
             self.logger.error(f"failed to get all agents: {e}")
 
+        self.agent_pool.start_watcher()
+
         active_agents = []
 
         agents_created = []
@@ -53,6 +63,7 @@ class Diana:
             agent_collection_name = str(agent.get("_id", ""))
             persona_info=agent.get("persona", "")
             agent_strategy=agent.get("strategyType")
+            agent_risk_policy=agent.get("riskPolicy") or []
 
             # TODO add embeddings field from mongo db
 
@@ -61,6 +72,7 @@ class Diana:
                 KNOWLEDGE_BASE_COLLECTION_NAME = agent_id,
                 AGENT_OBJECT_ID = agent_id,
                 PERSONA_INFO = persona_info,
+                RISK_POLICY = agent_risk_policy,
                 PROMPT = persona_info + """
                 Question: {question} 
                 Context: {context} 
@@ -117,23 +129,48 @@ class Diana:
                 """
             )
 
-            print(f"working on {agent.get("agentName","")} \n")
-            self.start_agent(agent_collection_name=agent_collection_name, hub_pull = updated_agent, twitter_api_consts = agent_twitter_consts, strategy_generator=updated_agent_trading_settings)
-            print(f"done with invoking {agent.get("agentName","")} \n")
+            self.scheduler.schedule(
+                agent_id=agent_id,
+                job=partial(self.start_agent, agent_collection_name=agent_collection_name, hub_pull=updated_agent, twitter_api_consts=agent_twitter_consts, strategy_generator=updated_agent_trading_settings, agent_name=agent.get("agentName", ""), settings_fingerprint=AgentPool.fingerprint(agent)),
+            )
+            agents_created.append(agent_id)
 
-    def start_agent(self, agent_collection_name:str, hub_pull: HubPull, twitter_api_consts:TwitterApiConsts, strategy_generator:Backtester): 
+        # agents removed from the agent db stop being scheduled
+        for agent_id in set(self.scheduler.agents) - set(agents_created):
+            self.scheduler.unschedule(agent_id)
+            self.agent_pool.invalidate(agent_id)
 
-        agent47 = TheAgent(collection_name=agent_collection_name, hub_pull=hub_pull, twitter_api_consts=twitter_api_consts, strategy_generator=strategy_generator)
+        # the scheduler thread runs every agent as soon as it is due, see start_scheduler()
+        self.logger.info(f"scheduled {len(agents_created)} agents, next agent due in {self.scheduler.next_run_in()} seconds")
 
-        # maybe store this so we dont have to make a new agent everytime
-        active_agent = agent47.create_agent()
+    def start_scheduler(self) -> threading.Thread:
+        """
+        Starts the thread running the scheduled agents' cycles, bounded by SchedulerConsts.MAX_CONCURRENT_AGENTS
+        and the provider rate limits, each agent on its own interval. start() only (un)schedules agents.
 
-        try:
+        :return: The scheduler thread.
+        """
+        return self.scheduler.start()
+
+    def start_agent(self, agent_collection_name:str, hub_pull: HubPull, twitter_api_consts:TwitterApiConsts, strategy_generator:Backtester, agent_name:str = "", settings_fingerprint:str = ""): 
 
-            with ThreadPoolExecutor(max_workers=1) as executor:            
-                executor.submit(agent47.invoke_agent47)
+        print(f"working on {agent_name} \n")
 
-            agent47.api_cool_down()
+        try:
+            agent47 = self.agent_pool.acquire(
+                agent_id=agent_collection_name,
+                fingerprint=settings_fingerprint,
+                build=partial(TheAgent, collection_name=agent_collection_name, hub_pull=hub_pull, twitter_api_consts=twitter_api_consts, strategy_generator=strategy_generator),
+            )
+
+            # the scheduler runs this in a worker thread and spaces the agent's cycles, no cool down needed here
+            try:
+                response = agent47.invoke_agent47()
+            finally:
+                # an agent evicted during the cycle is only closed once the cycle is done with it
+                self.agent_pool.release(agent_collection_name)
+            print(f"done with invoking {agent_name} \n")
+            return response
 
         except Exception as e:
             self.logger.error(f"failed to start agent {agent_collection_name}: {e}")
@@ -166,40 +203,49 @@ class Diana:
         return None  # Gracefully return None if it fails
 
     @staticmethod
-    def update_knowledge_base() -> List[str]:
-        logger = LoggerConfig.setup_logger(__class__.__name__)
-        try:
-            rag_pipeline = RagPipeline(collection_name="DIANA")
-            agent_diana = HubPull()
-            portfolio_manager = PortfolioManager(hub_pull=agent_diana)
-            short_term_memory_to_delete = rag_pipeline.process_and_update_knowledge_base()
-            portfolio_manager.update_portfolio_metrics()
-            logger.info(f"updated knowledgebase with {len(short_term_memory_to_delete)} documents")
-            return short_term_memory_to_delete
-        except Exception as e:
-            logger.error(f"failed to update knowledge base: {e}")
+    def start_knowledge_ingestion() -> KnowledgeIngestionDaemon:
+        """
+        Starts the daemon streaming new and changed NFA tweets, opportunities and tokens into the knowledge base.
+
+        :return: The started KnowledgeIngestionDaemon.
+        """
+        knowledge_ingestion = KnowledgeIngestionDaemon()
+        knowledge_ingestion.start()
+        return knowledge_ingestion
 
     @staticmethod
-    def clean_agent_workspace(content: List[str]) -> None:
+    def start_memory_compactor() -> MemoryCompactor:
         """
-        Process the models ToolCall and uses a predefined tool.
+        Starts the thread deleting expired short term memory from chroma in bulk.
 
-        Parameters
-        ----------
-        content : List[str]
-            List of the new knowledgebase document IDs.
+        :return: The started MemoryCompactor.
+        """
+        memory_compactor = MemoryCompactor()
+        memory_compactor.start()
+        return memory_compactor
 
-        Returns
-        -------
-            None 
+    @staticmethod
+    def update_knowledge_base() -> List[str]:
+        """
+        Stores the latest market data in the shared short term memory of the DIANA collection, it
+        expires after ShortTermMemoryConsts.TTL_SECONDS instead of being deleted after the cycle.
         """
         logger = LoggerConfig.setup_logger(__class__.__name__)
+        portfolio_manager = None
         try:
-            chroma_client = ChromaVectorStoreManager("DIANA")
-            chroma_client.delete_documents(document_ids=content)
-            print(f"removed {len(content)} documents from chroma db \n")
+            rag_pipeline = RagPipeline(collection_name="DIANA")
+            agent_diana = HubPull()
+            portfolio_manager = PortfolioManager(hub_pull=agent_diana)
+            short_term_memory_ids = rag_pipeline.process_and_update_knowledge_base()
+            portfolio_manager.update_portfolio_metrics()
+            logger.info(f"updated knowledgebase with {len(short_term_memory_ids)} documents")
+            return short_term_memory_ids
         except Exception as e:
             logger.error(f"failed to update knowledge base: {e}")
+        finally:
+            # built every cycle, its portfolio state must not outlive it
+            if portfolio_manager is not None:
+                portfolio_manager.close()
 
     @staticmethod
     def api_cool_down() -> None:
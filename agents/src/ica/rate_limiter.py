@@ -0,0 +1,112 @@
+import time
+import asyncio
+import threading
+from typing import Callable, Dict, Optional
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from config.config import SchedulerConsts
+
+
+class RateLimiter(BaseRateLimiter):
+    """
+    A thread safe token bucket, usable from threads (acquire) and from asyncio (aacquire).
+
+    One limiter per provider is shared by the whole process (see RateLimiter.for_provider()), so
+    every agent draws from the same OpenAI, Twitter and Coinmarketcap budgets. Being a langchain
+    BaseRateLimiter it can also be handed to a chat model through its rate_limiter argument.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added to the bucket per second.
+    capacity : float
+        Maximum number of tokens in the bucket, i.e. the largest burst allowed.
+    clock : Callable[[], float], optional
+        Monotonic clock, by default time.monotonic.
+    """
+
+    _providers: Dict[str, "RateLimiter"] = {}
+    _providers_lock = threading.Lock()
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_provider(cls, provider: str, scheduler_consts: Optional[SchedulerConsts] = None) -> "RateLimiter":
+        """
+        Return the process wide limiter of a provider, built from SchedulerConsts.RATE_LIMITS on first use.
+
+        Parameters
+        ----------
+        provider : str
+            Provider name, e.g. "openai", "twitter" or "coinmarketcap".
+        scheduler_consts : Optional[SchedulerConsts]
+            Settings used to build the limiter, defaults to SchedulerConsts().
+
+        Returns
+        -------
+        RateLimiter
+            The shared limiter of the provider.
+        """
+        with cls._providers_lock:
+            if provider not in cls._providers:
+                rate_limits = (scheduler_consts or SchedulerConsts()).RATE_LIMITS
+                if provider not in rate_limits:
+                    raise ValueError(f"No rate limit configured for provider {provider}, expected one of {list(rate_limits)}")
+                rate, capacity = rate_limits[provider]
+                cls._providers[provider] = cls(rate=rate, capacity=capacity)
+            return cls._providers[provider]
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Take tokens from the bucket if they are available.
+
+        Parameters
+        ----------
+        tokens : float, optional
+            Number of tokens to take, by default 1.
+
+        Returns
+        -------
+        float
+            0 when the tokens were taken, otherwise the seconds to wait before they are available.
+        """
+        # a request larger than the bucket waits for a full bucket instead of waiting forever
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, *, blocking: bool = True, tokens: float = 1) -> bool:
+        while True:
+            wait_seconds = self.try_acquire(tokens)
+            if wait_seconds == 0:
+                return True
+            if not blocking:
+                return False
+            time.sleep(wait_seconds)
+
+    async def aacquire(self, *, blocking: bool = True, tokens: float = 1) -> bool:
+        while True:
+            wait_seconds = self.try_acquire(tokens)
+            if wait_seconds == 0:
+                return True
+            if not blocking:
+                return False
+            await asyncio.sleep(wait_seconds)
+
+    @property
+    def available_tokens(self) -> float:
+        with self._lock:
+            return min(self.capacity, self._tokens + (self.clock() - self._updated_at) * self.rate)
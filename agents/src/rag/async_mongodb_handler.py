@@ -0,0 +1,221 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from bson.objectid import ObjectId
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult
+
+from config.config import MFAMongodbConsts, PrivexMongodbConsts
+from rag.mongo_client_registry import MongoClientRegistry
+from rag.mongodb_handler import MongoDBHandler
+from rag.token_id_resolver import TokenIdResolver
+
+
+class AsyncMongoDBHandler:
+    """
+    Async twin of MongoDBHandler built on pymongo's AsyncMongoClient.
+
+    Exposes the same portfolio, symbol lookup, tweet archive and change stream operations as
+    MongoDBHandler, as coroutines, so an asyncio scheduler can overlap Mongo round trips with LLM
+    and HTTP calls (e.g. asyncio.gather(handler.get_portfolio_details(...), handler.get_cmc_ids_by_symbols(...))).
+    Clients come from MongoClientRegistry, one pooled async client per URI and event loop.
+
+    Parameters
+    ----------
+    collection_name : str
+        Name of the agent's collection, kept for parity with MongoDBHandler.
+    """
+
+    def __init__(self, collection_name: str) -> None:
+        self.collection_name = collection_name
+        self.mfa_mongodb = MFAMongodbConsts()
+        self.privex_mongodb = PrivexMongodbConsts()
+
+    @property
+    def privex_db(self) -> AsyncDatabase:
+        return MongoClientRegistry.get_async_database(self.privex_mongodb.PRIVEX_MONGDB_URI, self.privex_mongodb.DB_NAME)
+
+    @property
+    def mfa_db(self) -> AsyncDatabase:
+        return MongoClientRegistry.get_async_database(self.mfa_mongodb.MFA_MONGDB_URI, self.mfa_mongodb.DB_NAME)
+
+    @property
+    def agent_settings(self) -> AsyncCollection:
+        return self.privex_db["agent_settings"]
+
+    @property
+    def agent_portfolio(self) -> AsyncCollection:
+        return self.privex_db["agent_portfolio"]
+
+    @property
+    def tweet_comments_delete_later(self) -> AsyncCollection:
+        return self.privex_db["tweet_comments_delete_later"]
+
+    @property
+    def tweet_threads_delete_later(self) -> AsyncCollection:
+        return self.privex_db["tweet_threads_delete_later"]
+
+    async def get_all_agents(self) -> Optional[List[Dict[str, Any]]]:
+        try:
+            return await self.agent_settings.find().to_list()
+        except Exception as e:
+            print(f"Error retrieving agents: {e}")
+            return None
+
+    async def get_agent_settings(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.agent_settings.find_one({"_id": ObjectId(agent_id)})
+        except Exception as e:
+            print(f"Error retrieving agent: {e}")
+            return None
+
+    async def get_portfolio_details(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch portfolio details for a given agent ID, see MongoDBHandler.get_portfolio_details().
+
+        Returns
+        -------
+        Optional[Dict[str, Any]]
+            The agent's portfolioDetails, {} when the agent has no portfolio, None on errors.
+        """
+        try:
+            document = await self.agent_portfolio.find_one({"agentId": ObjectId(agent_id)}, projection={"portfolioDetails": 1})
+            if not document:
+                print(f"No portfolio found for agentId: {agent_id}")
+                return {}
+            return document.get("portfolioDetails", {})
+        except Exception as e:
+            print(f"Error fetching portfolio details: {e}")
+            return None
+
+    async def update_or_create_portfolio_v2(self, agent_id: str, portfolio_updates: dict, portfolio_metrics: dict) -> None:
+        """
+        Replace the agent's portfolio details and metrics in one upsert, see MongoDBHandler.update_or_create_portfolio_v2().
+        """
+        await self.ensure_portfolio_index()
+        for attempt in range(MongoDBHandler.PORTFOLIO_WRITE_ATTEMPTS):
+            try:
+                result = await self.agent_portfolio.update_one(
+                    {"agentId": ObjectId(agent_id)},
+                    {"$set": {"portfolioDetails": portfolio_updates, "portfolioMetrics": portfolio_metrics}},
+                    upsert=True,
+                )
+                break
+            except DuplicateKeyError:
+                # another writer inserted the portfolio first, the upsert now updates it
+                if attempt == MongoDBHandler.PORTFOLIO_WRITE_ATTEMPTS - 1:
+                    raise
+        if result.upserted_id is not None:
+            print(f"Created new portfolio entry for agent {agent_id} with _id {result.upserted_id}")
+        else:
+            print(f"Updated portfolio for agent {agent_id}.")
+
+    async def write_portfolio_holdings(self, agent_id: str, holdings: Optional[Dict[str, Dict[str, Any]]] = None, increments: Optional[Dict[str, Dict[str, float]]] = None, portfolio_metrics: Optional[Any] = None) -> Optional[BulkWriteResult]:
+        """
+        Write the changed holdings (and metrics) in one bulk_write round trip, see MongoDBHandler.write_portfolio_holdings().
+        """
+        operations = MongoDBHandler.portfolio_write_operations(agent_id=agent_id, holdings=holdings, increments=increments, portfolio_metrics=portfolio_metrics)
+        if not operations:
+            return None
+        await self.ensure_portfolio_index()
+        written = len(operations)
+        for attempt in range(MongoDBHandler.PORTFOLIO_WRITE_ATTEMPTS):
+            try:
+                result = await self.agent_portfolio.bulk_write(operations, ordered=True)
+                break
+            except BulkWriteError as e:
+                operations = MongoDBHandler.portfolio_operations_to_retry(error=e, operations=operations, attempt=attempt)
+        print(f"Wrote {written} portfolio updates for agent {agent_id}.")
+        return result
+
+    async def ensure_portfolio_index(self) -> None:
+        """
+        Create the unique agentId index of agent_portfolio once per process, see MongoDBHandler.ensure_portfolio_index().
+
+        Creating an existing index is a no-op, so concurrent first writers all await the creation
+        instead of one of them writing before the index exists.
+        """
+        key = (self.privex_mongodb.PRIVEX_MONGDB_URI, self.agent_portfolio.full_name)
+        if MongoDBHandler.portfolio_index_ensured(key):
+            return
+        try:
+            await self.agent_portfolio.create_index(MongoDBHandler.PORTFOLIO_INDEX_KEY, unique=True, name=MongoDBHandler.PORTFOLIO_INDEX_NAME)
+        except OperationFailure as e:
+            print(f"unable to create the unique agentId index of agent_portfolio: {e}")
+        MongoDBHandler.mark_portfolio_index_ensured(key)
+
+    async def save_tweet_comment_delete_later(self, agent_id: str, tweet_comments_updates: str) -> None:
+        await self._append_to_archive(
+            collection=self.tweet_comments_delete_later, agent_id=agent_id, field="tweetCommentDetails", update=tweet_comments_updates
+        )
+
+    async def save_tweet_thread_delete_later(self, agent_id: str, tweet_comments_updates: List[str]) -> None:
+        await self._append_to_archive(
+            collection=self.tweet_threads_delete_later, agent_id=agent_id, field="tweetThreadDetails", update=tweet_comments_updates
+        )
+
+    async def get_cmc_ids_by_symbols(self, symbol: str) -> List[str]:
+        """
+        Return the Coinmarketcap ids of a symbol from the NFA 'tokens' collection, see MongoDBHandler.get_cmc_ids_by_symbols().
+
+        Served by the same in memory TokenIdResolver as the sync handler, in a worker thread since
+        the first lookup of the process loads the collection.
+        """
+        return await asyncio.to_thread(lambda: TokenIdResolver.shared().resolve(symbol))
+
+    async def watch_agent_settings(self, operation_types: Sequence[str] = ("insert",), retry_seconds: float = 5) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield agent_settings change events, resuming after the last seen event when the stream fails.
+
+        Parameters
+        ----------
+        operation_types : Sequence[str], optional
+            Change stream operation types to yield, by default ("insert",).
+        retry_seconds : float, optional
+            Delay before the stream is reopened after an error, by default 5.
+
+        Yields
+        ------
+        Dict[str, Any]
+            Change stream events.
+        """
+        resume_token = None
+        pipeline = [{"$match": {"operationType": {"$in": list(operation_types)}}}]
+        while True:
+            try:
+                async with await self.agent_settings.watch(pipeline, resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        yield change
+            except Exception as e:
+                print(f"Change Stream error: {e} \n")
+                print(f"Retrying in {retry_seconds} seconds... \n")
+                await asyncio.sleep(retry_seconds)
+
+    async def listen_for_changes(self) -> None:
+        """
+        Async MongoDBHandler.listen_for_changes(), embeds every new agent's persona and knowledge base.
+        """
+        async for change in self.watch_agent_settings(operation_types=("insert",)):
+            # embedding is a blocking OpenAI call, keep it off the event loop
+            await asyncio.to_thread(MongoDBHandler.process_new_document, change["fullDocument"])
+
+    async def _append_to_archive(self, collection: AsyncCollection, agent_id: str, field: str, update: Any) -> None:
+        agent_object_id = ObjectId(agent_id)
+        existing_archive = await collection.find_one({"agentId": agent_object_id}, projection={field: 1})
+
+        if existing_archive:
+            # older archives stored a single entry, make it a list before appending
+            if not isinstance(existing_archive.get(field), list):
+                await collection.update_one({"agentId": agent_object_id}, {"$set": {field: [existing_archive.get(field)]}})
+
+            result = await collection.update_one({"agentId": agent_object_id}, {"$push": {field: update}})
+            if result.modified_count > 0:
+                print(f"Appended to {collection.name} collection for agent {agent_id}.")
+            else:
+                print(f"{collection.name} update failed.")
+        else:
+            result = await collection.insert_one({"agentId": agent_object_id, field: [update]})
+            print(f"Created new {collection.name} entry for agent {agent_id} with _id {result.inserted_id}")
@@ -0,0 +1,354 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+from typing_extensions import List
+
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+
+from config.config import ChangeStreamConsts, PrivexMongodbConsts
+from rag.mongo_client_registry import MongoClientRegistry
+
+
+@dataclass
+class ChangeStreamSubscription:
+    """
+    One watched collection of a ChangeStreamListener.
+
+    Attributes
+    ----------
+    name : str
+        Unique name, the key of the subscription's persisted resume token.
+    collection : Callable[[], Collection]
+        Returns the watched collection.
+    handle_batch : Callable[[List[Dict[str, Any]]], Any]
+        Processes a batch of change events, called from the worker pool. It must be idempotent,
+        the batches that were not finished when the process stopped, and the batches following a
+        batch that kept failing, are delivered again.
+    pipeline : List[Dict[str, Any]]
+        Change stream pipeline, by default inserts, updates and replaces.
+    full_document : Optional[str]
+        Change stream fullDocument option, by default "updateLookup" so updates carry the whole document.
+    max_in_flight_batches : Optional[int]
+        Batches handed to the workers but not finished before the stream stops being read, by
+        default ChangeStreamConsts.MAX_IN_FLIGHT_BATCHES. 1 handles the batches in stream order.
+    """
+
+    name: str
+    collection: Callable[[], Collection]
+    handle_batch: Callable[[List[Dict[str, Any]]], Any]
+    pipeline: List[Dict[str, Any]] = field(default_factory=lambda: [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}])
+    full_document: Optional[str] = "updateLookup"
+    max_in_flight_batches: Optional[int] = None
+
+
+class ChangeBatchError(Exception):
+    """
+    A batch of change events still failed after ChangeStreamConsts.HANDLE_ATTEMPTS calls of handle_batch.
+
+    Attributes
+    ----------
+    batch : List[Dict[str, Any]]
+        The failed change events.
+    resume_token : Dict[str, Any]
+        Resume token of the stream after the failed batch.
+    """
+
+    def __init__(self, message: str, batch: List[Dict[str, Any]], resume_token: Dict[str, Any]) -> None:
+        super().__init__(message)
+        self.batch = batch
+        self.resume_token = resume_token
+
+
+class ResumeTokenStore:
+    """
+    Resume tokens of change stream subscriptions, persisted in the privex database.
+
+    Parameters
+    ----------
+    collection : Optional[Callable[[], Collection]]
+        Returns the collection tokens are stored in, by default ChangeStreamConsts.RESUME_TOKENS_COLLECTION_NAME of the privex database.
+    """
+
+    def __init__(self, collection: Optional[Callable[[], Collection]] = None, change_stream_consts: Optional[ChangeStreamConsts] = None) -> None:
+        self.change_stream_consts = change_stream_consts or ChangeStreamConsts()
+        self.collection = collection or self._privex_resume_tokens
+
+    def load(self, name: str) -> Optional[Dict[str, Any]]:
+        document = self.collection().find_one({"_id": name})
+        return document["resumeToken"] if document else None
+
+    def save(self, name: str, resume_token: Dict[str, Any]) -> None:
+        self.collection().update_one({"_id": name}, {"$set": {"resumeToken": resume_token, "updatedAt": datetime.now()}}, upsert=True)
+
+    def clear(self, name: str) -> None:
+        self.collection().delete_one({"_id": name})
+
+    def _privex_resume_tokens(self) -> Collection:
+        privex_mongodb = PrivexMongodbConsts()
+        return MongoClientRegistry.get_database(privex_mongodb.PRIVEX_MONGDB_URI, privex_mongodb.DB_NAME)[self.change_stream_consts.RESUME_TOKENS_COLLECTION_NAME]
+
+
+class DeadLetterStore:
+    """
+    Change events a subscription kept failing to handle, persisted in the privex database to be replayed by hand.
+
+    Parameters
+    ----------
+    collection : Optional[Callable[[], Collection]]
+        Returns the collection dead letters are stored in, by default ChangeStreamConsts.DEAD_LETTERS_COLLECTION_NAME of the privex database.
+    """
+
+    def __init__(self, collection: Optional[Callable[[], Collection]] = None, change_stream_consts: Optional[ChangeStreamConsts] = None) -> None:
+        self.change_stream_consts = change_stream_consts or ChangeStreamConsts()
+        self.collection = collection or self._privex_dead_letters
+
+    def save(self, name: str, changes: List[Dict[str, Any]], error: str) -> None:
+        self.collection().insert_one({"subscription": name, "changes": changes, "error": error, "createdAt": datetime.now()})
+
+    def _privex_dead_letters(self) -> Collection:
+        privex_mongodb = PrivexMongodbConsts()
+        return MongoClientRegistry.get_database(privex_mongodb.PRIVEX_MONGDB_URI, privex_mongodb.DB_NAME)[self.change_stream_consts.DEAD_LETTERS_COLLECTION_NAME]
+
+
+class ChangeStreamListener:
+    """
+    Watches several collections' change streams and hands their events, in batches, to a bounded worker pool.
+
+    Every subscription is read by its own thread. Events are grouped into batches of up to
+    BATCH_SIZE events, waiting at most BATCH_WAIT_SECONDS for a batch to fill, and each batch is
+    handled by one call of the subscription's handle_batch in the shared pool of MAX_WORKERS
+    threads. A subscription stops reading its stream while max_in_flight_batches of its batches
+    are unfinished, so a burst of events is absorbed by the server side cursor and results in
+    fuller batches instead of unbounded memory. Once a batch and every batch before it finished,
+    the resume token of the stream after its last event is persisted (reads without events
+    persist it too, so filtered out events are not scanned again), and a restarted listener
+    continues after the last handled event instead of missing or replaying the stream. A failing
+    batch is retried HANDLE_ATTEMPTS times with a doubling backoff, after that the stream is
+    reopened from the last handled batch, so its events are delivered again instead of lost. A
+    batch still failing after MAX_BATCH_REDELIVERIES reopenings is moved to the dead letter store
+    and skipped, so one event the handler always rejects does not stall the subscription.
+    Errors reopen the stream from the last token in a loop, a token that fell off the oplog
+    restarts the stream from now.
+
+    Parameters
+    ----------
+    subscriptions : List[ChangeStreamSubscription]
+        The watched collections and their handlers.
+    resume_token_store : Optional[ResumeTokenStore]
+        Where resume tokens are persisted, by default ResumeTokenStore().
+    dead_letter_store : Optional[DeadLetterStore]
+        Where skipped batches are persisted, by default DeadLetterStore().
+    change_stream_consts : Optional[ChangeStreamConsts]
+        Worker, batch and retry settings, by default ChangeStreamConsts().
+
+    Methods
+    -------
+    start() -> None
+        Starts the subscription threads.
+    run_forever() -> None
+        Starts the subscriptions and blocks until stop() is called.
+    stop(timeout: Optional[float]) -> None
+        Stops reading the streams and waits for the running batches.
+    """
+
+    # the resume token is no longer in the oplog, the stream can only be opened from now
+    HISTORY_LOST_ERROR_CODES = (260, 280, 286)
+
+    def __init__(self, subscriptions: List[ChangeStreamSubscription], resume_token_store: Optional[ResumeTokenStore] = None, change_stream_consts: Optional[ChangeStreamConsts] = None, dead_letter_store: Optional[DeadLetterStore] = None) -> None:
+        self.change_stream_consts = change_stream_consts or ChangeStreamConsts()
+        self.subscriptions = subscriptions
+        self.resume_token_store = resume_token_store or ResumeTokenStore(change_stream_consts=self.change_stream_consts)
+        self.dead_letter_store = dead_letter_store or DeadLetterStore(change_stream_consts=self.change_stream_consts)
+        self.max_batch_redeliveries = self.change_stream_consts.MAX_BATCH_REDELIVERIES
+        self.max_workers = self.change_stream_consts.MAX_WORKERS
+        self.batch_size = self.change_stream_consts.BATCH_SIZE
+        self.batch_wait_seconds = self.change_stream_consts.BATCH_WAIT_SECONDS
+        self.retry_seconds = self.change_stream_consts.RETRY_SECONDS
+        self.handle_attempts = self.change_stream_consts.HANDLE_ATTEMPTS
+        self.handle_retry_seconds = self.change_stream_consts.HANDLE_RETRY_SECONDS
+        self.events_handled: Dict[str, int] = {subscription.name: 0 for subscription in subscriptions}
+        self._events_handled_lock = threading.Lock()
+        # resume token after the last batch of each subscription that was handled with every batch before it
+        self._handled_resume_tokens: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """
+        Start (once) one thread per subscription.
+        """
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ChangeStreamWorker")
+        self._threads = [
+            threading.Thread(target=self._listen, args=(subscription,), name=f"ChangeStream-{subscription.name}", daemon=True)
+            for subscription in self.subscriptions
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def run_forever(self) -> None:
+        self.start()
+        while not self._stop_event.wait(1):
+            pass
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def read_batch(self, stream: Any) -> List[Dict[str, Any]]:
+        """
+        Up to batch_size events of an open change stream, waiting at most batch_wait_seconds after the first one.
+        """
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.batch_wait_seconds
+        while len(batch) < self.batch_size and not self._stop_event.is_set():
+            change = stream.try_next()
+            if change is not None:
+                batch.append(change)
+            elif not batch or time.monotonic() >= deadline or not stream.alive:
+                break
+        return batch
+
+    def handle(self, subscription: ChangeStreamSubscription, batch: List[Dict[str, Any]]) -> None:
+        """
+        Call handle_batch, retrying with a doubling backoff, the last error is raised when every attempt failed.
+        """
+        for attempt in range(self.handle_attempts):
+            try:
+                subscription.handle_batch(batch)
+                break
+            except Exception as e:
+                print(f"{subscription.name} failed to handle {len(batch)} change events (attempt {attempt + 1} of {self.handle_attempts}): {e}")
+                if attempt + 1 == self.handle_attempts or self._stop_event.wait(self.handle_retry_seconds * 2 ** attempt):
+                    raise
+        with self._events_handled_lock:
+            self.events_handled[subscription.name] += len(batch)
+
+    def _listen(self, subscription: ChangeStreamSubscription) -> None:
+        max_in_flight_batches = subscription.max_in_flight_batches or self.change_stream_consts.MAX_IN_FLIGHT_BATCHES
+        in_flight: Deque[Tuple[Future, Dict[str, Any], List[Dict[str, Any]]]] = deque()
+        resume_token = self._load_resume_token(subscription)
+        self._handled_resume_tokens[subscription.name] = resume_token
+        # reopenings from the same handled token, counted to dead letter a batch that always fails
+        redelivered_from: Optional[Dict[str, Any]] = None
+        redeliveries = 0
+
+        while not self._stop_event.is_set():
+            try:
+                with subscription.collection().watch(
+                    subscription.pipeline,
+                    full_document=subscription.full_document,
+                    resume_after=resume_token,
+                    max_await_time_ms=max(int(self.batch_wait_seconds * 1000), 1),
+                ) as stream:
+                    while not self._stop_event.is_set() and stream.alive:
+                        batch = self.read_batch(stream)
+                        self._save_finished(subscription, in_flight)
+                        # the post batch token also moves past the events the pipeline filtered out
+                        stream_resume_token = stream.resume_token or (batch[-1]["_id"] if batch else None)
+                        if not batch:
+                            if stream_resume_token is not None and stream_resume_token != resume_token:
+                                # persisted in order, once the batches before it finished
+                                resume_token = stream_resume_token
+                                in_flight.append((self._finished_future(), resume_token, []))
+                                self._save_finished(subscription, in_flight)
+                            continue
+                        self._wait_for_capacity(subscription, in_flight, max_in_flight_batches)
+                        resume_token = stream_resume_token
+                        in_flight.append((self._executor.submit(self.handle, subscription, batch), resume_token, batch))
+            except ChangeBatchError as e:
+                # the batches after the failed one are delivered again too, handle_batch is idempotent
+                wait([future for future, _, _ in in_flight])
+                in_flight.clear()
+                resume_token = self._handled_resume_tokens[subscription.name]
+                redeliveries = redeliveries + 1 if resume_token == redelivered_from else 1
+                redelivered_from = resume_token
+                if redeliveries > self.max_batch_redeliveries and self._dead_letter(subscription, e):
+                    resume_token = e.resume_token
+                    redelivered_from, redeliveries = None, 0
+                    continue
+                print(f"{subscription.name} {e}, reopening the change stream after the last handled batch in {self.retry_seconds} seconds")
+                self._stop_event.wait(self.retry_seconds)
+            except OperationFailure as e:
+                if e.code in self.HISTORY_LOST_ERROR_CODES:
+                    print(f"{subscription.name} resume token is no longer in the oplog, restarting the change stream from now")
+                    resume_token = None
+                    self.resume_token_store.clear(subscription.name)
+                else:
+                    print(f"{subscription.name} change stream error: {e}, retrying in {self.retry_seconds} seconds")
+                self._stop_event.wait(self.retry_seconds)
+            except Exception as e:
+                print(f"{subscription.name} change stream error: {e}, retrying in {self.retry_seconds} seconds")
+                self._stop_event.wait(self.retry_seconds)
+
+        wait([future for future, _, _ in in_flight])
+        try:
+            self._save_finished(subscription, in_flight)
+        except ChangeBatchError as e:
+            print(f"{subscription.name} {e}, it is delivered again on restart")
+
+    def _wait_for_capacity(self, subscription: ChangeStreamSubscription, in_flight: Deque[Tuple[Future, Dict[str, Any], List[Dict[str, Any]]]], max_in_flight_batches: int) -> None:
+        while sum(not future.done() for future, _, _ in in_flight) >= max_in_flight_batches:
+            wait([future for future, _, _ in in_flight], timeout=1, return_when=FIRST_COMPLETED)
+            self._save_finished(subscription, in_flight)
+
+    def _save_finished(self, subscription: ChangeStreamSubscription, in_flight: Deque[Tuple[Future, Dict[str, Any], List[Dict[str, Any]]]]) -> None:
+        # only a batch whose predecessors all succeeded moves the persisted position forward
+        resume_token = None
+        error = None
+        while in_flight and in_flight[0][0].done():
+            error = in_flight[0][0].exception()
+            if error is not None:
+                break
+            _, resume_token, _ = in_flight.popleft()
+        if resume_token is not None:
+            self._save_resume_token(subscription, resume_token)
+        if error is not None:
+            _, failed_resume_token, failed_batch = in_flight[0]
+            raise ChangeBatchError(f"failed to handle a batch of change events: {error}", batch=failed_batch, resume_token=failed_resume_token) from error
+
+    def _save_resume_token(self, subscription: ChangeStreamSubscription, resume_token: Dict[str, Any]) -> None:
+        self._handled_resume_tokens[subscription.name] = resume_token
+        try:
+            self.resume_token_store.save(subscription.name, resume_token)
+        except Exception as e:
+            print(f"{subscription.name} failed to save resume token: {e}")
+
+    def _dead_letter(self, subscription: ChangeStreamSubscription, error: ChangeBatchError) -> bool:
+        """
+        Persist a batch that kept failing and move the subscription past it, False (and the batch is
+        delivered again) when it could not be persisted.
+        """
+        event_ids = [change["_id"] for change in error.batch]
+        print(f"{subscription.name} skipping {len(error.batch)} change events after {self.max_batch_redeliveries} redeliveries: {error}, events {event_ids}")
+        try:
+            self.dead_letter_store.save(subscription.name, changes=error.batch, error=str(error))
+        except Exception as e:
+            print(f"{subscription.name} failed to dead letter {len(error.batch)} change events, delivering them again: {e}")
+            return False
+        self._save_resume_token(subscription, error.resume_token)
+        return True
+
+    @staticmethod
+    def _finished_future() -> Future:
+        future: Future = Future()
+        future.set_result(None)
+        return future
+
+    def _load_resume_token(self, subscription: ChangeStreamSubscription) -> Optional[Dict[str, Any]]:
+        try:
+            return self.resume_token_store.load(subscription.name)
+        except Exception as e:
+            print(f"{subscription.name} failed to load resume token, starting from now: {e}")
+            return None
@@ -0,0 +1,174 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import chromadb
+from chromadb.api import ClientAPI
+from chromadb.api.models.Collection import Collection
+from langchain_chroma import Chroma
+
+from config.config import ChromaConsts
+from rag.embedding_service import EmbeddingService
+
+
+class ChromaRegistry:
+    """
+    Process wide registry holding one persistent Chroma client per directory and one handle per collection.
+
+    Opening a PersistentClient opens its SQLite database and every collection handle loads the
+    collection's HNSW index, so every ChromaVectorStoreManager, EmbeddingModel and
+    RagDocumentLoader of the process shares the client of a directory and the handles of its
+    collections instead of opening them again per agent, tweet or cycle. Writes through any
+    handle are seen by all of them since they share one index in memory. Collections record the
+    embedding backend and model they are created with in their metadata, a collection embedded
+    with another model (e.g. OpenAI embeddings opened with the onnx backend, whose vectors differ
+    in size) fails to open instead of failing on every search.
+
+    Methods
+    -------
+    get_client(path: Optional[str]) -> ClientAPI
+        Returns the shared client of a directory, by default ChromaConsts.PERSIST_DIRECTORY.
+    get_collection(collection_name: str, path: Optional[str]) -> Collection
+        Returns the shared chromadb handle of a collection, creating the collection when missing.
+    get_vector_store(collection_name: str, path: Optional[str]) -> Chroma
+        Returns the shared langchain store of a collection, embedding with EmbeddingService.shared().
+    reset() -> None
+        Forgets every client and handle.
+    """
+
+    # collection metadata keys of the embeddings a collection holds
+    EMBEDDING_BACKEND_KEY = "embedding_backend"
+    EMBEDDING_MODEL_KEY = "embedding_model"
+
+    _clients: Dict[str, ClientAPI] = {}
+    _vector_stores: Dict[Tuple[str, str], Chroma] = {}
+    _lock = threading.RLock()
+
+    @classmethod
+    def get_client(cls, path: Optional[str] = None) -> ClientAPI:
+        path = cls._normalize(path)
+        with cls._lock:
+            client = cls._clients.get(path)
+            if client is None:
+                client = chromadb.PersistentClient(path=path)
+                cls._clients[path] = client
+            return client
+
+    @classmethod
+    def get_collection(cls, collection_name: str, path: Optional[str] = None) -> Collection:
+        # the handle of the shared langchain store, so both see the same collection without a second lookup
+        return cls.get_vector_store(collection_name, path=path)._collection
+
+    @classmethod
+    def get_vector_store(cls, collection_name: str, path: Optional[str] = None) -> Chroma:
+        """
+        Return the shared langchain store of a collection, built on first use.
+
+        Parameters
+        ----------
+        collection_name : str
+            The name of the collection.
+        path : Optional[str]
+            Directory of the persistent store, by default ChromaConsts.PERSIST_DIRECTORY.
+
+        Returns
+        -------
+        Chroma
+            The store, documents are embedded with EmbeddingService.shared().
+
+        Raises
+        ------
+        ValueError
+            The collection was embedded with another embedding model.
+        """
+        key = (cls._normalize(path), collection_name)
+        with cls._lock:
+            vector_store = cls._vector_stores.get(key)
+            if vector_store is not None:
+                return vector_store
+            embedding_service = EmbeddingService.shared()
+            vector_store = Chroma(
+                collection_name=collection_name,
+                embedding_function=embedding_service.as_langchain(),
+                client=cls.get_client(key[0]),
+                # only applied when the collection is created
+                collection_metadata=cls._embedding_metadata(embedding_service),
+            )
+            # a local metadata read, no embedding request is made while other collections wait for the lock
+            legacy_collection = not cls._check_embedding_model(vector_store._collection, embedding_service, path=key[0])
+            cls._vector_stores[key] = vector_store
+
+        if legacy_collection:
+            try:
+                cls._check_legacy_dimension(vector_store._collection, embedding_service, path=key[0])
+            except ValueError:
+                with cls._lock:
+                    if cls._vector_stores.get(key) is vector_store:
+                        del cls._vector_stores[key]
+                raise
+        return vector_store
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls._lock:
+            cls._clients.clear()
+            cls._vector_stores.clear()
+
+    @classmethod
+    def _embedding_metadata(cls, embedding_service: EmbeddingService) -> Dict[str, str]:
+        return {cls.EMBEDDING_BACKEND_KEY: embedding_service.backend.name, cls.EMBEDDING_MODEL_KEY: embedding_service.model}
+
+    @classmethod
+    def _check_embedding_model(cls, collection: Collection, embedding_service: EmbeddingService, path: str) -> bool:
+        """
+        Compare the recorded embedding model with the service's, False for a non-empty collection created before models were recorded.
+        """
+        metadata = collection.metadata or {}
+        model = metadata.get(cls.EMBEDDING_MODEL_KEY)
+        if model is None:
+            if collection.count() > 0:
+                return False
+            cls._record_embedding_model(collection, embedding_service)
+            return True
+        if model != embedding_service.model:
+            raise ValueError(
+                f"chroma collection {collection.name} in {path} was embedded with {metadata.get(cls.EMBEDDING_BACKEND_KEY)} ({model}), "
+                f"the {embedding_service.backend.name} embedding backend uses {embedding_service.model}. Switch OpenAiConsts.EMBEDDING_BACKEND "
+                f"back or re-embed the collection in another ChromaConsts.PERSIST_DIRECTORY."
+            )
+        return True
+
+    @classmethod
+    def _check_legacy_dimension(cls, collection: Collection, embedding_service: EmbeddingService, path: str) -> None:
+        # an embedding request, made outside of the lock, once per collection created before models were recorded
+        stored = collection.get(limit=1, include=["embeddings"])["embeddings"]
+        if stored is None or len(stored) == 0:
+            return
+        try:
+            dimension = embedding_service.dimension()
+        except Exception as e:
+            print(f"unable to check the embedding size of chroma collection {collection.name}: {e}")
+            return
+        if len(stored[0]) != dimension:
+            raise ValueError(
+                f"chroma collection {collection.name} in {path} holds {len(stored[0])} dimensional embeddings, "
+                f"the {embedding_service.backend.name} embedding backend ({embedding_service.model}) produces {dimension} "
+                f"dimensional ones. Switch OpenAiConsts.EMBEDDING_BACKEND back or re-embed the collection in another ChromaConsts.PERSIST_DIRECTORY."
+            )
+        cls._record_embedding_model(collection, embedding_service)
+
+    @classmethod
+    def _record_embedding_model(cls, collection: Collection, embedding_service: EmbeddingService) -> None:
+        metadata: Dict[str, Any] = dict(collection.metadata or {})
+        # modify() replaces the metadata and cannot carry the hnsw settings, such collections stay unrecorded
+        if any(name.startswith("hnsw:") for name in metadata):
+            return
+        try:
+            collection.modify(metadata={**metadata, **cls._embedding_metadata(embedding_service)})
+        except Exception as e:
+            print(f"unable to record the embedding model of chroma collection {collection.name}: {e}")
+
+    @staticmethod
+    def _normalize(path: Optional[str]) -> str:
+        # "./chroma_langchain_db" and its absolute path are the same store
+        return os.path.abspath(path or ChromaConsts().PERSIST_DIRECTORY)
@@ -5,12 +5,13 @@ from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
 
 from config.config import HubPull
 from config.config import KnowledgeBaseFilePaths
 from config.config import OpenAiConsts
+from rag.embedding_service import EmbeddingService
+from rag.chroma_registry import ChromaRegistry
+from rag.rag_chroma_client import ChromaVectorStoreManager
 
 
 class RagDocumentLoader:
@@ -103,14 +104,14 @@ class RagDocumentLoader:
         """
         if not self.splits:
             raise ValueError("No text splits found. Please split the documents first.")
-        embeddings = OpenAIEmbeddings(model=self.embedding_model)
+        embeddings = EmbeddingService.shared().as_langchain()
         self.vector_store = InMemoryVectorStore(embeddings)
         ids = self.vector_store.add_documents(documents=self.splits)
         print(f"Generated and stored embeddings for {len(ids)} documents. \n")
 
-        # for dev sanity - print vector previews
+        # for dev sanity - print vector previews, read back from the store instead of embedding the chunk again
         first_document_content = self.splits[0].page_content
-        first_vector = embeddings.embed_query(first_document_content)
+        first_vector = self.vector_store.store[ids[0]]["vector"]
         
         print("Vector Preview (First 5 dimensions):")
         print(f"Document: {first_document_content[:100]}...")
@@ -123,18 +124,14 @@ class RagDocumentLoader:
         """
         if not self.splits:
             raise ValueError("No text splits found. Please split the documents first.")
-        embeddings = OpenAIEmbeddings(model=self.embedding_model)
-        vector_store = Chroma(
-            collection_name=self.agent_info.KNOWLEDGE_BASE_COLLECTION_NAME,
-            embedding_function=embeddings,
-            persist_directory="./chroma_langchain_db", 
-        )
-        ids = vector_store.add_documents(documents=self.splits)
+        vector_store = ChromaRegistry.get_vector_store(self.agent_info.KNOWLEDGE_BASE_COLLECTION_NAME)
+        # content derived ids, chunks stored by an earlier run are neither embedded nor inserted again
+        ids = ChromaVectorStoreManager.upsert_into(vector_store=vector_store, documents=self.splits)
         print(f"Generated and stored embeddings for {len(ids)} documents. \n")
 
-        # for dev sanity - print vector previews
+        # for dev sanity - print vector previews, read back from the store instead of embedding the chunk again
         first_document_content = self.splits[0].page_content
-        first_vector = embeddings.embed_query(first_document_content)
+        first_vector = vector_store.get(ids=[ids[0]], include=["embeddings"])["embeddings"][0]
         
         print("Vector Preview (First 5 dimensions):")
         print(f"Document: {first_document_content[:100]}...")
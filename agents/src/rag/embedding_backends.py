@@ -0,0 +1,201 @@
+import os
+import abc
+import threading
+from typing import Any, Dict, Optional
+from typing_extensions import List
+
+import numpy as np
+import openai
+from dotenv import load_dotenv
+
+from config.config import EmbeddingServiceConsts, LocalEmbeddingConsts, OpenAiConsts
+
+
+class EmbeddingBackend(abc.ABC):
+    """
+    Computes the embeddings of one request of the EmbeddingService.
+
+    Attributes
+    ----------
+    name : str
+        Name of the backend in OpenAiConsts.EMBEDDING_BACKEND.
+    model : str
+        Identifies the vectors produced, embeddings of different models are never mixed in the cache.
+    max_batch_inputs : int
+        Maximum number of texts per embed_batch() call.
+    max_batch_tokens : int
+        Maximum number of estimated tokens per embed_batch() call.
+    rate_limit_provider : Optional[str]
+        SchedulerConsts.RATE_LIMITS bucket every call draws from, None when the backend is not rate limited.
+    """
+
+    name: str = ""
+    model: str = ""
+    max_batch_inputs: int = 2048
+    max_batch_tokens: int = 250000
+    rate_limit_provider: Optional[str] = None
+
+    @abc.abstractmethod
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeddings of texts, in the order of texts.
+        """
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """
+    OpenAI embeddings API, one request per batch.
+
+    Parameters
+    ----------
+    model : Optional[str]
+        Embedding model, by default OpenAiConsts.DEFAULT_EMBEDDING_MODEL.
+    embedding_service_consts : Optional[EmbeddingServiceConsts]
+        Request limits and rate limit bucket, by default EmbeddingServiceConsts().
+    """
+
+    name = "openai"
+
+    def __init__(self, model: Optional[str] = None, embedding_service_consts: Optional[EmbeddingServiceConsts] = None) -> None:
+        embedding_service_consts = embedding_service_consts or EmbeddingServiceConsts()
+        self.model = model or OpenAiConsts().DEFAULT_EMBEDDING_MODEL
+        self.max_batch_inputs = embedding_service_consts.MAX_BATCH_INPUTS
+        self.max_batch_tokens = embedding_service_consts.MAX_BATCH_TOKENS
+        self.rate_limit_provider = embedding_service_consts.RATE_LIMIT_PROVIDER
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        load_dotenv()
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OpenAI API key not found. Please set it in your environment.")
+        openai.api_key = api_key
+        response = openai.embeddings.create(model=self.model, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """
+    Local CPU sentence embeddings with onnxruntime, no network call and no rate limit.
+
+    By default the all-MiniLM-L6-v2 ONNX export that chromadb ships (downloaded once to
+    ~/.cache/chroma) is used, MODEL_DIRECTORY may point at any sentence-transformers style export
+    holding model.onnx and tokenizer.json. Texts are tokenized in batches padded to their longest
+    text, the token embeddings are mean pooled and L2 normalized like sentence-transformers does.
+    The session runs INTRA_OP_THREADS threads per batch and is shared by the EmbeddingService's
+    concurrent requests. With QUANTIZE_INT8 the weights are dynamically quantized to int8 once
+    (requires the onnx package), which is smaller and faster on CPU for slightly different vectors.
+
+    Parameters
+    ----------
+    local_embedding_consts : Optional[LocalEmbeddingConsts]
+        Model, batch, thread and quantization settings, by default LocalEmbeddingConsts().
+    session : Optional[Any]
+        onnxruntime InferenceSession to use instead of loading the model, for tests.
+    tokenizer : Optional[Any]
+        tokenizers Tokenizer to use instead of loading the model's, for tests.
+    """
+
+    name = "onnx"
+    MODEL_FILE_NAME = "model.onnx"
+    QUANTIZED_MODEL_FILE_NAME = "model.int8.onnx"
+    TOKENIZER_FILE_NAME = "tokenizer.json"
+
+    def __init__(self, local_embedding_consts: Optional[LocalEmbeddingConsts] = None, session: Optional[Any] = None, tokenizer: Optional[Any] = None) -> None:
+        self.local_embedding_consts = local_embedding_consts or LocalEmbeddingConsts()
+        self.quantize_int8 = self.local_embedding_consts.QUANTIZE_INT8
+        self.model = self.local_embedding_consts.MODEL_NAME + ("-int8" if self.quantize_int8 else "")
+        self.max_batch_inputs = self.local_embedding_consts.BATCH_SIZE
+        self.max_seq_length = self.local_embedding_consts.MAX_SEQ_LENGTH
+        self.max_batch_tokens = self.max_batch_inputs * self.max_seq_length
+        self.rate_limit_provider = None
+        self._session = session
+        self._tokenizer = tokenizer
+        self._load_lock = threading.Lock()
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        session, tokenizer = self._load()
+        encoded = tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encoded], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encoded], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": np.zeros_like(input_ids)}
+        input_names = {model_input.name for model_input in session.get_inputs()}
+        last_hidden_state = session.run(None, {name: value for name, value in inputs.items() if name in input_names})[0]
+
+        # mean of the token embeddings, padding excluded
+        mask = attention_mask[:, :, np.newaxis].astype(np.float32)
+        embeddings = (last_hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings.astype(np.float32).tolist()
+
+    def _load(self) -> Any:
+        with self._load_lock:
+            if self._session is None or self._tokenizer is None:
+                model_directory = self.local_embedding_consts.MODEL_DIRECTORY or self._chroma_model_directory()
+                if self._tokenizer is None:
+                    self._tokenizer = self._load_tokenizer(os.path.join(model_directory, self.TOKENIZER_FILE_NAME))
+                if self._session is None:
+                    self._session = self._load_session(model_directory)
+            return self._session, self._tokenizer
+
+    def _load_tokenizer(self, path: str) -> Any:
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_file(path)
+        tokenizer.enable_truncation(max_length=self.max_seq_length)
+        # pad to the longest text of the batch instead of max_seq_length
+        tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        return tokenizer
+
+    def _load_session(self, model_directory: str) -> Any:
+        import onnxruntime
+
+        model_path = os.path.join(model_directory, self.MODEL_FILE_NAME)
+        if self.quantize_int8:
+            quantized_model_path = os.path.join(model_directory, self.QUANTIZED_MODEL_FILE_NAME)
+            if not os.path.exists(quantized_model_path):
+                try:
+                    from onnxruntime.quantization import QuantType, quantize_dynamic
+                except ImportError as e:
+                    raise ImportError("int8 quantization of the local embedding model requires the onnx package, pip install onnx") from e
+                quantize_dynamic(model_path, quantized_model_path, weight_type=QuantType.QInt8)
+            model_path = quantized_model_path
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.log_severity_level = 3
+        session_options.intra_op_num_threads = self.local_embedding_consts.INTRA_OP_THREADS
+        return onnxruntime.InferenceSession(model_path, sess_options=session_options, providers=["CPUExecutionProvider"])
+
+    @staticmethod
+    def _chroma_model_directory() -> str:
+        from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+
+        chroma_model = ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+        chroma_model._download_model_if_not_exists()
+        return os.path.join(chroma_model.DOWNLOAD_PATH, chroma_model.EXTRACTED_FOLDER_NAME)
+
+
+EMBEDDING_BACKENDS: Dict[str, type] = {
+    OpenAIEmbeddingBackend.name: OpenAIEmbeddingBackend,
+    OnnxEmbeddingBackend.name: OnnxEmbeddingBackend,
+}
+
+
+def embedding_backend(name: Optional[str] = None) -> EmbeddingBackend:
+    """
+    Build an embedding backend by name.
+
+    Parameters
+    ----------
+    name : Optional[str]
+        "openai" or "onnx", by default OpenAiConsts.EMBEDDING_BACKEND.
+
+    Returns
+    -------
+    EmbeddingBackend
+        The backend with its default settings.
+    """
+    name = name or OpenAiConsts().EMBEDDING_BACKEND
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend {name}, expected one of {list(EMBEDDING_BACKENDS)}")
+    return EMBEDDING_BACKENDS[name]()
@@ -0,0 +1,279 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from typing_extensions import List
+
+import numpy as np
+
+from config.config import EmbeddingCacheConsts
+
+
+class EmbeddingCache:
+    """
+    A content addressed LRU cache of embeddings keyed by (model, sha256 of the text).
+
+    One instance is shared by every EmbeddingService of the process (see EmbeddingCache.shared()),
+    so a persona, a Coinmarketcap chunk or a prior tweet that was embedded once is never sent to the
+    provider again. Vectors are stored as float32 blobs in SQLite, which keeps them across restarts,
+    the MEMORY_ENTRIES most recently used ones are also held in memory. When the stored vectors
+    exceed max_bytes the least recently used ones are evicted. Uses are recorded in memory and
+    written with the next set_many(), so a lookup never writes to disk.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Size cap of the stored vectors.
+    sqlite_path : str, optional
+        Path of the SQLite file backing the cache, by default "" (memory only, max_bytes caps the memory tier).
+    memory_entries : int, optional
+        Maximum number of vectors held in memory, by default 10000.
+    clock : Callable[[], float], optional
+        Wall clock used for recency, by default time.time.
+
+    Attributes
+    ----------
+    hits : int
+        Number of embeddings served from the cache.
+    misses : int
+        Number of embeddings that had to be requested from the provider.
+    """
+
+    _shared: Optional["EmbeddingCache"] = None
+    _shared_lock = threading.Lock()
+    # least recently used rows deleted per eviction query
+    EVICTION_BATCH_SIZE = 256
+
+    def __init__(self, max_bytes: int, sqlite_path: str = "", memory_entries: int = 10000, clock: Callable[[], float] = time.time) -> None:
+        self.max_bytes = max_bytes
+        self.sqlite_path = sqlite_path
+        self.memory_entries = memory_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._touched: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+        if self.sqlite_path:
+            self._connection = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "size INTEGER NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._connection.commit()
+            self._disk_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @classmethod
+    def shared(cls) -> "EmbeddingCache":
+        """
+        Return the process wide embedding cache, built from EmbeddingCacheConsts on first use.
+
+        Returns
+        -------
+        EmbeddingCache
+            The shared cache instance.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                embedding_cache_consts = EmbeddingCacheConsts()
+                cls._shared = cls(
+                    max_bytes=embedding_cache_consts.MAX_BYTES,
+                    sqlite_path=embedding_cache_consts.PATH,
+                    memory_entries=embedding_cache_consts.MEMORY_ENTRIES,
+                )
+            return cls._shared
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: Iterable[str]) -> Dict[str, List[float]]:
+        """
+        Look up the embeddings of many texts at once.
+
+        Parameters
+        ----------
+        model : str
+            Embedding model the vectors were computed with.
+        texts : Iterable[str]
+            Texts to look up.
+
+        Returns
+        -------
+        Dict[str, List[float]]
+            Cached embeddings keyed by text, missing texts are left out.
+        """
+        texts = list(dict.fromkeys(texts))
+        found: Dict[str, List[float]] = {}
+        now = self.clock()
+
+        with self._lock:
+            on_disk = {}
+            for text in texts:
+                key = (model, self.text_hash(text))
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[text] = vector.tolist()
+                    if self._connection is not None:
+                        self._touched[key] = now
+                elif self._connection is not None:
+                    on_disk[key[1]] = text
+
+            if on_disk:
+                rows = []
+                hashes = list(on_disk)
+                # stay below SQLite's limit of host parameters per statement
+                for start in range(0, len(hashes), 500):
+                    chunk = hashes[start:start + 500]
+                    rows.extend(self._connection.execute(
+                        f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({', '.join('?' * len(chunk))})",
+                        (model, *chunk),
+                    ).fetchall())
+                for text_hash, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember((model, text_hash), vector)
+                    found[on_disk[text_hash]] = vector.tolist()
+                    self._touched[(model, text_hash)] = now
+
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text]).get(text)
+
+    def set_many(self, model: str, embeddings_by_text: Dict[str, List[float]]) -> None:
+        """
+        Store freshly computed embeddings and evict the least recently used ones above the size cap.
+
+        Parameters
+        ----------
+        model : str
+            Embedding model the vectors were computed with.
+        embeddings_by_text : Dict[str, List[float]]
+            Embeddings keyed by text.
+        """
+        if not embeddings_by_text:
+            return
+
+        now = self.clock()
+        with self._lock:
+            rows = []
+            for text, embedding in embeddings_by_text.items():
+                key = (model, self.text_hash(text))
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((model, key[1], vector.tobytes(), vector.nbytes, now))
+                self._touched.pop(key, None)
+
+            if self._connection is None:
+                return
+            self._write_touched()
+            for row in rows:
+                cursor = self._connection.execute(
+                    "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, size, last_used) VALUES (?, ?, ?, ?, ?)", row
+                )
+                if cursor.rowcount:
+                    self._disk_bytes += row[3]
+                else:
+                    # the same text embedded by the same model gives the same vector, a stored one is only marked as used
+                    self._connection.execute("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?", (now, model, row[1]))
+            self._evict_from_disk()
+            self._connection.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Hit/miss counters, every hit is an embedding that was not requested from the provider.
+
+        Returns
+        -------
+        Dict[str, float]
+            hits, misses, hit_rate, the number of vectors in memory and the bytes stored on disk.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+            self._touched.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM embeddings")
+                self._connection.commit()
+                self._disk_bytes = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._write_touched()
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
+
+    def _remember(self, key: Tuple[str, str], vector: np.ndarray) -> None:
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous.nbytes
+        self._entries[key] = vector
+        self._memory_bytes += vector.nbytes
+        # without a disk tier the byte cap applies to memory
+        max_memory_bytes = self.max_bytes if self._connection is None else float("inf")
+        while self._entries and (len(self._entries) > self.memory_entries or self._memory_bytes > max_memory_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def _write_touched(self) -> None:
+        if self._touched:
+            self._connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(last_used, model, text_hash) for (model, text_hash), last_used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _evict_from_disk(self) -> None:
+        while self._disk_bytes > self.max_bytes:
+            rows = self._connection.execute(
+                "SELECT model, text_hash, size FROM embeddings ORDER BY last_used LIMIT ?",
+                (self.EVICTION_BATCH_SIZE,),
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                return
+            evicted = []
+            for model, text_hash, size in rows:
+                if self._disk_bytes <= self.max_bytes:
+                    break
+                evicted.append((model, text_hash))
+                self._disk_bytes -= size
+            self._connection.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", evicted)
+            for key in evicted:
+                vector = self._entries.pop(key, None)
+                if vector is not None:
+                    self._memory_bytes -= vector.nbytes
+
+    @classmethod
+    def _reset_after_fork(cls) -> None:
+        # a sqlite connection must not be used across a fork, a forked process opens its own cache
+        cls._shared_lock = threading.Lock()
+        cls._shared = None
+
+
+os.register_at_fork(after_in_child=EmbeddingCache._reset_after_fork)
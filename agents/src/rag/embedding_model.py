@@ -4,13 +4,13 @@ from dotenv import load_dotenv
 import json
 
 from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.document_loaders import JSONLoader
 from langchain_text_splitters import RecursiveJsonSplitter
-from langchain_chroma import Chroma
 
 from config.config import GeneratedTradesFilePaths
 from config.config import OpenAiConsts
+from rag.chroma_registry import ChromaRegistry
+from rag.rag_chroma_client import ChromaVectorStoreManager
 from config.config import KnowledgeBaseFilePaths
 from config.config import HubPull
 
@@ -164,7 +164,11 @@ class EmbeddingModel:
             # json_chunks = splitter.split_json(json_data=json_data)
             # for chunk in json_chunks[:3]:
             #     print(chunk)
-            docs = splitter.create_documents(texts=[json_data], metadatas=[{"source": metadata_source}])
+            metadata = {"source": metadata_source}
+            # token stats carry their symbol, so searches can be pre-filtered on it
+            if isinstance(json_data, dict) and isinstance(json_data.get("symbol"), str):
+                metadata["symbol"] = json_data["symbol"].upper()
+            docs = splitter.create_documents(texts=[json_data], metadatas=[metadata])
             all_docs.extend(docs)
 
         return all_docs
@@ -181,18 +185,14 @@ class EmbeddingModel:
         self.splits = text_chunks
         if not self.splits:
             raise ValueError("No text splits found. Please split the documents first.")
-        embeddings = OpenAIEmbeddings(model=self.embedding_model)
-        vector_store = Chroma(
-            collection_name=self.agent_info.KNOWLEDGE_BASE_COLLECTION_NAME,
-            embedding_function=embeddings,
-            persist_directory="./chroma_langchain_db", 
-        )
-        ids = vector_store.add_documents(documents=self.splits)
+        vector_store = ChromaRegistry.get_vector_store(self.agent_info.KNOWLEDGE_BASE_COLLECTION_NAME)
+        # content derived ids, chunks stored by an earlier run are neither embedded nor inserted again
+        ids = ChromaVectorStoreManager.upsert_into(vector_store=vector_store, documents=self.splits)
         print(f"Generated and stored embeddings for {len(ids)} documents. \n")
 
-        # for dev sanity - print vector previews
+        # for dev sanity - print vector previews, read back from the store instead of embedding the chunk again
         first_document_content = self.splits[0].page_content
-        first_vector = embeddings.embed_query(first_document_content)
+        first_vector = vector_store.get(ids=[ids[0]], include=["embeddings"])["embeddings"][0]
         
         print("Vector Preview (First 5 dimensions):")
         print(f"Document: {first_document_content[:100]}...")
@@ -0,0 +1,302 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from typing_extensions import List
+
+from langchain_core.embeddings import Embeddings
+
+from config.config import EmbeddingCacheConsts, EmbeddingServiceConsts
+from ica.rate_limiter import RateLimiter
+from rag.embedding_backends import EmbeddingBackend, embedding_backend
+from rag.embedding_cache import EmbeddingCache
+
+
+class EmbeddingService:
+    """
+    Process wide embeddings endpoint that coalesces concurrent requests into batched API calls.
+
+    Texts are submitted from any thread and answered with futures. A dispatcher thread collects
+    the texts submitted within COALESCE_WINDOW_SECONDS of each other, drops duplicates and cuts
+    them into requests within the backend's max_batch_inputs and max_batch_tokens (estimated).
+    Up to MAX_CONCURRENT_REQUESTS requests run at once, each one taking a token of the backend's
+    rate limiter first, so a burst of OpenAI embeddings from every agent, ingestion and script
+    shares one budget. Texts found in the embedding cache are answered without a request, and
+    every computed embedding is cached. A request rejected for its input is split in halves until
+    the rejected text is sent alone, so only the callers waiting for that text get the error.
+
+    Parameters
+    ----------
+    backend : Optional[EmbeddingBackend]
+        Computes the embeddings of a request, by default the OpenAiConsts.EMBEDDING_BACKEND backend.
+    rate_limiter : Optional[RateLimiter]
+        Limiter every request is taken from, by default the shared limiter of the backend's
+        rate_limit_provider, none for a backend without one.
+    embedding_service_consts : Optional[EmbeddingServiceConsts]
+        Coalescing, batch and concurrency settings, by default EmbeddingServiceConsts().
+    cache : Optional[EmbeddingCache]
+        Cache looked up before and filled after every request, by default none. shared() uses
+        EmbeddingCache.shared() unless EmbeddingCacheConsts.ENABLED is False.
+
+    Methods
+    -------
+    shared(backend: Optional[str]) -> EmbeddingService
+        Returns the process wide service of a backend.
+    submit(text: str) -> Future
+        Queues one text, the future resolves to its embedding.
+    submit_many(texts: List[str]) -> List[Future]
+        Queues many texts.
+    embed(texts: List[str]) -> List[List[float]]
+        Embeds texts, blocking until every embedding is known.
+    dimension() -> int
+        Size of the backend's vectors.
+    as_langchain() -> Embeddings
+        The service as a langchain Embeddings, for vector stores.
+    """
+
+    # rough size of a token of english text, used to respect MAX_BATCH_TOKENS without a tokenizer
+    CHARACTERS_PER_TOKEN = 4
+    # embedded once per service to learn the size of the backend's vectors
+    DIMENSION_PROBE_TEXT = "dimension"
+    # HTTP statuses of a request rejected for its input rather than for the provider's state
+    INPUT_ERROR_STATUS_CODES = (400, 413, 422)
+
+    _shared: Dict[str, "EmbeddingService"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, backend: Optional[EmbeddingBackend] = None, rate_limiter: Optional[RateLimiter] = None, embedding_service_consts: Optional[EmbeddingServiceConsts] = None, cache: Optional[EmbeddingCache] = None) -> None:
+        self.embedding_service_consts = embedding_service_consts or EmbeddingServiceConsts()
+        self.backend = backend or embedding_backend()
+        self.model = self.backend.model
+        if rate_limiter is None and self.backend.rate_limit_provider:
+            rate_limiter = RateLimiter.for_provider(self.backend.rate_limit_provider)
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.coalesce_window_seconds = self.embedding_service_consts.COALESCE_WINDOW_SECONDS
+        self.max_batch_inputs = self.backend.max_batch_inputs
+        self.max_batch_tokens = self.backend.max_batch_tokens
+        self.requests_sent = 0
+        self.texts_embedded = 0
+        self._stats_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.embedding_service_consts.MAX_CONCURRENT_REQUESTS, thread_name_prefix="EmbeddingRequest")
+        self._dispatcher: Optional[threading.Thread] = None
+        self._dispatcher_lock = threading.Lock()
+        self._dimension: Optional[int] = None
+
+    @classmethod
+    def shared(cls, backend: Optional[str] = None) -> "EmbeddingService":
+        """
+        Return the process wide service of a backend, by default OpenAiConsts.EMBEDDING_BACKEND.
+        """
+        backend = embedding_backend(backend)
+        with cls._shared_lock:
+            if backend.name not in cls._shared:
+                cache = EmbeddingCache.shared() if EmbeddingCacheConsts().ENABLED else None
+                cls._shared[backend.name] = cls(backend=backend, cache=cache)
+            return cls._shared[backend.name]
+
+    def submit(self, text: str) -> Future:
+        """
+        Queue a text to be embedded with the texts submitted around the same time.
+
+        Parameters
+        ----------
+        text : str
+            The text to embed.
+
+        Returns
+        -------
+        Future
+            Resolves to the embedding, or raises the error of the request it was part of.
+        """
+        return self.submit_many([text])[0]
+
+    def submit_many(self, texts: List[str]) -> List[Future]:
+        """
+        Queue many texts, the ones already in the cache get a future that is already resolved.
+        """
+        cached = {}
+        if self.cache is not None and texts:
+            try:
+                cached = self.cache.get_many(self.model, texts)
+            except Exception as e:
+                print(f"embedding cache lookup failed, requesting {len(texts)} embeddings: {e}")
+        futures = []
+        for text in texts:
+            future: Future = Future()
+            if text in cached:
+                future.set_result(cached[text])
+            else:
+                self._start_dispatcher()
+                self._queue.put((text, future))
+            futures.append(future)
+        return futures
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [future.result() for future in self.submit_many(texts)]
+
+    def embed_one(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def dimension(self) -> int:
+        """
+        Size of the backend's vectors, found by embedding a probe text on first use.
+        """
+        if self._dimension is None:
+            self._dimension = len(self.embed_one(self.DIMENSION_PROBE_TEXT))
+        return self._dimension
+
+    def as_langchain(self) -> "ServiceEmbeddings":
+        return ServiceEmbeddings(self)
+
+    def estimate_tokens(self, text: str) -> int:
+        return len(text) // self.CHARACTERS_PER_TOKEN + 1
+
+    def make_batches(self, pending: List[Tuple[str, Future]]) -> List[Dict[str, List[Future]]]:
+        """
+        Cut pending texts into requests within the provider limits, a text submitted several times is sent once.
+
+        Parameters
+        ----------
+        pending : List[Tuple[str, Future]]
+            (text, future) pairs in submission order.
+
+        Returns
+        -------
+        List[Dict[str, List[Future]]]
+            One {text: futures waiting for it} mapping per request.
+        """
+        batches: List[Dict[str, List[Future]]] = []
+        batch: Dict[str, List[Future]] = {}
+        batch_tokens = 0
+        for text, future in pending:
+            if text in batch:
+                batch[text].append(future)
+                continue
+            tokens = self.estimate_tokens(text)
+            if batch and (len(batch) >= self.max_batch_inputs or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch = {}
+                batch_tokens = 0
+            batch[text] = [future]
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def is_input_error(self, error: Exception) -> bool:
+        """
+        Whether a failed request was rejected for one of its texts, a provider error (rate limit, outage) is not retried in parts.
+        """
+        if getattr(error, "status_code", None) in self.INPUT_ERROR_STATUS_CODES:
+            return True
+        # local backends reject a text while tokenizing it
+        return isinstance(error, (ValueError, TypeError, UnicodeError))
+
+    def close(self) -> None:
+        """
+        Stop the dispatcher once the queued texts are sent and wait for the running requests.
+        """
+        with self._dispatcher_lock:
+            dispatcher = self._dispatcher
+            self._dispatcher = None
+        if dispatcher is not None:
+            self._queue.put(None)
+            dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    def _start_dispatcher(self) -> None:
+        with self._dispatcher_lock:
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch, name=f"EmbeddingService-{self.model}", daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch(self) -> None:
+        stopped = False
+        while not stopped:
+            item = self._queue.get()
+            if item is None:
+                break
+            pending = [item]
+            deadline = time.monotonic() + self.coalesce_window_seconds
+            # keep collecting until the window closed and nothing else is queued
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                pending.append(item)
+            for batch in self.make_batches(pending):
+                self._executor.submit(self._send, batch)
+
+    def _send(self, batch: Dict[str, List[Future]]) -> None:
+        texts = list(batch)
+        try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            embeddings = self.backend.embed_batch(texts)
+            if len(embeddings) != len(texts):
+                raise ValueError(f"expected {len(texts)} embeddings, got {len(embeddings)}")
+        except Exception as e:
+            if len(texts) > 1 and self.is_input_error(e):
+                print(f"embedding request of {len(texts)} texts was rejected, sending it in two parts: {e}")
+                middle = len(texts) // 2
+                self._send({text: batch[text] for text in texts[:middle]})
+                self._send({text: batch[text] for text in texts[middle:]})
+                return
+            print(f"Error generating embeddings for {len(texts)} texts: {e}")
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        with self._stats_lock:
+            self.requests_sent += 1
+            self.texts_embedded += len(texts)
+        if self.cache is not None:
+            try:
+                self.cache.set_many(self.model, dict(zip(texts, embeddings)))
+            except Exception as e:
+                print(f"failed to cache {len(texts)} embeddings: {e}")
+        for text, embedding in zip(texts, embeddings):
+            for future in batch[text]:
+                if not future.done():
+                    future.set_result(list(embedding))
+
+    @classmethod
+    def _reset_after_fork(cls) -> None:
+        # the dispatcher and request threads do not exist in a forked process, it builds its own services
+        cls._shared_lock = threading.Lock()
+        cls._shared = {}
+
+
+class ServiceEmbeddings(Embeddings):
+    """
+    langchain Embeddings backed by an EmbeddingService, a drop in replacement for OpenAIEmbeddings
+    whose requests are coalesced with every other embedding of the process.
+
+    Parameters
+    ----------
+    service : Optional[EmbeddingService]
+        The service embeddings are requested from, by default EmbeddingService.shared().
+    """
+
+    def __init__(self, service: Optional[EmbeddingService] = None) -> None:
+        self.service = service or EmbeddingService.shared()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.service.embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.service.embed_one(text)
+
+
+os.register_at_fork(after_in_child=EmbeddingService._reset_after_fork)
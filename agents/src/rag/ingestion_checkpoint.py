@@ -0,0 +1,152 @@
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+
+from config.config import NfaIngestionConsts, PrivexMongodbConsts
+from rag.mongo_client_registry import MongoClientRegistry
+
+
+class IngestionCheckpoint:
+    """
+    Persisted (time field, _id) high-water mark of an incrementally ingested collection.
+
+    stream() only returns the documents written after the stored mark, in (time field, _id) order,
+    so every ingestion cycle reads the new documents instead of a whole trailing window and
+    overlapping windows never ingest a document twice. The mark is advanced as documents are
+    streamed and persisted by commit() once they were processed, a failed cycle reads them again.
+
+    A time field set by the writer rather than at insertion (e.g. the posting time of a scraped
+    tweet) can be older than the mark when the document is inserted, such collections are streamed
+    with time_field="_id" so the mark is the insertion ordered ObjectId alone.
+
+    Parameters
+    ----------
+    name : str
+        Name of the checkpoint, e.g. "rag_pipeline:twitterposts".
+    checkpoints_collection : Optional[Callable[[], Collection]]
+        Returns the collection checkpoints are stored in, by default
+        NfaIngestionConsts.CHECKPOINT_COLLECTION_NAME of the privex database.
+    nfa_ingestion_consts : Optional[NfaIngestionConsts]
+        Checkpoint collection and batch size settings, by default NfaIngestionConsts().
+
+    Methods
+    -------
+    stream(collection: Collection, time_field: str, since: datetime, projection: Optional[Dict], batch_size: Optional[int]) -> Iterator[Dict]
+        Yields the documents written after the high-water mark.
+    commit() -> None
+        Persists the mark of the last streamed document.
+    """
+
+    # (database, collection, time field) already indexed by this process
+    _indexed: Set[Tuple[str, str, str]] = set()
+    _indexed_lock = threading.Lock()
+
+    def __init__(self, name: str, checkpoints_collection: Optional[Callable[[], Collection]] = None, nfa_ingestion_consts: Optional[NfaIngestionConsts] = None) -> None:
+        self.nfa_ingestion_consts = nfa_ingestion_consts or NfaIngestionConsts()
+        self.name = name
+        self.checkpoints_collection = checkpoints_collection or self._privex_checkpoints
+        self.watermark: Optional[Dict[str, Any]] = None
+        self._pending: Optional[Dict[str, Any]] = None
+        self._loaded = False
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        The stored high-water mark, {"time": datetime, "_id": Any} or None before the first commit.
+        """
+        if not self._loaded:
+            document = self.checkpoints_collection().find_one({"_id": self.name})
+            self.watermark = {"time": document["time"], "_id": document["lastId"]} if document else None
+            self._loaded = True
+        return self.watermark
+
+    def stream(self, collection: Collection, time_field: str, since: datetime, projection: Optional[Dict[str, Any]] = None, batch_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the documents of a collection written after the high-water mark, or after since when
+        the mark is older than since (or missing).
+
+        Parameters
+        ----------
+        collection : Collection
+            The ingested collection.
+        time_field : str
+            Insertion time field of the collection, e.g. "createdAt", or "_id" to order by the
+            ObjectIds (their insertion time) alone.
+        since : datetime
+            Oldest time ingested, bounds the first run and a checkpoint that fell behind.
+        projection : Optional[Dict[str, Any]]
+            Fields returned, by default every field. time_field and _id are always returned.
+        batch_size : Optional[int]
+            Documents per cursor batch, by default NfaIngestionConsts.BATCH_SIZE.
+
+        Yields
+        ------
+        Dict[str, Any]
+            The new documents in (time_field, _id) order.
+        """
+        watermark = self._pending or self.load()
+        if time_field == "_id":
+            # ObjectIds embed their insertion time (naive datetimes are local, like datetime.now())
+            since_id = ObjectId.from_datetime(since.astimezone(timezone.utc))
+            query = {"_id": {"$gt": watermark["_id"] if watermark is not None and watermark["_id"] >= since_id else since_id}}
+            sort = [("_id", ASCENDING)]
+        else:
+            self.ensure_index(collection=collection, time_field=time_field)
+            if watermark is not None and watermark["time"] >= since:
+                query = {"$or": [
+                    {time_field: {"$gt": watermark["time"]}},
+                    {time_field: watermark["time"], "_id": {"$gt": watermark["_id"]}},
+                ]}
+            else:
+                query = {time_field: {"$gt": since}}
+            sort = [(time_field, ASCENDING), ("_id", ASCENDING)]
+
+        if projection is not None:
+            projection = {**projection, time_field: 1, "_id": 1}
+
+        cursor = collection.find(query, projection=projection, batch_size=batch_size or self.nfa_ingestion_consts.BATCH_SIZE)
+        for document in cursor.sort(sort):
+            self._pending = {"time": document[time_field], "_id": document["_id"]}
+            yield document
+
+    def commit(self) -> None:
+        """
+        Persist the mark of the last streamed document, nothing happens when no new document was streamed.
+        """
+        if self._pending is None:
+            return
+        self.checkpoints_collection().update_one(
+            {"_id": self.name},
+            {"$set": {"time": self._pending["time"], "lastId": self._pending["_id"], "updatedAt": datetime.now()}},
+            upsert=True,
+        )
+        self.watermark = self._pending
+        self._pending = None
+
+    def rollback(self) -> None:
+        """
+        Forget the documents streamed since the last commit, the next stream() returns them again.
+        """
+        self._pending = None
+
+    @classmethod
+    def ensure_index(cls, collection: Collection, time_field: str) -> None:
+        """
+        Create the (time_field, _id) index the stream is sorted on, once per process, a read only user only gets a warning.
+        """
+        key = (collection.database.name, collection.name, time_field)
+        with cls._indexed_lock:
+            if key in cls._indexed:
+                return
+            cls._indexed.add(key)
+        try:
+            collection.create_index([(time_field, ASCENDING), ("_id", ASCENDING)])
+        except Exception as e:
+            print(f"unable to ensure {time_field} index on {collection.name}: {e}")
+
+    def _privex_checkpoints(self) -> Collection:
+        privex_mongodb = PrivexMongodbConsts()
+        return MongoClientRegistry.get_database(privex_mongodb.PRIVEX_MONGDB_URI, privex_mongodb.DB_NAME)[self.nfa_ingestion_consts.CHECKPOINT_COLLECTION_NAME]
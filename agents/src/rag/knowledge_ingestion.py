@@ -0,0 +1,168 @@
+import json
+from dataclasses import replace
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+from typing_extensions import List
+
+from langchain_text_splitters import RecursiveJsonSplitter
+from pymongo.database import Database
+
+from config.config import ChangeStreamConsts, KnowledgeIngestionConsts, MFAMongodbConsts
+from rag.change_stream_listener import ChangeStreamListener, ChangeStreamSubscription, ResumeTokenStore
+from rag.mongo_client_registry import MongoClientRegistry
+from rag.rag_chroma_client import ChromaVectorStoreManager
+
+
+class KnowledgeIngestionDaemon:
+    """
+    Streams new and changed NFA documents into the chroma knowledge base as they are written.
+
+    A ChangeStreamListener subscription per collection of KnowledgeIngestionConsts.SOURCES
+    (twitterposts, opportunities and tokens) delivers inserted, updated and replaced documents in
+    batches of up to BATCH_SIZE documents, waiting at most BATCH_WAIT_SECONDS for a batch to fill,
+    and every batch is embedded with one embeddings request. Batches of a collection are embedded
+    in stream order, one at a time, the stream is not read further meanwhile. Chunks are stored
+    under IDs derived from their content and the document's mongo _id, so a changed document only
+    embeds its new or changed chunks and the chunks it no longer has are deleted. Resume tokens are
+    persisted once a batch is stored, so a restart continues where ingestion stopped. Nothing runs
+    while no document changes.
+
+    Parameters
+    ----------
+    manager : Optional[ChromaVectorStoreManager]
+        Store the documents are embedded into, by default the CHROMA_COLLECTION_NAME collection.
+    database : Optional[Callable[[], Database]]
+        Returns the watched NFA database, by default built from MFAMongodbConsts.
+    knowledge_ingestion_consts : Optional[KnowledgeIngestionConsts]
+        Watched collections and batch settings, by default KnowledgeIngestionConsts().
+    resume_token_store : Optional[ResumeTokenStore]
+        Where the listener persists its resume tokens, by default ResumeTokenStore().
+
+    Methods
+    -------
+    start() -> None
+        Starts the change stream listener.
+    stop() -> None
+        Stops the listener once the running batches are stored.
+    subscriptions() -> List[ChangeStreamSubscription]
+        One subscription per watched collection.
+    ingest_batch(batch: List[Tuple[str, Dict[str, Any]]]) -> List[str]
+        Embeds a batch of documents into chroma.
+    """
+
+    # a chunk is identified by its content and the document it belongs to
+    DOCUMENT_ID_FIELDS = ("source", "mongo_id")
+    # insertion time fields of the NFA collections, stored as created_at metadata for time range searches
+    TIME_FIELDS = ("createdAt", "created_at")
+
+    def __init__(self, manager: Optional[ChromaVectorStoreManager] = None, database: Optional[Callable[[], Database]] = None, knowledge_ingestion_consts: Optional[KnowledgeIngestionConsts] = None, resume_token_store: Optional[ResumeTokenStore] = None) -> None:
+        self.knowledge_ingestion_consts = knowledge_ingestion_consts or KnowledgeIngestionConsts()
+        self.sources = self.knowledge_ingestion_consts.SOURCES
+        self._manager = manager
+        self.database = database or self._mfa_database
+        self.splitter = RecursiveJsonSplitter(max_chunk_size=300)
+        self.documents_ingested = 0
+        self.listener = ChangeStreamListener(
+            subscriptions=self.subscriptions(),
+            resume_token_store=resume_token_store,
+            change_stream_consts=replace(
+                ChangeStreamConsts(),
+                BATCH_SIZE=self.knowledge_ingestion_consts.BATCH_SIZE,
+                BATCH_WAIT_SECONDS=self.knowledge_ingestion_consts.BATCH_WAIT_SECONDS,
+            ),
+        )
+
+    @property
+    def manager(self) -> ChromaVectorStoreManager:
+        # built on first use, so the daemon can be created before the OpenAI key is loaded
+        if self._manager is None:
+            self._manager = ChromaVectorStoreManager(self.knowledge_ingestion_consts.CHROMA_COLLECTION_NAME)
+        return self._manager
+
+    def start(self) -> None:
+        self.listener.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self.listener.stop(timeout=timeout)
+
+    def subscriptions(self) -> List[ChangeStreamSubscription]:
+        """
+        One change stream subscription per watched collection, handling its batches in stream order.
+        """
+        return [
+            ChangeStreamSubscription(
+                name=f"knowledge_ingestion:{collection_name}",
+                collection=lambda collection_name=collection_name: self.database()[collection_name],
+                handle_batch=lambda changes, collection_name=collection_name: self.ingest_changes(collection_name=collection_name, changes=changes),
+                max_in_flight_batches=1,
+            )
+            for collection_name in self.sources
+        ]
+
+    def ingest_changes(self, collection_name: str, changes: List[Dict[str, Any]]) -> List[str]:
+        return self.ingest_batch([(collection_name, change["fullDocument"]) for change in changes if change.get("fullDocument")])
+
+    def ingest_batch(self, batch: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        """
+        Replace the chroma chunks of a batch of documents with their current content, the new or changed
+        chunks are embedded in one embeddings request.
+
+        Parameters
+        ----------
+        batch : List[Tuple[str, Dict[str, Any]]]
+            (collection name, mongo document) pairs.
+
+        Returns
+        -------
+        List[str]
+            IDs of the current chroma chunks of the documents.
+        """
+        # the latest version of a document wins when it changed more than once in the batch
+        latest_documents = {(collection_name, str(document["_id"])): (collection_name, document) for collection_name, document in batch}
+
+        documents = []
+        for (collection_name, mongo_id), (_, document) in latest_documents.items():
+            documents.extend(self.splitter.create_documents(
+                texts=[self.format_document(collection_name=collection_name, document=document)],
+                metadatas=[self.metadata(collection_name=collection_name, mongo_id=mongo_id, document=document)],
+            ))
+
+        if not documents:
+            return []
+
+        ids = self.manager.replace_documents_where(
+            filters={"mongo_id": {"$in": [mongo_id for _, mongo_id in latest_documents]}},
+            documents=documents,
+            key_fields=self.DOCUMENT_ID_FIELDS,
+        )
+        self.documents_ingested += len(latest_documents)
+        print(f"ingested {len(latest_documents)} NFA documents as {len(ids)} chroma documents \n")
+        return ids
+
+    def metadata(self, collection_name: str, mongo_id: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Chroma metadata of the chunks of a document, including the fields ChromaVectorStoreManager.search() filters on.
+        """
+        metadata: Dict[str, Any] = {"source": self.sources[collection_name], "collection": collection_name, "mongo_id": mongo_id}
+        for time_field in self.TIME_FIELDS:
+            if isinstance(document.get(time_field), datetime):
+                metadata["created_at"] = document[time_field].timestamp()
+                break
+        if isinstance(document.get("symbol"), str):
+            metadata["symbol"] = document["symbol"].upper()
+        return metadata
+
+    @staticmethod
+    def format_document(collection_name: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        JSON friendly content of a mongo document, opportunities keep only their data like query_nfa_collection_by_most_recent_entries().
+        """
+        if collection_name == "opportunities":
+            return {str(document["_id"]): {"data": str(document.get("data"))}}
+        # ObjectIds and datetimes become strings
+        return json.loads(json.dumps(document, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value)))
+
+    @staticmethod
+    def _mfa_database() -> Database:
+        mfa_mongodb = MFAMongodbConsts()
+        return MongoClientRegistry.get_database(mfa_mongodb.MFA_MONGDB_URI, mfa_mongodb.DB_NAME)
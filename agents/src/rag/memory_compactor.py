@@ -0,0 +1,115 @@
+import threading
+from typing import Callable, Dict, Optional
+from typing_extensions import List
+
+from config.config import ShortTermMemoryConsts
+from rag.chroma_registry import ChromaRegistry
+from rag.rag_chroma_client import ChromaVectorStoreManager
+
+
+class MemoryCompactor:
+    """
+    Background thread deleting the expired short term memory of the chroma collections in bulk.
+
+    Short term memory is written with ChromaVectorStoreManager.remember() and is hidden from
+    searches as soon as it expires, so the compactor only bounds the size of the collections and
+    their index: every COMPACTION_INTERVAL_SECONDS the expired documents of each collection of
+    ShortTermMemoryConsts.COLLECTION_NAMES (every collection of the chroma store when empty) are
+    deleted, COMPACTION_BATCH_SIZE per request. Memory left behind by a failed cycle or agent
+    expires like any other.
+
+    Parameters
+    ----------
+    managers : Optional[Dict[str, ChromaVectorStoreManager]]
+        Managers of the compacted collections keyed by collection name, by default one per
+        collection_names(), built on first compaction.
+    short_term_memory_consts : Optional[ShortTermMemoryConsts]
+        Collections, interval and batch settings, by default ShortTermMemoryConsts().
+    clock : Optional[Callable[[], float]]
+        Returns the epoch seconds documents expired by, by default the current time.
+
+    Methods
+    -------
+    start() -> None
+        Starts the compaction thread.
+    stop(timeout: Optional[float]) -> None
+        Stops the compaction thread.
+    compact() -> Dict[str, int]
+        Deletes the expired documents of every collection once.
+    collection_names() -> List[str]
+        The compacted collections.
+    """
+
+    def __init__(self, managers: Optional[Dict[str, ChromaVectorStoreManager]] = None, short_term_memory_consts: Optional[ShortTermMemoryConsts] = None, clock: Optional[Callable[[], float]] = None) -> None:
+        self.short_term_memory_consts = short_term_memory_consts or ShortTermMemoryConsts()
+        self.interval = self.short_term_memory_consts.COMPACTION_INTERVAL_SECONDS
+        self.batch_size = self.short_term_memory_consts.COMPACTION_BATCH_SIZE
+        self.clock = clock
+        self.documents_deleted = 0
+        self._managers: Dict[str, ChromaVectorStoreManager] = dict(managers or {})
+        self._collection_names: List[str] = list(managers) if managers else list(self.short_term_memory_consts.COLLECTION_NAMES)
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def collection_names(self) -> List[str]:
+        if self._collection_names:
+            return list(self._collection_names)
+        # collections are created per agent, list them again on every compaction
+        return [getattr(collection, "name", collection) for collection in ChromaRegistry.get_client().list_collections()]
+
+    def manager(self, collection_name: str) -> ChromaVectorStoreManager:
+        # built on first use, so the compactor can be created before the OpenAI key is loaded
+        if collection_name not in self._managers:
+            self._managers[collection_name] = ChromaVectorStoreManager(collection_name)
+        return self._managers[collection_name]
+
+    def start(self) -> None:
+        """
+        Start (once) the daemon thread compacting every interval seconds.
+        """
+        with self._lock:
+            self._stop_event.clear()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._compact_periodically, name="MemoryCompactor", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop_event.set()
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=timeout)
+
+    def compact(self) -> Dict[str, int]:
+        """
+        Delete the expired short term memory of every collection once.
+
+        Returns
+        -------
+        Dict[str, int]
+            Number of deleted documents keyed by collection name.
+        """
+        now = self.clock() if self.clock is not None else None
+        deleted = {}
+        try:
+            collection_names = self.collection_names()
+        except Exception as e:
+            print(f"failed to list the chroma collections to compact: {e}")
+            return {}
+        for collection_name in collection_names:
+            try:
+                deleted[collection_name] = self.manager(collection_name).delete_expired(now=now, batch_size=self.batch_size)
+            except Exception as e:
+                print(f"failed to compact the short term memory of chroma collection {collection_name}: {e}")
+                deleted[collection_name] = 0
+        self.documents_deleted += sum(deleted.values())
+        if any(deleted.values()):
+            print(f"deleted {sum(deleted.values())} expired short term memory documents from chroma \n")
+        return deleted
+
+    def _compact_periodically(self) -> None:
+        # memory left behind by an earlier run is deleted on start
+        while not self._stop_event.is_set():
+            self.compact()
+            self._stop_event.wait(self.interval)
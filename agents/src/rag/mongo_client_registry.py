@@ -0,0 +1,191 @@
+import os
+import atexit
+import asyncio
+import weakref
+import threading
+from typing import AsyncGenerator, Dict, Optional
+
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
+
+from config.config import MongoClientConsts
+
+
+class MongoClientRegistry:
+    """
+    Process wide registry holding one pooled MongoClient per URI.
+
+    MongoClient is thread safe and keeps its own connection pool, so every MongoDBHandler (and
+    every agent) shares the same client per URI instead of paying a new connection handshake for
+    each handler or query. Clients are created lazily (connect=False, the first operation opens the
+    pool), sized by MongoClientConsts, and closed once by close_all() when the process exits.
+
+    AsyncMongoClient instances are bound to the event loop they run on, so async clients are shared
+    per (URI, event loop) instead. They are held weakly by their loop, a new loop never gets the
+    client of a finished one, and are closed on their loop when asyncio.run() shuts it down.
+
+    Methods
+    -------
+    get_client(uri: str) -> MongoClient
+        Returns the shared client of a URI, creating it on first use.
+    get_database(uri: str, db_name: str) -> Database
+        Returns a database of the shared client of a URI.
+    get_async_client(uri: str) -> AsyncMongoClient
+        Returns the shared async client of a URI for the running event loop.
+    get_async_database(uri: str, db_name: str) -> AsyncDatabase
+        Returns a database of the shared async client of a URI.
+    close_all() -> None
+        Closes every shared client.
+    aclose_all() -> None
+        Closes every shared async client of the running event loop.
+    """
+
+    _clients: Dict[str, MongoClient] = {}
+    _async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncMongoClient]]" = weakref.WeakKeyDictionary()
+    _loop_closers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncGenerator[None, None]]" = weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+    _atexit_registered = False
+
+    @classmethod
+    def get_client(cls, uri: str, mongo_client_consts: Optional[MongoClientConsts] = None) -> MongoClient:
+        """
+        Return the shared client of a URI, creating it on first use.
+
+        Parameters
+        ----------
+        uri : str
+            MongoDB connection URI.
+        mongo_client_consts : Optional[MongoClientConsts]
+            Pool settings used when the client is created, defaults to MongoClientConsts().
+
+        Returns
+        -------
+        MongoClient
+            The shared client.
+        """
+        with cls._lock:
+            client = cls._clients.get(uri)
+            if client is None:
+                client = MongoClient(uri, **cls._client_options(mongo_client_consts))
+                cls._clients[uri] = client
+                cls._register_atexit()
+            return client
+
+    @classmethod
+    def get_database(cls, uri: str, db_name: str) -> Database:
+        return cls.get_client(uri)[db_name]
+
+    @classmethod
+    def get_async_client(cls, uri: str, mongo_client_consts: Optional[MongoClientConsts] = None) -> AsyncMongoClient:
+        """
+        Return the shared async client of a URI for the running event loop, creating it on first use.
+
+        Parameters
+        ----------
+        uri : str
+            MongoDB connection URI.
+        mongo_client_consts : Optional[MongoClientConsts]
+            Pool settings used when the client is created, defaults to MongoClientConsts().
+
+        Returns
+        -------
+        AsyncMongoClient
+            The shared async client.
+        """
+        loop = asyncio.get_running_loop()
+        with cls._lock:
+            clients = cls._async_clients.get(loop)
+            if clients is None:
+                clients = cls._async_clients[loop] = {}
+                cls._close_at_loop_shutdown(loop)
+            client = clients.get(uri)
+            if client is None:
+                client = AsyncMongoClient(uri, **cls._client_options(mongo_client_consts))
+                clients[uri] = client
+                cls._register_atexit()
+            return client
+
+    @classmethod
+    def get_async_database(cls, uri: str, db_name: str) -> AsyncDatabase:
+        return cls.get_async_client(uri)[db_name]
+
+    @classmethod
+    def close_all(cls) -> None:
+        with cls._lock:
+            for client in cls._clients.values():
+                try:
+                    client.close()
+                except Exception as e:
+                    print(f"Error closing MongoDB client: {e}")
+            cls._clients.clear()
+            async_clients = list(cls._async_clients.items())
+            cls._async_clients.clear()
+            cls._loop_closers.clear()
+        # async clients can only be closed on their own event loop, the ones of a running or closed loop are dropped
+        for loop, clients in async_clients:
+            if loop.is_closed() or loop.is_running():
+                continue
+            for client in clients.values():
+                try:
+                    loop.run_until_complete(client.close())
+                except Exception as e:
+                    print(f"Error closing async MongoDB client: {e}")
+
+    @classmethod
+    async def aclose_all(cls) -> None:
+        loop = asyncio.get_running_loop()
+        with cls._lock:
+            clients = list(cls._async_clients.pop(loop, {}).values())
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"Error closing async MongoDB client: {e}")
+
+    @classmethod
+    def _close_at_loop_shutdown(cls, loop: asyncio.AbstractEventLoop) -> None:
+        # asyncio.run() closes the loop's async generators (shutdown_asyncgens) before closing the loop,
+        # a generator started on the loop closes its clients there while the loop still runs
+        async def close_clients() -> AsyncGenerator[None, None]:
+            try:
+                yield
+            finally:
+                await cls.aclose_all()
+
+        async def start(closer: AsyncGenerator[None, None]) -> None:
+            await closer.__anext__()
+
+        closer = close_clients()
+        # the loop only tracks its async generators weakly
+        cls._loop_closers[loop] = closer
+        loop.create_task(start(closer))
+
+    @staticmethod
+    def _client_options(mongo_client_consts: Optional[MongoClientConsts]) -> Dict[str, object]:
+        settings = mongo_client_consts or MongoClientConsts()
+        return {
+            "connect": False,
+            "maxPoolSize": settings.MAX_POOL_SIZE,
+            "minPoolSize": settings.MIN_POOL_SIZE,
+            "maxIdleTimeMS": settings.MAX_IDLE_TIME_MS,
+            "connectTimeoutMS": settings.CONNECT_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": settings.SERVER_SELECTION_TIMEOUT_MS,
+        }
+
+    @classmethod
+    def _register_atexit(cls) -> None:
+        if not cls._atexit_registered:
+            atexit.register(cls.close_all)
+            cls._atexit_registered = True
+
+    @classmethod
+    def _reset_after_fork(cls) -> None:
+        # clients are not fork safe, a forked process (e.g. Diana's change stream listener) opens its own
+        cls._lock = threading.Lock()
+        cls._clients = {}
+        cls._async_clients = weakref.WeakKeyDictionary()
+        cls._loop_closers = weakref.WeakKeyDictionary()
+
+
+os.register_at_fork(after_in_child=MongoClientRegistry._reset_after_fork)
@@ -1,16 +1,23 @@
 from typing import List, Dict, Tuple, Any, Optional
 import time
 import os
-import openai
+import threading
 from dotenv import load_dotenv
 from config.config import OpenAiConsts
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ConfigurationError
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, ConnectionFailure, ConfigurationError, DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult
 from datetime import datetime, timedelta
 from tqdm import tqdm
 from bson.objectid import ObjectId
 
 from config.config import MFAMongodbConsts, PrivexMongodbConsts
+from rag.mongo_client_registry import MongoClientRegistry
+from rag.token_id_resolver import TokenIdResolver
+from rag.ingestion_checkpoint import IngestionCheckpoint
+from rag.change_stream_listener import ChangeStreamListener, ChangeStreamSubscription
+from rag.embedding_service import EmbeddingService
 
 
 class MongoDBHandler:
@@ -18,6 +25,14 @@ class MongoDBHandler:
     A class to manage MongoDB connections and operations.
     """
 
+    # agent_portfolio collections whose unique agentId index was ensured by this process
+    _portfolio_indexes: set = set()
+    _portfolio_indexes_lock = threading.Lock()
+    # attempts of a portfolio upsert that lost the race to insert the portfolio document
+    PORTFOLIO_WRITE_ATTEMPTS = 3
+    PORTFOLIO_INDEX_KEY = "agentId"
+    PORTFOLIO_INDEX_NAME = "agentId_unique"
+
     def __init__(self, collection_name:str):
         """
         Initializes the MongoDBHandler class.
@@ -32,6 +47,7 @@ class MongoDBHandler:
         self.client = None
         self.database = None
         self.collection = None
+        self.ingestion_checkpoints: Dict[str, IngestionCheckpoint] = {}
         self._mfa_database(uri=mfa_mongodb.MFA_MONGDB_URI, db_name=mfa_mongodb.DB_NAME, collection_name=self.collection_name)
         
         self.privex_mongodb = PrivexMongodbConsts()
@@ -83,7 +99,8 @@ class MongoDBHandler:
             uri (str): MongoDB connection URI. If None, reads from environment variable `MONGO_URI`.
             db_name (str): Name of the database to connect to.
         """
-        self.privex_mongodb_client = MongoClient(uri)
+        # shared pooled client, every handler in the process reuses the same connections
+        self.privex_mongodb_client = MongoClientRegistry.get_client(uri)
         self.privex_db = self.privex_mongodb_client[db_name]
         self.agent_settings = self.privex_db["agent_settings"]
         self.agent_portfolio = self.privex_db["agent_portfolio"]
@@ -100,7 +117,7 @@ class MongoDBHandler:
             if not self.uri:
                 raise ValueError("MongoDB URI is not provided or missing in environment variables.")
 
-            self.client = MongoClient(self.uri)
+            self.client = MongoClientRegistry.get_client(self.uri)
             # Test connection
             self.client.admin.command("ping")
             print("Connected to MongoDB successfully!")
@@ -151,26 +168,34 @@ class MongoDBHandler:
     @staticmethod
     def generate_embedding(text: str) -> Optional[List[float]]:
         """Generate OpenAI embeddings for a given text"""
+        return MongoDBHandler.generate_embeddings([text])[0]
 
-        if not text or text.strip() == "":  # Avoid sending empty text
-            return None
-        
-        load_dotenv()
-        api_key = os.getenv("OPENAI_API_KEY")
-        openai.api_key = api_key
-        if not api_key:
-            raise ValueError("OpenAI API key not found. Please set it in your environment.")
-        
-        try:
-            response = openai.embeddings.create(
-                model=self.default_embedding_model,
-                input=text
-            )
+    @staticmethod
+    def generate_embeddings(texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Generate OpenAI embeddings for many texts through the shared EmbeddingService, which
+        coalesces them with the embeddings requested concurrently elsewhere in the process.
 
-            return response.data[0].embedding
+        Parameters
+        ----------
+        texts : List[str]
+            Texts to embed, empty texts are not sent.
 
-        except Exception as e:
-            return None
+        Returns
+        -------
+        List[Optional[List[float]]]
+            One embedding per text, None for empty texts or when the request failed.
+        """
+        # Avoid sending empty text
+        futures = [EmbeddingService.shared().submit(text) if text and text.strip() != "" else None for text in texts]
+        embeddings: List[Optional[List[float]]] = []
+        for future in futures:
+            try:
+                embeddings.append(future.result() if future is not None else None)
+            except Exception as e:
+                print(f"Error generating embeddings: {e}")
+                embeddings.append(None)
+        return embeddings
 
     def mongo_db_insert_one_document_for_agent(self, agent_id: str, document: dict, db_collection_name: str) -> None:
         """
@@ -192,7 +217,6 @@ class MongoDBHandler:
         if not agent:
             print(f"Agent not found! Could not update {db_collection_name}")
         else:
-            client = self.privex_mongodb_client
             mongo_db_collection = self.privex_db[db_collection_name]
             portfolio_document = {
                 "agentId": ObjectId(agent_id),
@@ -200,76 +224,173 @@ class MongoDBHandler:
             }
             result = mongo_db_collection.insert_one(portfolio_document)
             print(f"updated agent {db_collection_name} for {agent_id}")
-        client.close()
 
     def update_or_create_portfolio(self, agent_id:str, portfolio_updates:dict) -> None:
         """
-        Checks if an agent has an existing portfolio entry.
-        If found, updates it. If not, creates a new entry.
+        Replaces the agent's whole portfolioDetails map, creating the portfolio entry when missing.
+
+        Prefer write_portfolio_holdings(), which only writes the holdings that changed.
 
         :param agent_id: The _id of the agent (as a string).
         :param portfolio_updates: Dictionary with updated token balances.
         """
-        agent_object_id = ObjectId(agent_id)
+        result = self._upsert_portfolio(agent_id=agent_id, update={"$set": {"portfolioDetails": portfolio_updates}})
 
-        existing_portfolio = self.agent_portfolio.find_one({"agentId": agent_object_id})
-
-        if existing_portfolio:
-            update_data = {
-                "portfolioDetails": portfolio_updates,
-            }
-            
-            result = self.agent_portfolio.update_one(
-                {"agentId": agent_object_id},
-                {"$set": update_data}
-            )
-
-            if result.matched_count > 0:
-                print(f"Updated portfolio for agent {agent_id}.")
-            else:
-                print("Portfolio update failed.")
+        if result.upserted_id is not None:
+            print(f"Created new portfolio entry for agent {agent_id} with _id {result.upserted_id}")
         else:
-            new_portfolio = {
-                "agentId": agent_object_id,
-                "portfolioDetails": portfolio_updates,
-            }
-            result = self.agent_portfolio.insert_one(new_portfolio)
-            print(f"Created new portfolio entry for agent {agent_id} with _id {result.inserted_id}")
+            print(f"Updated portfolio for agent {agent_id}.")
 
     def update_or_create_portfolio_v2(self, agent_id:str, portfolio_updates:dict, portfolio_metrics: dict) -> None:
         """
-        Checks if an agent has an existing portfolio entry.
-        If found, updates it. If not, creates a new entry.
+        Replaces the agent's whole portfolioDetails map and portfolioMetrics, creating the portfolio entry when missing.
+
+        Prefer write_portfolio_holdings(), which only writes the holdings that changed.
 
         :param agent_id: The _id of the agent (as a string).
         :param portfolio_updates: Dictionary with updated token balances.
+        :param portfolio_metrics: Portfolio performance metrics.
         """
-        agent_object_id = ObjectId(agent_id)
+        result = self._upsert_portfolio(agent_id=agent_id, update={"$set": {"portfolioDetails": portfolio_updates, "portfolioMetrics": portfolio_metrics}})
 
-        existing_portfolio = self.agent_portfolio.find_one({"agentId": agent_object_id})
+        if result.upserted_id is not None:
+            print(f"Created new portfolio entry for agent {agent_id} with _id {result.upserted_id}")
+        else:
+            print(f"Updated portfolio for agent {agent_id}.")
 
-        if existing_portfolio:
-            update_data = {
-                "portfolioDetails": portfolio_updates,
-                "portfolioMetrics": portfolio_metrics,
-            }
-            
-            result = self.agent_portfolio.update_one(
-                {"agentId": agent_object_id},
-                {"$set": update_data}
-            )
+    @staticmethod
+    def portfolio_write_operations(agent_id: str, holdings: Optional[Dict[str, Dict[str, Any]]] = None, increments: Optional[Dict[str, Dict[str, float]]] = None, portfolio_metrics: Optional[Any] = None) -> List[UpdateOne]:
+        """
+        Build the upserts writing only the given holding fields of an agent's portfolio.
 
-            if result.matched_count > 0:
-                print(f"Updated portfolio for agent {agent_id}.")
-            else:
-                print("Portfolio update failed.")
-        else:
-            new_portfolio = {
-                "agentId": agent_object_id,
-                "portfolioDetails": portfolio_updates,
-            }
-            result = self.agent_portfolio.insert_one(new_portfolio)
-            print(f"Created new portfolio entry for agent {agent_id} with _id {result.inserted_id}")
+        Every holding becomes one UpdateOne on portfolioDetails.<symbol>.<field> dotted paths, so
+        holdings and fields that are not part of the write are left untouched and increments are
+        applied atomically by the server.
+
+        Parameters
+        ----------
+        agent_id : str
+            The _id of the agent (as a string).
+        holdings : Optional[Dict[str, Dict[str, Any]]]
+            Fields to $set keyed by symbol, e.g. {"ETH": {"last_price": 2700.0}}.
+        increments : Optional[Dict[str, Dict[str, float]]]
+            Fields to $inc keyed by symbol, e.g. {"ETH": {"amount": 0.1}}, a missing field starts at 0.
+        portfolio_metrics : Optional[Any]
+            Portfolio performance metrics to $set, left untouched when None.
+
+        Returns
+        -------
+        List[UpdateOne]
+            One upsert per symbol, followed by the metrics upsert.
+
+        Raises
+        ------
+        ValueError
+            If a symbol cannot be used as a field name in a dotted path.
+        """
+        agent_filter = {"agentId": ObjectId(agent_id)}
+        holdings = holdings or {}
+        increments = increments or {}
+        operations = []
+
+        for symbol in list(dict.fromkeys([*holdings, *increments])):
+            if not symbol or "." in symbol or symbol.startswith("$"):
+                raise ValueError(f"Symbol {symbol!r} cannot be written as a portfolioDetails field")
+
+            update: Dict[str, Dict[str, Any]] = {}
+            set_fields = {f"portfolioDetails.{symbol}.{field}": value for field, value in holdings.get(symbol, {}).items() if field not in increments.get(symbol, {})}
+            inc_fields = {f"portfolioDetails.{symbol}.{field}": value for field, value in increments.get(symbol, {}).items()}
+            set_fields.setdefault(f"portfolioDetails.{symbol}.symbol", symbol)
+            update["$set"] = set_fields
+            if inc_fields:
+                update["$inc"] = inc_fields
+            operations.append(UpdateOne(agent_filter, update, upsert=True))
+
+        if portfolio_metrics is not None:
+            operations.append(UpdateOne(agent_filter, {"$set": {"portfolioMetrics": portfolio_metrics}}, upsert=True))
+
+        return operations
+
+    def write_portfolio_holdings(self, agent_id: str, holdings: Optional[Dict[str, Dict[str, Any]]] = None, increments: Optional[Dict[str, Dict[str, float]]] = None, portfolio_metrics: Optional[Any] = None) -> Optional[BulkWriteResult]:
+        """
+        Write the changed holdings (and metrics) of an agent's portfolio in one bulk_write round trip.
+
+        The portfolio entry is created when missing. Concurrent writers touching different holdings
+        or incrementing the same amount no longer overwrite each other, see portfolio_write_operations().
+
+        Returns
+        -------
+        Optional[BulkWriteResult]
+            The bulk write result, None when there was nothing to write.
+        """
+        operations = self.portfolio_write_operations(agent_id=agent_id, holdings=holdings, increments=increments, portfolio_metrics=portfolio_metrics)
+        if not operations:
+            return None
+
+        self.ensure_portfolio_index()
+        written = len(operations)
+        for attempt in range(self.PORTFOLIO_WRITE_ATTEMPTS):
+            try:
+                # ordered, the operations of one write are applied one after the other
+                result = self.agent_portfolio.bulk_write(operations, ordered=True)
+                break
+            except BulkWriteError as e:
+                operations = self.portfolio_operations_to_retry(error=e, operations=operations, attempt=attempt)
+        print(f"Wrote {written} portfolio updates for agent {agent_id}.")
+        return result
+
+    @classmethod
+    def portfolio_operations_to_retry(cls, error: BulkWriteError, operations: List[UpdateOne], attempt: int) -> List[UpdateOne]:
+        """
+        The portfolio operations to write again after a bulk write lost the race to insert the
+        portfolio document, shared with AsyncMongoDBHandler.
+
+        Raises
+        ------
+        BulkWriteError
+            error, when it is not a duplicate key error or it was the last attempt.
+        """
+        write_errors = error.details.get("writeErrors", [])
+        if attempt == cls.PORTFOLIO_WRITE_ATTEMPTS - 1 or not write_errors or write_errors[0].get("code") != 11000:
+            raise error
+        # another writer inserted the portfolio first, the failed upsert and the ones after it now update that document
+        return operations[write_errors[0]["index"]:]
+
+    @classmethod
+    def portfolio_index_ensured(cls, key: Tuple[str, str]) -> bool:
+        with cls._portfolio_indexes_lock:
+            return key in cls._portfolio_indexes
+
+    @classmethod
+    def mark_portfolio_index_ensured(cls, key: Tuple[str, str]) -> None:
+        with cls._portfolio_indexes_lock:
+            cls._portfolio_indexes.add(key)
+
+    def ensure_portfolio_index(self) -> None:
+        """
+        Create the unique agentId index of agent_portfolio once per process, concurrent upserts of a
+        new agent's portfolio then insert one document and the others fail with a duplicate key error
+        and are retried as updates.
+        """
+        key = (self.privex_mongodb.PRIVEX_MONGDB_URI, self.agent_portfolio.full_name)
+        with self._portfolio_indexes_lock:
+            if key in self._portfolio_indexes:
+                return
+            try:
+                self.agent_portfolio.create_index(self.PORTFOLIO_INDEX_KEY, unique=True, name=self.PORTFOLIO_INDEX_NAME)
+            except OperationFailure as e:
+                # e.g. duplicate portfolios that have to be merged first, writes go on without the index
+                print(f"unable to create the unique agentId index of agent_portfolio: {e}")
+            self._portfolio_indexes.add(key)
+
+    def _upsert_portfolio(self, agent_id: str, update: Dict[str, Any]) -> Any:
+        self.ensure_portfolio_index()
+        for attempt in range(self.PORTFOLIO_WRITE_ATTEMPTS):
+            try:
+                return self.agent_portfolio.update_one({"agentId": ObjectId(agent_id)}, update, upsert=True)
+            except DuplicateKeyError:
+                if attempt == self.PORTFOLIO_WRITE_ATTEMPTS - 1:
+                    raise
 
     def save_tweet_comment_delete_later(self, agent_id: str, tweet_comments_updates: str) -> None:
         """
@@ -360,9 +481,8 @@ class MongoDBHandler:
         
         """
         try:
-            client = self.privex_mongodb_client
             collection = self.agent_portfolio
-            document = collection.find_one({"agentId": ObjectId(agent_id)})
+            document = collection.find_one({"agentId": ObjectId(agent_id)}, projection={"portfolioDetails": 1})
 
             if not document:
                 print(f"No portfolio found for agentId: {agent_id}")
@@ -371,7 +491,6 @@ class MongoDBHandler:
             portfolio_details = document.get("portfolioDetails", {})
 
             return portfolio_details  
-        # TODO close db connection 
 
         except Exception as e:
             print(f"Error fetching portfolio details: {e}")
@@ -392,10 +511,8 @@ class MongoDBHandler:
         """
         agents = []
         try:
-            client = self.privex_mongodb_client
             collection = self.agent_settings
             agents = list(collection.find())
-            client.close()
         except Exception as e:
             print(f"Error retrieving agents: {e}")
             agents = None
@@ -416,10 +533,8 @@ class MongoDBHandler:
         """
         agent = []
         try:
-            client = self.privex_mongodb_client
             collection = self.agent_settings
             agent = collection.find_one({"_id": ObjectId(agent_id)})
-            # client.close()
         except Exception as e:
             print(f"Error retrieving agent: {e}")
             agent = None
@@ -471,8 +586,7 @@ class MongoDBHandler:
             A list of dictionaries representing the queried tweets.
         """
         mfa_mongodb = MFAMongodbConsts()
-        client = MongoClient(mfa_mongodb.MFA_MONGDB_URI)
-        db = client[mfa_mongodb.DB_NAME]
+        db = MongoClientRegistry.get_database(mfa_mongodb.MFA_MONGDB_URI, mfa_mongodb.DB_NAME)
         collection = db["twitterposts"]
         now = datetime.now()
         date_filter = now - timedelta(minutes=1440)
@@ -492,86 +606,106 @@ class MongoDBHandler:
 
         print(f"Found {len(tweets)} tweets to process in RAG Pipeline \n")
 
-        # Close the connection
-        client.close()
-
         return tweets
     
-    def query_nfa_collection_by_most_recent_entries(self, minutes_to_backfill: float) -> Tuple[List[Dict], List[Dict]]:
+    def query_nfa_collection_by_most_recent_entries(self, minutes_to_backfill: float, checkpoint_name: str = "rag_pipeline", tweet_projection: Optional[Dict[str, Any]] = None, batch_size: Optional[int] = None, commit: bool = False) -> Tuple[List[Dict], List[Dict]]:
         """
-        Queries collection entries created within the minutes_to_backfill param from the MongoDB database
+        Queries the collection entries created since the last call (at most minutes_to_backfill ago) from the MongoDB database
         and returns the results as a list of dictionaries.
 
         This is a custom def specifically tailored to the NFA database, which was used in this project.
 
         Your Agent will require their own database querying logic, replace this def with your database query logic.
 
+        Every collection keeps a persisted IngestionCheckpoint high-water mark, so overlapping calls only return
+        the entries that were not returned before. Tweets are scraped after they were posted, their created_at can be
+        older than tweets already ingested, so their mark is the insertion ordered _id. Opportunities are marked on createdAt.
+
+        The marks only move in memory until they are committed: once the returned entries are stored call
+        commit_nfa_ingestion() to persist them, or rollback_nfa_ingestion() when storing failed so the next call
+        returns the same entries again. An uncommitted call is also replayed by the next process.
+
         Parameters
         ----------
         minutes_to_backfill : float
-            number of minutes to look back to and return collection entries
+            number of minutes to look back to on the first call, or when the checkpoint is older than that
+        checkpoint_name : str, optional
+            prefix of the checkpoints of the tweets and opportunities collections, by default "rag_pipeline"
+        tweet_projection : Optional[Dict[str, Any]]
+            tweet fields returned, by default every field
+        batch_size : Optional[int]
+            documents per cursor batch, by default NfaIngestionConsts.BATCH_SIZE
+        commit : bool, optional
+            persist the checkpoints before returning, by default False. Only pass True when losing the returned
+            entries on a failure is acceptable.
 
         Returns
         -------
-        List[Dict]
-            A list of dictionaries representing the queried tweets.
+        Tuple[List[Dict], List[Dict]]
+            The new tweets and the new opportunities.
         """
         mfa_mongodb = MFAMongodbConsts()
-        client = MongoClient(mfa_mongodb.MFA_MONGDB_URI)
-        db = client[mfa_mongodb.DB_NAME]
-        tweet_collection = db["twitterposts"]
-        opportunities_collection = db["opportunities"]
+        db = MongoClientRegistry.get_database(mfa_mongodb.MFA_MONGDB_URI, mfa_mongodb.DB_NAME)
+        since = datetime.now() - timedelta(minutes=minutes_to_backfill)
 
-        now = datetime.now()
-        date_filter = now - timedelta(minutes=minutes_to_backfill)
-        twitter_posts_query = {"created_at": {"$gt": date_filter}}
-        opportunities_query = {"createdAt": {"$gt": date_filter}}
-
-        tweet_results = tweet_collection.find(twitter_posts_query)
-        tweet_total_results = tweet_collection.count_documents(twitter_posts_query)
-        opportunities_results = opportunities_collection.find(opportunities_query)
-        opportunities_total_results = opportunities_collection.count_documents(opportunities_query)
+        tweets_checkpoint, opportunities_checkpoint = self._nfa_ingestion_checkpoints(checkpoint_name)
 
         twitter_nfa_results=[]
         opportunities_nfa_results = []
 
         # format tweets from nfa database here
-        for tweet in tqdm(tweet_results, total=tweet_total_results, desc="Processing tweets", unit="tweet"):
+        for tweet in tweets_checkpoint.stream(collection=db["twitterposts"], time_field="_id", since=since, projection=tweet_projection, batch_size=batch_size):
             tweet["_id"] = str(tweet["_id"])
-            tweet["oppDocId"] = str(tweet["oppDocId"])
+            if "oppDocId" in tweet:
+                tweet["oppDocId"] = str(tweet["oppDocId"])
             for key, value in tweet.items():
                 if isinstance(value, datetime):
                     tweet[key] = value.isoformat()
             twitter_nfa_results.append(tweet)
 
-        # format opportunities from nfa database here
-        for opportunity in tqdm(opportunities_results, total=opportunities_total_results, desc="Processing opportunities", unit="opportunity"):
-            
-            for key, value in opportunity.items():
-                if isinstance(value, datetime):
-                    opportunity[key] = value.isoformat()
+        # format opportunities from nfa database here, only their data is used
+        for opportunity in opportunities_checkpoint.stream(collection=db["opportunities"], time_field="createdAt", since=since, projection={"data": 1}, batch_size=batch_size):
+            opportunities_nfa_results.append({str(opportunity["_id"]): {"data": str(opportunity["data"])}})
 
-            opportunity_at_index_dict = {}
-            opportunity_at_index_dict[str(opportunity["_id"])] = {
-                "data":str(opportunity["data"])
-            }
-            opportunities_nfa_results.append(opportunity_at_index_dict)
+        if commit:
+            self.commit_nfa_ingestion(checkpoint_name=checkpoint_name)
 
         print(f"Found {len(twitter_nfa_results) + len(opportunities_nfa_results)} data points to process in RAG Pipeline \n")
 
-        # Close the connection
-        client.close()
-
         return twitter_nfa_results, opportunities_nfa_results
 
+    def commit_nfa_ingestion(self, checkpoint_name: str = "rag_pipeline") -> None:
+        """
+        Persist the checkpoints of the entries returned by query_nfa_collection_by_most_recent_entries(), call once they are stored.
+        """
+        for checkpoint in self._nfa_ingestion_checkpoints(checkpoint_name):
+            checkpoint.commit()
+
+    def rollback_nfa_ingestion(self, checkpoint_name: str = "rag_pipeline") -> None:
+        """
+        Forget the entries returned since the last commit, the next query returns them again.
+        """
+        for checkpoint in self._nfa_ingestion_checkpoints(checkpoint_name):
+            checkpoint.rollback()
+
+    def _nfa_ingestion_checkpoints(self, checkpoint_name: str) -> Tuple[IngestionCheckpoint, IngestionCheckpoint]:
+        # kept on the handler, entries streamed but not committed yet are not returned twice
+        for collection_name in ("twitterposts", "opportunities"):
+            name = f"{checkpoint_name}:{collection_name}"
+            if name not in self.ingestion_checkpoints:
+                self.ingestion_checkpoints[name] = IngestionCheckpoint(name=name)
+        return self.ingestion_checkpoints[f"{checkpoint_name}:twitterposts"], self.ingestion_checkpoints[f"{checkpoint_name}:opportunities"]
+
     def get_cmc_ids_by_symbols(self, symbol: str) -> List[str]:
         """
-        Query the 'tokens' collection and return all 'id' values from 'cmc_info' for the given symbol.
+        Return all 'id' values from 'cmc_info' of the 'tokens' collection for the given symbol.
 
         This is a custom def specifically tailored to the NFA database, which was used in this project.
 
         Your Agent will require their own database querying logic, replace this def with your database query logic.
 
+        Lookups are served from the process wide in memory TokenIdResolver, the collection is only read once.
+
         Parameters
         ----------
         symbol : str
@@ -582,86 +716,93 @@ class MongoDBHandler:
         list
             A list of 'id' values found in the 'cmc_info' array of matching documents.
         """
-
-        mfa_mongodb = MFAMongodbConsts()
-        client = MongoClient(mfa_mongodb.MFA_MONGDB_URI)
-        db = client[mfa_mongodb.DB_NAME]
-        collection = db['tokens']
-        
-        try: 
-            result = collection.find_one({"symbol": symbol})            
-            if result and "cmc_info" in result:
-                # ids = [float(entry["id"]) for entry in result["cmc_info"]]
-                ids = [str(entry["id"]) for entry in result["cmc_info"]]
-                client.close()
-                return ids
-            else:
-                client.close()
-                return [] 
-        except Exception as e:
-            print(f"unable to get Coinmarketcap token IDs from nfa mongo db")
-            return []
+        return TokenIdResolver.shared().resolve(symbol)
 
     @staticmethod
     def process_new_document(doc) -> None:
         """Process a new document, generate embeddings, and update MongoDB"""
+        MongoDBHandler.process_new_documents([doc])
 
-        # because the listener is static we have to load these everytime
+    @staticmethod
+    def process_new_documents(docs: List[Dict[str, Any]]) -> None:
+        """
+        Embed the persona and knowledge base of many agent_settings documents in one batch of the EmbeddingService
+        and write them back with one bulk write.
+        """
+        # because the listener is static we look up the shared client of the process everytime
         privex_mongodb = PrivexMongodbConsts()
-        privex_mongodb_client = MongoClient(privex_mongodb.PRIVEX_MONGDB_URI)
-        privex_db = privex_mongodb_client[privex_mongodb.DB_NAME]
+        privex_db = MongoClientRegistry.get_database(privex_mongodb.PRIVEX_MONGDB_URI, privex_mongodb.DB_NAME)
         agent_settings = privex_db["agent_settings"]
-        
-        doc_id = doc["_id"]
-        persona_text = doc.get("persona", "")
-        knowledge_base_text = doc.get("knowledgeBase", "")
-
-        # Generate embeddings
-        persona_embedding = MongoDBHandler.generate_embedding(persona_text)
-        knowledge_base_embedding = MongoDBHandler.generate_embedding(knowledge_base_text)
-
-        # Prepare update query
-        update_query = {}
-        if persona_embedding:
-            update_query["embedded_persona"] = persona_embedding
-        if knowledge_base_embedding:
-            update_query["embedded_knowledgeBase"] = knowledge_base_embedding
-
-        # Update MongoDB document with new embeddings
-        if update_query:  # Only update if there's something to insert
-            agent_settings.update_one({"_id": doc_id}, {"$set": update_query})
-            print(f"Updated document {doc_id} with embeddings.")
 
-    @staticmethod
-    def listen_for_changes():
-        
-        """Listen for new documents and process them in real-time"""
+        # Generate embeddings, persona and knowledge base of every document are submitted together
+        texts = []
+        for doc in docs:
+            texts.extend([doc.get("persona", ""), doc.get("knowledgeBase", "")])
+        embeddings = MongoDBHandler.generate_embeddings(texts)
 
-        try:
+        updates = []
+        for index, doc in enumerate(docs):
+            persona_embedding, knowledge_base_embedding = embeddings[2 * index], embeddings[2 * index + 1]
 
-            # because the listener is static we have to load these everytime
-            privex_mongodb = PrivexMongodbConsts()
-            privex_mongodb_client = MongoClient(privex_mongodb.PRIVEX_MONGDB_URI)
-            privex_db = privex_mongodb_client[privex_mongodb.DB_NAME]
-            agent_settings = privex_db["agent_settings"]
+            # Prepare update query
+            update_query = {}
+            if persona_embedding:
+                update_query["embedded_persona"] = persona_embedding
+            if knowledge_base_embedding:
+                update_query["embedded_knowledgeBase"] = knowledge_base_embedding
 
-            with agent_settings.watch([{"$match": {"operationType": "insert"}}]) as stream:
-                for change in stream:
-                    new_document = change["fullDocument"]
-                    self.process_new_document(new_document)
+            # Only update if there's something to insert
+            if update_query:
+                updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": update_query}))
 
-        except Exception as e:
-            print(f"Change Stream error: {e} \n")
-            print("Retrying in 5 seconds... \n")
-            time.sleep(5)
-            MongoDBHandler.listen_for_changes()  # Restart listening
+        # Update MongoDB documents with new embeddings
+        if updates:
+            agent_settings.bulk_write(updates, ordered=False)
+            print(f"Updated {len(updates)} agent documents with embeddings.")
 
+    @staticmethod
+    def agent_settings_subscription() -> ChangeStreamSubscription:
+        """
+        Subscription embedding agents that are created, or whose persona or knowledge base changed.
+        """
+        def agent_settings() -> Collection:
+            privex_mongodb = PrivexMongodbConsts()
+            return MongoClientRegistry.get_database(privex_mongodb.PRIVEX_MONGDB_URI, privex_mongodb.DB_NAME)["agent_settings"]
+
+        def handle_batch(changes: List[Dict[str, Any]]) -> None:
+            # the latest version of every agent in the batch
+            documents = {change["documentKey"]["_id"]: change["fullDocument"] for change in changes if change.get("fullDocument")}
+            if documents:
+                MongoDBHandler.process_new_documents(list(documents.values()))
+
+        # the embedded_* fields written by process_new_documents() do not trigger a new event
+        pipeline = [{"$match": {"$or": [
+            {"operationType": {"$in": ["insert", "replace"]}},
+            {"operationType": "update", "$or": [
+                {"updateDescription.updatedFields.persona": {"$exists": True}},
+                {"updateDescription.updatedFields.knowledgeBase": {"$exists": True}},
+            ]},
+        ]}}]
+        return ChangeStreamSubscription(name="agent_settings_embeddings", collection=agent_settings, handle_batch=handle_batch, pipeline=pipeline)
+
+    @staticmethod
+    def listen_for_changes():
+        """
+        Listen for new and changed agents and embed them in real-time, resuming after the last handled change.
+
+        Blocks forever, run it in its own process or thread.
+        """
+        listener = ChangeStreamListener(subscriptions=[MongoDBHandler.agent_settings_subscription()])
+        listener.run_forever()
 
     def close(self):
         """
-        Closes the MongoDB connection.
+        Releases the handler's references to the MongoDB clients.
+
+        The clients are shared by every handler in the process, they are closed once by
+        MongoClientRegistry.close_all() when the process exits.
         """
-        if self.client:
-            self.client.close()
-            print("MongoDB connection closed.")
+        self.client = None
+        self.database = None
+        self.collection = None
 
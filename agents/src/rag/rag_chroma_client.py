@@ -1,13 +1,38 @@
 import os
-import chromadb
-from uuid import uuid4
-from typing import Any, List, Dict, Optional
+import time
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, List, Dict, Optional, Sequence, Union
+
+import numpy as np
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
 from dotenv import load_dotenv
 
-from config.config import OpenAiConsts
+from config.config import OpenAiConsts, ShortTermMemoryConsts
+from rag.chroma_registry import ChromaRegistry
+
+
+@dataclass
+class SearchHit:
+    """
+    One result of ChromaVectorStoreManager.search().
+
+    Attributes
+    ----------
+    id : str
+        ID of the chroma document, see ChromaVectorStoreManager.fetch_documents().
+    distance : float
+        Distance of the document to the query, lower is more similar.
+    document : Optional[Document]
+        The document, only when the search included content.
+    """
+
+    id: str
+    distance: float
+    document: Optional[Document] = None
 
 
 class ChromaVectorStoreManager:
@@ -23,24 +48,34 @@ class ChromaVectorStoreManager:
     Attributes
     ----------
     client : PersistentClient
-        A persistent Chroma client used for interacting with the vector store.
+        The process wide persistent Chroma client of ChromaConsts.PERSIST_DIRECTORY, see ChromaRegistry.
     vector_store : Chroma
-        The Chroma vector store initialized with the specified collection.
-    collection : PersistentClient.Collection
-        The collection used for managing document storage and retrieval.
+        The shared Chroma vector store of the collection.
+    collection : Collection
+        The shared chromadb handle of the collection.
     """
+
+    # metadata fields that, together with the content, identify a document
+    DOCUMENT_ID_FIELDS = ("source",)
+    # metadata fields search() pre-filters on, created_at holds epoch seconds
+    SOURCE_FIELD = "source"
+    AGENT_ID_FIELD = "agent_id"
+    SYMBOL_FIELD = "symbol"
+    TIME_FIELD = "created_at"
+    # short term memory written by remember(), hidden from searches once expires_at (epoch seconds) has passed
+    NAMESPACE_FIELD = "namespace"
+    SHORT_TERM_FIELD = "short_term"
+    EXPIRES_AT_FIELD = "expires_at"
+
     def __init__(self, collection_name: str) -> None:
         self.open_ai_consts = OpenAiConsts()
         self._load_api_key()
         self.collection_name = collection_name
-        self.open_ai_embedding_function = OpenAIEmbeddings(model=self.open_ai_consts.DEFAULT_EMBEDDING_MODEL)
-        self.client = chromadb.PersistentClient()
-        self.vector_store = Chroma(
-            collection_name=collection_name,
-            embedding_function=self.open_ai_embedding_function,
-            persist_directory="./chroma_langchain_db",  # Where to save data locally, remove if not necessary
-        )
-        self.collection = self.client.get_or_create_collection(collection_name)
+        # managers are built per agent, tweet and cycle, they share the client and collection handles of the process
+        self.client = ChromaRegistry.get_client()
+        self.vector_store = ChromaRegistry.get_vector_store(collection_name)
+        self.open_ai_embedding_function = self.vector_store.embeddings
+        self.collection = ChromaRegistry.get_collection(collection_name)
 
     def _load_api_key(self) -> None:
         """
@@ -53,7 +88,7 @@ class ChromaVectorStoreManager:
 
     def add_documents(self, documents: List[Document]) -> List[str]:
         """
-        Add documents to the vector store.
+        Add documents to the vector store, documents that are already stored are not embedded again.
 
         Parameters
         ----------
@@ -63,11 +98,157 @@ class ChromaVectorStoreManager:
         Returns
         -------
         List[str]
-            A list of unique IDs assigned to the added documents.
+            The content derived IDs of the documents, see document_id().
+        """
+        return self.upsert_documents(documents)
+
+    def upsert_documents(self, documents: List[Document], key_fields: Sequence[str] = DOCUMENT_ID_FIELDS) -> List[str]:
+        return self.upsert_into(vector_store=self.vector_store, documents=documents, key_fields=key_fields)
+
+    def replace_documents_where(self, filters: Dict[str, Any], documents: List[Document], key_fields: Sequence[str] = DOCUMENT_ID_FIELDS) -> List[str]:
+        """
+        Make documents the only ones matching a metadata filter: new or changed documents are added,
+        unchanged ones are kept as they are and the ones that are no longer part of documents are deleted.
+
+        Parameters
+        ----------
+        filters : Dict[str, Any]
+            Chroma metadata filter selecting the documents being replaced, e.g. {"mongo_id": {"$in": [...]}}.
+        documents : List[Document]
+            The current documents, they must match filters.
+        key_fields : Sequence[str]
+            Metadata fields identifying a document together with its content.
+
+        Returns
+        -------
+        List[str]
+            IDs of the current documents.
+        """
+        document_ids = self.upsert_documents(documents, key_fields=key_fields)
+        current_ids = set(document_ids)
+        stale_ids = [document_id for document_id in self.vector_store.get(where=filters, include=[])["ids"] if document_id not in current_ids]
+        if stale_ids:
+            self.vector_store.delete(ids=stale_ids)
+        return document_ids
+
+    def remember(self, documents: List[Document], agent_id: Optional[str] = None, ttl_seconds: Optional[float] = None, key_fields: Sequence[str] = DOCUMENT_ID_FIELDS) -> List[str]:
         """
-        uuids = [str(uuid4()) for _ in documents]
-        self.vector_store.add_documents(documents=documents, ids=uuids)
-        return uuids
+        Add documents as short term memory that expires ttl_seconds from now.
+
+        Every document is stored in the namespace of its agent and "source" metadata, see namespace(),
+        so agents writing the same chunk keep their own copy and expiry. A chunk that is still stored
+        is not embedded again, only its expiry is pushed back. Expired documents are left out of
+        search(), similarity_search() and similarity_search_with_score() and deleted in bulk by
+        delete_expired(), see rag.memory_compactor.
+
+        Parameters
+        ----------
+        documents : List[Document]
+            The documents to remember.
+        agent_id : Optional[str]
+            Agent the memory belongs to, by default the memory is shared by every agent.
+        ttl_seconds : Optional[float]
+            Lifetime of the documents, by default ShortTermMemoryConsts.TTL_SECONDS.
+        key_fields : Sequence[str]
+            Metadata fields identifying a document together with its content and namespace.
+
+        Returns
+        -------
+        List[str]
+            IDs of the documents.
+        """
+        ttl_seconds = ShortTermMemoryConsts().TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        expires_at = time.time() + ttl_seconds
+        short_term_documents = []
+        for document in documents:
+            metadata = dict(document.metadata)
+            if agent_id is not None:
+                metadata[self.AGENT_ID_FIELD] = str(agent_id)
+            metadata[self.NAMESPACE_FIELD] = self.namespace(agent_id=agent_id, source=metadata.get(self.SOURCE_FIELD))
+            metadata[self.SHORT_TERM_FIELD] = True
+            metadata[self.EXPIRES_AT_FIELD] = expires_at
+            short_term_documents.append(Document(page_content=document.page_content, metadata=metadata))
+
+        document_ids = self.upsert_documents(short_term_documents, key_fields=(*key_fields, self.NAMESPACE_FIELD))
+        if document_ids:
+            # chunks stored by an earlier cycle live on, metadata updates are not embedded
+            self.collection.update(ids=document_ids, metadatas=[{self.EXPIRES_AT_FIELD: expires_at}] * len(document_ids))
+        return document_ids
+
+    @staticmethod
+    def namespace(agent_id: Optional[str] = None, source: Optional[str] = None) -> str:
+        """
+        Namespace of short term memory, e.g. "shared/nfa_opportunities" or "67bda73d43d6464a9cad4241/twitter_posts".
+        """
+        return f"{agent_id or 'shared'}/{source or 'unknown'}"
+
+    def delete_expired(self, now: Optional[float] = None, batch_size: int = 1000) -> int:
+        """
+        Delete the short term memory that expired, batch_size documents per delete.
+
+        Parameters
+        ----------
+        now : Optional[float]
+            Epoch seconds documents expired by, by default the current time.
+        batch_size : int, optional
+            Documents deleted per request, by default 1000.
+
+        Returns
+        -------
+        int
+            Number of deleted documents.
+        """
+        now = time.time() if now is None else now
+        expired = {"$and": [{self.SHORT_TERM_FIELD: True}, {self.EXPIRES_AT_FIELD: {"$lte": now}}]}
+        deleted = 0
+        while True:
+            document_ids = self.collection.get(where=expired, limit=batch_size, include=[])["ids"]
+            if not document_ids:
+                return deleted
+            self.collection.delete(ids=document_ids)
+            deleted += len(document_ids)
+
+    @staticmethod
+    def document_id(document: Document, key_fields: Sequence[str] = DOCUMENT_ID_FIELDS) -> str:
+        """
+        Deterministic ID of a document, the sha256 of its key metadata fields and its content.
+        """
+        key = [str(document.metadata.get(field, "")) for field in key_fields] + [document.page_content]
+        return hashlib.sha256("\x00".join(key).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def upsert_into(vector_store: Chroma, documents: List[Document], key_fields: Sequence[str] = DOCUMENT_ID_FIELDS) -> List[str]:
+        """
+        Add documents to a Chroma store under their document_id(), only the documents whose ID is not
+        stored yet are embedded, an ID that is stored already holds the same content.
+
+        Parameters
+        ----------
+        vector_store : Chroma
+            The store the documents are added to.
+        documents : List[Document]
+            The documents, duplicates are stored once.
+        key_fields : Sequence[str]
+            Metadata fields identifying a document together with its content.
+
+        Returns
+        -------
+        List[str]
+            The IDs of the documents, in order and without duplicates.
+        """
+        documents_by_id = {}
+        for document in documents:
+            documents_by_id.setdefault(ChromaVectorStoreManager.document_id(document, key_fields=key_fields), document)
+        document_ids = list(documents_by_id)
+        if not document_ids:
+            return []
+
+        stored_ids = set(vector_store.get(ids=document_ids, include=[])["ids"])
+        new_ids = [document_id for document_id in document_ids if document_id not in stored_ids]
+        if new_ids:
+            vector_store.add_documents(documents=[documents_by_id[document_id] for document_id in new_ids], ids=new_ids)
+        print(f"upserted {len(document_ids)} documents into chroma, {len(new_ids)} new or changed \n")
+        return document_ids
 
     def update_document(self, document_id: str, document: Document) -> None:
         """
@@ -106,6 +287,173 @@ class ChromaVectorStoreManager:
         """
         self.vector_store.delete(ids=document_ids)
 
+    def delete_documents_where(self, filters: Dict[str, Any]) -> List[str]:
+        """
+        Delete every document whose metadata matches a filter.
+
+        Parameters
+        ----------
+        filters : Dict[str, Any]
+            Chroma metadata filter, e.g. {"mongo_id": {"$in": ["67b...", "67c..."]}}.
+
+        Returns
+        -------
+        List[str]
+            IDs of the deleted documents.
+        """
+        document_ids = self.vector_store.get(where=filters, include=[])["ids"]
+        if document_ids:
+            self.vector_store.delete(ids=document_ids)
+        return document_ids
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        source: Optional[str] = None,
+        agent_id: Optional[str] = None,
+        symbol: Optional[str] = None,
+        since: Optional[Union[datetime, float]] = None,
+        until: Optional[Union[datetime, float]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        namespace: Optional[str] = None,
+        include_expired: bool = False,
+        mmr: bool = False,
+        fetch_k: Optional[int] = None,
+        lambda_mult: float = 0.5,
+        include_content: bool = False,
+    ) -> List[SearchHit]:
+        """
+        Search the collection, pre-filtered on metadata by chroma before the nearest neighbours are taken.
+
+        Only ids and distances are returned unless include_content is set, fetch_documents() loads the
+        content of the hits that are actually used. With mmr the fetch_k nearest candidates are
+        re-ranked by maximal marginal relevance on their stored vectors, so k diverse documents are
+        returned without loading the content of the candidates.
+
+        Parameters
+        ----------
+        query : str
+            The query string to search against.
+        k : int, optional
+            The number of results, by default 10.
+        source : Optional[str]
+            Only documents of this "source" metadata, e.g. "nfa_opportunities".
+        agent_id : Optional[str]
+            Only documents of this "agent_id" metadata.
+        symbol : Optional[str]
+            Only documents of this "symbol" metadata, e.g. "ETH".
+        since : Optional[Union[datetime, float]]
+            Only documents whose "created_at" metadata is at or after this time.
+        until : Optional[Union[datetime, float]]
+            Only documents whose "created_at" metadata is at or before this time.
+        where : Optional[Dict[str, Any]]
+            Any other chroma metadata filter, combined with the ones above.
+        namespace : Optional[str]
+            Only the short term memory of this namespace, see namespace().
+        include_expired : bool, optional
+            Also search short term memory that expired but was not deleted yet, by default False.
+        mmr : bool, optional
+            Diversify the results with maximal marginal relevance, by default False.
+        fetch_k : Optional[int]
+            Candidates re-ranked by mmr, by default 4 * k.
+        lambda_mult : float, optional
+            mmr trade off between similarity (1) and diversity (0), by default 0.5.
+        include_content : bool, optional
+            Return the documents with the hits, by default False.
+
+        Returns
+        -------
+        List[SearchHit]
+            The hits, most relevant first.
+        """
+        query_embedding = self.vector_store.embeddings.embed_query(query)
+        filters = self.metadata_filter(source=source, agent_id=agent_id, symbol=symbol, since=since, until=until, where=where, namespace=namespace, include_expired=include_expired)
+        include = ["distances"]
+        if mmr:
+            include.append("embeddings")
+        if include_content:
+            include.extend(["documents", "metadatas"])
+
+        results = self.collection.query(
+            query_embeddings=[query_embedding],
+            n_results=max(fetch_k or 4 * k, k) if mmr else k,
+            where=filters,
+            include=include,
+        )
+        ids = results["ids"][0]
+        if not ids:
+            return []
+
+        positions = list(range(len(ids)))
+        if mmr:
+            positions = maximal_marginal_relevance(np.array(query_embedding, dtype=np.float32), results["embeddings"][0], lambda_mult=lambda_mult, k=k)
+
+        hits = []
+        for position in positions:
+            document = None
+            if include_content:
+                document = Document(page_content=results["documents"][0][position], metadata=results["metadatas"][0][position] or {})
+            hits.append(SearchHit(id=ids[position], distance=results["distances"][0][position], document=document))
+        return hits
+
+    def fetch_documents(self, ids: List[str]) -> List[Document]:
+        """
+        Load the documents of search hits, in the order of ids, ids that no longer exist are skipped.
+        """
+        if not ids:
+            return []
+        results = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        documents = {
+            document_id: Document(page_content=content, metadata=metadata or {})
+            for document_id, content, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+        }
+        return [documents[document_id] for document_id in ids if document_id in documents]
+
+    @classmethod
+    def metadata_filter(
+        cls,
+        source: Optional[str] = None,
+        agent_id: Optional[str] = None,
+        symbol: Optional[str] = None,
+        since: Optional[Union[datetime, float]] = None,
+        until: Optional[Union[datetime, float]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        namespace: Optional[str] = None,
+        include_expired: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Chroma where filter of search(), None when nothing is filtered.
+        """
+        clauses = []
+        for field, value in ((cls.SOURCE_FIELD, source), (cls.AGENT_ID_FIELD, agent_id), (cls.SYMBOL_FIELD, symbol), (cls.NAMESPACE_FIELD, namespace)):
+            if value is not None:
+                clauses.append({field: str(value)})
+        if since is not None:
+            clauses.append({cls.TIME_FIELD: {"$gte": cls.timestamp(since)}})
+        if until is not None:
+            clauses.append({cls.TIME_FIELD: {"$lte": cls.timestamp(until)}})
+        if where:
+            clauses.append(where)
+        if not include_expired:
+            clauses.append(cls.live_filter())
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    @classmethod
+    def live_filter(cls, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Chroma where filter matching every document but the short term memory expired by now.
+        """
+        now = time.time() if now is None else now
+        # documents stored without a TTL have no short_term field, which $ne matches
+        return {"$or": [{cls.SHORT_TERM_FIELD: {"$ne": True}}, {cls.EXPIRES_AT_FIELD: {"$gt": now}}]}
+
+    @staticmethod
+    def timestamp(value: Union[datetime, float]) -> float:
+        return value.timestamp() if isinstance(value, datetime) else float(value)
+
     def similarity_search(
         self, query: str, k: int = 6, filters: Optional[Dict[str, str]] = None
     ) -> List[Document]:
@@ -119,14 +467,14 @@ class ChromaVectorStoreManager:
         k : int, optional
             The number of top results to return, by default 2.
         filters : Optional[Dict[str, str]], optional
-            Filters to apply to the query, by default None.
+            Filters to apply to the query, by default None. Expired short term memory is never returned.
 
         Returns
         -------
         List[Document]
             A list of documents matching the query.
         """
-        return self.vector_store.similarity_search(query, k=k, filter=filters)
+        return self.vector_store.similarity_search(query, k=k, filter=self.metadata_filter(where=filters))
 
     def similarity_search_with_score(
         self, query: str, k: int = 1
@@ -146,7 +494,7 @@ class ChromaVectorStoreManager:
         List[Dict[str, float]]
             A list of dictionaries containing documents and their similarity scores.
         """
-        results_with_scores = self.vector_store.similarity_search_with_score(query, k=k)
+        results_with_scores = self.vector_store.similarity_search_with_score(query, k=k, filter=self.live_filter())
         return [{"document": res, "score": score} for res, score in results_with_scores]
 
     def get_documents_by_id(self, ids: List[str]) -> List[Document]:
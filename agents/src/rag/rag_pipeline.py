@@ -1,4 +1,4 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 from langchain_core.documents import Document
 import requests
@@ -8,6 +8,7 @@ from rag.embedding_model import EmbeddingModel
 from rag.rag_chroma_client import ChromaVectorStoreManager
 from rag.mongodb_handler import MongoDBHandler
 from backtesting.token_prices import TokenPrices
+from backtesting.price_store import PriceStore
 
 
 class RagPipeline:
@@ -19,6 +20,8 @@ class RagPipeline:
     ----------
     collection_name : str
         The name of the Chroma database collection.
+    agent_id : Optional[str]
+        The agent owning the short term memory written by the pipeline, None when it is shared by every agent.
     document_loader : RagDocumentLoader
         The document loader for handling PDF files.
     embed_model : EmbeddingModel
@@ -36,9 +39,11 @@ class RagPipeline:
         Splits multiple JSON documents and generates embeddings for the resulting text chunks.
     add_documents_to_db(documents: List[Document]) -> List[str]
         Adds documents to the Chroma vector store and returns their IDs.
+    remember_documents(documents: List[Document]) -> List[str]
+        Adds documents to the Chroma vector store as short term memory that expires.
     """
 
-    def __init__(self, collection_name: str):
+    def __init__(self, collection_name: str, agent_id: Optional[str] = None):
         """
         Initializes the RagPipeline with a Chroma collection name.
 
@@ -46,8 +51,11 @@ class RagPipeline:
         ----------
         collection_name : str
             The name of the Chroma collection.
+        agent_id : Optional[str]
+            The agent owning the short term memory, by default it is shared by every agent.
         """
         self.collection_name = collection_name
+        self.agent_id = agent_id
         self.document_loader = RagDocumentLoader()
         self.embed_model = EmbeddingModel()
         self.mfa_mongodb = MongoDBHandler(collection_name="opportunities")
@@ -114,6 +122,23 @@ class RagPipeline:
             A list of document IDs added to the Chroma vector store.
         """
         return self.manager.add_documents(documents)
+
+    def remember_documents(self, documents: List[Document]) -> List[str]:
+        """
+        Adds documents to the Chroma vector store as short term memory of the pipeline's agent, searches
+        stop returning them after ShortTermMemoryConsts.TTL_SECONDS and rag.memory_compactor deletes them.
+
+        Parameters
+        ----------
+        documents : List[Document]
+            A list of documents to be remembered.
+
+        Returns
+        -------
+        List[str]
+            A list of document IDs in the Chroma vector store.
+        """
+        return self.manager.remember(documents, agent_id=self.agent_id)
     
     def delete_later_coinmetrics_token_updates(self) -> List[str]:
         # TODO step 1 replace btc asset with asset from user query
@@ -166,6 +191,9 @@ class RagPipeline:
                     first_page = False
 
                 if all_data:
+                    # keep the daily history in the local price store instead of only embedding it
+                    price_store = PriceStore.shared()
+                    price_store.write_bars(price_store.coinmetrics_rows_to_bars(all_data))
                     asset_stats[i] = all_data
                     asset_stats_list.extend(data)
                     portfolio_document_list = self.process_multiple_json(json_data_list=asset_stats_list, metadata_source="nfa_opportunities")            
@@ -205,8 +233,10 @@ class RagPipeline:
         try:
 
             latest_portfolio_token_data = self.token_prices.get_coinmarketcap_latest_token_stats(ids_list=MOCK_LIST_3)
-            portfolio_document_list = self.process_multiple_json(json_data_list=latest_portfolio_token_data, metadata_source="nfa_opportunities")            
-            latest_portfolio_documents_ids = self.add_documents_to_db(portfolio_document_list)
+            # only split, process_multiple_json() would also store the chunks in the knowledge base collection for good
+            portfolio_document_list = self.embed_model.split_multiple_json(json_data_list=latest_portfolio_token_data, metadata_source="nfa_opportunities")
+            # market data is only relevant for a few cycles, it expires instead of being deleted by the caller
+            latest_portfolio_documents_ids = self.remember_documents(portfolio_document_list)
             print(f"Added {(len(latest_portfolio_documents_ids))} cmc documents to the Chroma database. \n")
             return latest_portfolio_documents_ids
         except Exception as e:
@@ -0,0 +1,234 @@
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from typing_extensions import List
+
+from pymongo.collection import Collection
+
+from config.config import MFAMongodbConsts
+from rag.mongo_client_registry import MongoClientRegistry
+
+
+class TokenIdResolver:
+    """
+    In memory map of the NFA 'tokens' collection from symbol, slug and contract address to Coinmarketcap ids.
+
+    The collection is read once (only the fields used for resolving) and kept fresh by a change
+    stream applying every inserted, updated, replaced or deleted token document. The stream
+    resumes from a token taken before the collection was read, so the changes written while it
+    was read are applied too. Resolving a
+    symbol is a dict lookup with no network round trip. The indexes backing the load and the
+    lookups that still go to Mongo are created when missing.
+
+    Parameters
+    ----------
+    tokens_collection : Optional[Callable[[], Collection]]
+        Returns the tokens collection, by default built from MFAMongodbConsts.
+
+    Methods
+    -------
+    shared() -> TokenIdResolver
+        Returns the process wide resolver, loaded and watching on first use.
+    resolve(key: str) -> List[str]
+        Coinmarketcap ids of a symbol, slug or contract address.
+    resolve_many(keys: Iterable[str]) -> Dict[str, List[str]]
+        Coinmarketcap ids of many keys at once.
+    remember(symbol: str, ids: List[str]) -> None
+        Caches ids found elsewhere (e.g. the Coinmarketcap API) for a symbol.
+    """
+
+    TOKENS_COLLECTION_NAME = "tokens"
+    PROJECTION = {"symbol": 1, "cmc_info.id": 1, "cmc_info.slug": 1, "cmc_info.platform.token_address": 1}
+    INDEXES = ("symbol", "cmc_info.slug", "cmc_info.platform.token_address")
+    # lookup order of resolve()
+    KEY_KINDS = ("symbol", "slug", "address")
+
+    _shared: Optional["TokenIdResolver"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, tokens_collection: Optional[Callable[[], Collection]] = None) -> None:
+        self.tokens_collection = tokens_collection or self._mfa_tokens
+        self.loaded = False
+        # (kind, key) -> {document _id: ids}, so a document can be removed from every key it was indexed under
+        self._index: Dict[Tuple[str, str], Dict[Any, List[str]]] = {}
+        self._document_keys: Dict[Any, List[Tuple[str, str]]] = {}
+        self._remembered: Dict[str, List[str]] = {}
+        # position of the tokens change stream before the last load, the watcher resumes from it
+        self._load_resume_token: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    @classmethod
+    def shared(cls) -> "TokenIdResolver":
+        """
+        Return the process wide resolver, loading it and starting its watcher on first use.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+                cls._shared.ensure_indexes()
+                cls._shared.load()
+                cls._shared.start_watcher()
+            return cls._shared
+
+    def ensure_indexes(self) -> None:
+        """
+        Create the tokens indexes when missing, a read only user only gets a warning.
+        """
+        try:
+            collection = self.tokens_collection()
+            for field in self.INDEXES:
+                collection.create_index(field)
+        except Exception as e:
+            print(f"unable to ensure indexes on NFA tokens collection: {e}")
+
+    def load(self) -> bool:
+        """
+        (Re)load the whole map from the tokens collection.
+
+        Returns
+        -------
+        bool
+            True when the collection was read, the previous map is kept otherwise.
+        """
+        try:
+            collection = self.tokens_collection()
+            # taken before the read, the changes written during it are replayed by the watcher
+            resume_token = self._current_resume_token(collection)
+            documents = list(collection.find({}, projection=self.PROJECTION))
+        except Exception as e:
+            print(f"unable to load NFA tokens collection: {e}")
+            return False
+
+        with self._lock:
+            self._index = {}
+            self._document_keys = {}
+            for document in documents:
+                self._add_document(document)
+            self._load_resume_token = resume_token
+            self.loaded = True
+        print(f"loaded {len(documents)} NFA tokens into the token id resolver")
+        return True
+
+    def resolve(self, key: str) -> List[str]:
+        """
+        Coinmarketcap ids of a symbol, slug or contract address, in that lookup order.
+
+        Parameters
+        ----------
+        key : str
+            Symbol (e.g. 'ETH'), Coinmarketcap slug (e.g. 'ethereum') or contract address.
+
+        Returns
+        -------
+        List[str]
+            The Coinmarketcap ids as strings, [] when unknown. When several token documents share
+            the key, the ids of the earliest inserted one (lowest _id) are returned, as find_one did.
+        """
+        with self._lock:
+            for kind in self.KEY_KINDS:
+                documents = self._index.get((kind, self._normalize(kind, key)))
+                if documents:
+                    return list(documents[min(documents, key=self._document_rank)])
+            return list(self._remembered.get(self._normalize("symbol", key), []))
+
+    def resolve_many(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        return {key: self.resolve(key) for key in keys}
+
+    def remember(self, symbol: str, ids: List[str]) -> None:
+        """
+        Cache ids that were found outside of the tokens collection, used when the symbol is not in it.
+        """
+        if ids:
+            with self._lock:
+                self._remembered[self._normalize("symbol", symbol)] = [str(token_id) for token_id in ids]
+
+    def handle_change(self, change: Dict[str, Any]) -> None:
+        """
+        Apply a tokens change stream event to the map.
+        """
+        document_id = change.get("documentKey", {}).get("_id")
+        with self._lock:
+            self._remove_document(document_id)
+            if change.get("operationType") != "delete" and change.get("fullDocument"):
+                self._add_document(change["fullDocument"])
+
+    def start_watcher(self) -> threading.Thread:
+        """
+        Start (once) the daemon thread applying tokens changes to the map.
+        """
+        with self._lock:
+            if self._watcher is None or not self._watcher.is_alive():
+                self._stop_event.clear()
+                self._watcher = threading.Thread(target=self._watch_tokens, name="TokenIdResolverWatcher", daemon=True)
+                self._watcher.start()
+            return self._watcher
+
+    def stop_watcher(self) -> None:
+        self._stop_event.set()
+
+    def _watch_tokens(self) -> None:
+        resume_token = self._load_resume_token
+        while not self._stop_event.is_set():
+            try:
+                with self.tokens_collection().watch(full_document="updateLookup", resume_after=resume_token, max_await_time_ms=1000) as stream:
+                    while not self._stop_event.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self.handle_change(change)
+                        resume_token = stream.resume_token
+            except Exception as e:
+                print(f"token id resolver change stream error: {e}, reloading in 5 seconds")
+                # the resume token may have expired meanwhile, start again from a full load
+                if not self._stop_event.wait(5):
+                    self.load()
+                resume_token = self._load_resume_token
+
+    @staticmethod
+    def _current_resume_token(collection: Collection) -> Optional[Dict[str, Any]]:
+        # a new change stream caches the server's post batch resume token, the current position of the oplog
+        try:
+            with collection.watch(full_document="updateLookup", max_await_time_ms=1) as stream:
+                return stream.resume_token
+        except Exception as e:
+            print(f"unable to open the NFA tokens change stream before loading, changes written meanwhile are missed: {e}")
+            return None
+
+    def _add_document(self, document: Dict[str, Any]) -> None:
+        cmc_info = document.get("cmc_info") or []
+        ids = [str(entry["id"]) for entry in cmc_info if entry.get("id") is not None]
+        if not ids:
+            return
+
+        keys = [("symbol", self._normalize("symbol", document.get("symbol")))]
+        for entry in cmc_info:
+            keys.append(("slug", self._normalize("slug", entry.get("slug"))))
+            keys.append(("address", self._normalize("address", (entry.get("platform") or {}).get("token_address"))))
+        keys = [key for key in dict.fromkeys(keys) if key[1]]
+
+        for key in keys:
+            self._index.setdefault(key, {})[document["_id"]] = ids
+        self._document_keys[document["_id"]] = keys
+
+    def _remove_document(self, document_id: Any) -> None:
+        for key in self._document_keys.pop(document_id, []):
+            documents = self._index.get(key, {})
+            documents.pop(document_id, None)
+            if not documents:
+                self._index.pop(key, None)
+
+    @staticmethod
+    def _document_rank(document_id: Any) -> Tuple[str, Any]:
+        # ObjectIds grow with insertion time, the type name keeps mixed _id types comparable
+        return type(document_id).__name__, document_id
+
+    @staticmethod
+    def _normalize(kind: str, key: Optional[str]) -> str:
+        if not key:
+            return ""
+        return key.strip().upper() if kind == "symbol" else key.strip().lower()
+
+    @staticmethod
+    def _mfa_tokens() -> Collection:
+        mfa_mongodb = MFAMongodbConsts()
+        return MongoClientRegistry.get_database(mfa_mongodb.MFA_MONGDB_URI, mfa_mongodb.DB_NAME)[TokenIdResolver.TOKENS_COLLECTION_NAME]
@@ -3,8 +3,8 @@ import os
 import openai
 import numpy as np
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from config.config import OpenAiConsts
+from pymongo import MongoClient, UpdateOne
+from rag.embedding_service import EmbeddingService
 
 
 '''
@@ -47,22 +47,25 @@ collection = db["agent_settings"]  # Collection name
 # Configure OpenAI API
 openai.api_key = OPENAI_API_KEY
 
-def generate_embedding(text):
-    """Generate OpenAI embeddings for a given text"""
+def submit_embedding(text):
+    """Queue a text on the shared embedding service, returns a future of its embedding"""
     if not text or text.strip() == "":  # Avoid sending empty text
         logging.warning("Skipping empty text for embedding.")
         return None
 
-    logging.info(f"Generating embedding for text (length: {len(text)} chars)...")
-    try:
-        response = openai.embeddings.create(
-            # model="text-embedding-ada-002",
-            model= OpenAiConsts().DEFAULT_EMBEDDING_MODEL,
-            input=text
-        )
-        logging.info("Embedding generated successfully.")
-        return response.data[0].embedding
+    logging.info(f"Submitting text for embedding (length: {len(text)} chars)...")
+    return EmbeddingService.shared().submit(text)
 
+def generate_embedding(text):
+    """Generate OpenAI embeddings for a given text"""
+    return embedding_result(submit_embedding(text))
+
+def embedding_result(future):
+    """Wait for a submitted embedding, None when nothing was submitted or the request failed"""
+    if future is None:
+        return None
+    try:
+        return future.result()
     except Exception as e:
         logging.error(f"Failed to generate embedding: {e}")
         return None
@@ -72,17 +75,16 @@ def process_documents():
     logging.info("Fetching documents from MongoDB...")
     documents = collection.find({}, {"_id": 1, "persona": 1, "knowledgeBase": 1})
 
-    count = 0
+    # Submit every text up front, the embedding service batches them into as few requests as the provider allows
+    pending = []
     for doc in documents:
-        doc_id = doc["_id"]
-        persona_text = doc.get("persona", "")
-        knowledge_base_text = doc.get("knowledgeBase", "")
-
-        logging.info(f"Processing document ID: {doc_id}")
+        logging.info(f"Processing document ID: {doc['_id']}")
+        pending.append((doc["_id"], submit_embedding(doc.get("persona", "")), submit_embedding(doc.get("knowledgeBase", ""))))
 
-        # Generate embeddings
-        persona_embedding = generate_embedding(persona_text)
-        knowledge_base_embedding = generate_embedding(knowledge_base_text)
+    updates = []
+    for doc_id, persona_future, knowledge_base_future in pending:
+        persona_embedding = embedding_result(persona_future)
+        knowledge_base_embedding = embedding_result(knowledge_base_future)
 
         # Prepare update query
         update_query = {}
@@ -91,13 +93,13 @@ def process_documents():
         if knowledge_base_embedding:
             update_query["knowledgeBase_embeddings"] = knowledge_base_embedding
 
-        # Update MongoDB document with new embeddings
         if update_query:  # Only update if there's something new to insert
-            collection.update_one({"_id": doc_id}, {"$set": update_query})
-            logging.info(f"Updated document {doc_id} with embeddings.")
-            count += 1
+            updates.append(UpdateOne({"_id": doc_id}, {"$set": update_query}))
 
-    logging.info(f"All documents processed successfully! {count} documents updated.")
+    # Update MongoDB documents with new embeddings in one bulk write
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+    logging.info(f"All documents processed successfully! {len(updates)} documents updated.")
 
 # Run the script
 # if __name__ == "__main__":
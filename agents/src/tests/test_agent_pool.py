@@ -0,0 +1,69 @@
+from bson.objectid import ObjectId
+
+from ica.agent_pool import AgentPool
+
+
+class FakeAgent:
+    def __init__(self):
+        self.graphs_created = 0
+        self.cycle_resets = 0
+        self.closed = False
+
+    def create_agent(self):
+        self.graphs_created += 1
+
+    def reset_cycle_state(self):
+        self.cycle_resets += 1
+
+    def close(self):
+        self.closed = True
+
+
+def run_cycle(agent_pool, agent_id, fingerprint):
+    agent = agent_pool.acquire(agent_id=agent_id, fingerprint=fingerprint, build=FakeAgent)
+    agent_pool.release(agent_id)
+    return agent
+
+
+def test_agent_pool_reuses_agent_until_settings_change():
+    agent_pool = AgentPool(settings_collection=lambda: None)
+    settings = {"_id": ObjectId("67bda73d43d6464a9cad4241"), "persona": "Joey"}
+    agent_id = str(settings["_id"])
+
+    agent = run_cycle(agent_pool, agent_id, AgentPool.fingerprint(settings))
+    assert run_cycle(agent_pool, agent_id, AgentPool.fingerprint(settings)) is agent
+    assert (agent.graphs_created, agent.cycle_resets) == (1, 2)
+
+    # embeddings written back by the insert listener do not make the agent stale
+    assert AgentPool.fingerprint({**settings, "embedded_persona": [0.1]}) == AgentPool.fingerprint(settings)
+
+    changed_settings = {**settings, "persona": "Diana"}
+    rebuilt_agent = run_cycle(agent_pool, agent_id, AgentPool.fingerprint(changed_settings))
+    assert rebuilt_agent is not agent
+    assert agent.closed and not rebuilt_agent.closed
+
+
+def test_agent_pool_change_stream_events_evict_agents():
+    agent_pool = AgentPool(settings_collection=lambda: None)
+    agent_id = ObjectId("67bda73d43d6464a9cad4241")
+    agent = run_cycle(agent_pool, str(agent_id), "v1")
+
+    agent_pool.handle_change({"operationType": "update", "documentKey": {"_id": agent_id}, "updateDescription": {"updatedFields": {"embedded_persona": [0.1]}}})
+    assert run_cycle(agent_pool, str(agent_id), "v1") is agent
+
+    agent_pool.handle_change({"operationType": "update", "documentKey": {"_id": agent_id}, "updateDescription": {"updatedFields": {"persona": "Diana"}}})
+    assert str(agent_id) not in agent_pool.agents and agent.closed
+    assert run_cycle(agent_pool, str(agent_id), "v1") is not agent
+
+
+def test_agent_evicted_during_its_cycle_is_closed_when_released():
+    agent_pool = AgentPool(settings_collection=lambda: None)
+    agent = agent_pool.acquire(agent_id="agent", fingerprint="v1", build=FakeAgent)
+
+    agent_pool.invalidate("agent")
+    # the running cycle keeps an open agent, its portfolio state still flushes
+    assert not agent.closed and agent_pool.agents["agent"].stale
+
+    agent_pool.release("agent")
+    assert agent.closed and "agent" not in agent_pool.agents
+    assert run_cycle(agent_pool, "agent", "v1") is not agent
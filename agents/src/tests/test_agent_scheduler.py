@@ -0,0 +1,113 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from config.config import SchedulerConsts
+from ica.rate_limiter import RateLimiter
+from ica.agent_scheduler import AgentScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(max_concurrent_agents=4, interval=60, clock=time.monotonic):
+    scheduler_consts = SchedulerConsts(MAX_CONCURRENT_AGENTS=max_concurrent_agents, AGENT_CYCLE_INTERVAL_SECONDS=interval, CYCLE_COST={"openai": 1})
+    return AgentScheduler(scheduler_consts=scheduler_consts, rate_limiters={"openai": RateLimiter(rate=1000, capacity=1000)}, clock=clock)
+
+
+def test_rate_limiter_token_bucket():
+    clock = FakeClock()
+    rate_limiter = RateLimiter(rate=2, capacity=4, clock=clock)
+
+    assert rate_limiter.acquire(blocking=False, tokens=4)
+    assert not rate_limiter.acquire(blocking=False)
+    assert rate_limiter.try_acquire(tokens=1) == pytest.approx(0.5)
+
+    clock.now += 1
+    assert rate_limiter.acquire(blocking=False, tokens=2)
+    assert rate_limiter.available_tokens == pytest.approx(0)
+
+
+def test_run_due_runs_agents_concurrently_with_a_bound():
+    scheduler = make_scheduler(max_concurrent_agents=3)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def job():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.2)
+        with lock:
+            running.pop()
+        return "done"
+
+    for agent_number in range(6):
+        scheduler.schedule(agent_id=f"agent_{agent_number}", job=job)
+
+    started_at = time.monotonic()
+    results = asyncio.run(scheduler.run_due())
+    elapsed = time.monotonic() - started_at
+
+    assert results == {f"agent_{agent_number}": "done" for agent_number in range(6)}
+    assert max(peak) == 3
+    # two waves of three instead of six sequential cycles
+    assert elapsed < 0.2 * 6 - 0.3
+
+
+def test_agents_keep_their_own_next_run_times():
+    clock = FakeClock()
+    scheduler = make_scheduler(interval=60, clock=clock)
+    calls = []
+
+    def failing_job():
+        calls.append("fast")
+        raise RuntimeError("provider down")
+
+    scheduler.schedule(agent_id="fast", job=failing_job, interval=10)
+    scheduler.schedule(agent_id="slow", job=lambda: calls.append("slow"))
+
+    results = asyncio.run(scheduler.run_due())
+    assert isinstance(results["fast"], RuntimeError)
+    assert scheduler.next_run_in() == 10
+
+    clock.now += 10
+    assert list(asyncio.run(scheduler.run_due())) == ["fast"]
+
+    scheduler.unschedule("fast")
+    clock.now += 50
+    assert list(asyncio.run(scheduler.run_due())) == ["slow"]
+    assert calls == ["fast", "slow", "fast", "slow"]
+
+
+def test_scheduler_thread_does_not_hold_agents_back_behind_a_slow_cycle():
+    scheduler = make_scheduler(max_concurrent_agents=2)
+    slow_cycle_done = threading.Event()
+    fast_cycles = []
+
+    scheduler.schedule(agent_id="slow", job=lambda: slow_cycle_done.wait(5))
+    scheduler.schedule(agent_id="fast", job=lambda: fast_cycles.append(time.monotonic()), interval=0.05)
+    scheduler.start()
+
+    deadline = time.monotonic() + 5
+    while len(fast_cycles) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # the fast agent kept its own interval while the slow cycle was still running
+    assert len(fast_cycles) >= 3 and not slow_cycle_done.is_set()
+
+    # agents scheduled from another thread start without waiting for the next timeout
+    late_cycle = threading.Event()
+    scheduler.schedule(agent_id="late", job=late_cycle.set)
+    assert late_cycle.wait(5)
+
+    slow_cycle_done.set()
+    scheduler.stop(timeout=5)
+    assert not scheduler._thread.is_alive()
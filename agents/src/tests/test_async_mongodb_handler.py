@@ -0,0 +1,111 @@
+import asyncio
+from types import SimpleNamespace
+
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from rag.async_mongodb_handler import AsyncMongoDBHandler
+from rag.token_id_resolver import TokenIdResolver
+from tests.test_token_id_resolver import FakeTokensCollection
+
+
+class FakeAsyncCollection:
+    """Async agent_portfolio stand in answering find_one from one stored document and recording writes."""
+
+    name = "agent_portfolio"
+
+    def __init__(self, document=None, lost_races=0):
+        self.document = document
+        self.full_name = f"privex.agent_portfolio.{id(self)}"
+        self.lost_races = lost_races
+        self.indexes = []
+        self.writes = []
+
+    async def create_index(self, keys, **kwargs):
+        self.indexes.append((keys, kwargs))
+
+    async def find_one(self, filter, projection=None):
+        self.writes.append(("find_one", filter))
+        return self.document
+
+    async def update_one(self, filter, update, upsert=False):
+        self.writes.append(("update_one", filter, update, upsert))
+        if self.lost_races:
+            self.lost_races -= 1
+            raise DuplicateKeyError("E11000 duplicate key error")
+        return SimpleNamespace(upserted_id=None, modified_count=1)
+
+    async def bulk_write(self, operations, ordered=True):
+        self.writes.append(("bulk_write", operations, ordered))
+        if self.lost_races:
+            self.lost_races -= 1
+            raise BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000 duplicate key error"}]})
+        return SimpleNamespace(upserted_count=0)
+
+
+class FakeAsyncHandler(AsyncMongoDBHandler):
+    def __init__(self, agent_portfolio):
+        super().__init__("DIANA")
+        self._agent_portfolio = agent_portfolio
+
+    @property
+    def agent_portfolio(self):
+        return self._agent_portfolio
+
+
+def test_async_handler_reads_portfolio_details():
+    agent_id = str(ObjectId())
+    handler = FakeAsyncHandler(FakeAsyncCollection({"portfolioDetails": {"ETH": {"amount": 1.0}}}))
+
+    assert asyncio.run(handler.get_portfolio_details(agent_id)) == {"ETH": {"amount": 1.0}}
+    assert handler.agent_portfolio.writes == [("find_one", {"agentId": ObjectId(agent_id)})]
+
+    # an agent without a portfolio has no holdings
+    assert asyncio.run(FakeAsyncHandler(FakeAsyncCollection()).get_portfolio_details(agent_id)) == {}
+
+
+def test_async_handler_writes_holdings_in_one_ordered_bulk_write():
+    agent_id = str(ObjectId())
+    handler = FakeAsyncHandler(FakeAsyncCollection())
+
+    asyncio.run(handler.write_portfolio_holdings(agent_id, holdings={"ETH": {"last_price": 2700.0}}, increments={"ETH": {"amount": 0.5}}))
+
+    [(method, operations, ordered)] = handler.agent_portfolio.writes
+    assert method == "bulk_write" and ordered
+    assert len(operations) == 1
+    assert operations[0]._doc == {"$set": {"portfolioDetails.ETH.last_price": 2700.0, "portfolioDetails.ETH.symbol": "ETH"}, "$inc": {"portfolioDetails.ETH.amount": 0.5}}
+    # nothing to write is not a round trip
+    assert asyncio.run(handler.write_portfolio_holdings(agent_id)) is None
+    assert len(handler.agent_portfolio.writes) == 1
+
+
+def test_async_portfolio_writes_ensure_the_index_and_retry_lost_insert_races():
+    agent_id = str(ObjectId())
+    handler = FakeAsyncHandler(FakeAsyncCollection(lost_races=1))
+
+    asyncio.run(handler.write_portfolio_holdings(agent_id, holdings={"ETH": {"last_price": 2700.0}, "BTC": {"last_price": 95000.0}}))
+
+    assert handler.agent_portfolio.indexes == [("agentId", {"unique": True, "name": "agentId_unique"})]
+    # the failed upsert and the ones after it are written again, they now update the other writer's document
+    [(_, first_operations, _), (_, retried_operations, _)] = handler.agent_portfolio.writes
+    assert retried_operations == first_operations[1:]
+
+    handler.agent_portfolio.lost_races = 1
+    asyncio.run(handler.update_or_create_portfolio_v2(agent_id, portfolio_updates={}, portfolio_metrics={}))
+    assert [write[0] for write in handler.agent_portfolio.writes[2:]] == ["update_one", "update_one"]
+    # the index is created once per process
+    assert len(handler.agent_portfolio.indexes) == 1
+
+
+def test_async_symbol_lookup_goes_through_the_shared_token_id_resolver(monkeypatch):
+    resolver = TokenIdResolver(tokens_collection=lambda: FakeTokensCollection([
+        {"_id": 2, "symbol": "UNI", "cmc_info": [{"id": 99999}]},
+        {"_id": 1, "symbol": "UNI", "cmc_info": [{"id": 7083, "slug": "uniswap"}]},
+    ]))
+    assert resolver.load()
+    monkeypatch.setattr(TokenIdResolver, "_shared", resolver)
+    handler = FakeAsyncHandler(FakeAsyncCollection())
+
+    # same case handling, slug fallback and document ranking as MongoDBHandler.get_cmc_ids_by_symbols()
+    assert asyncio.run(handler.get_cmc_ids_by_symbols("uni")) == ["7083"]
+    assert asyncio.run(handler.get_cmc_ids_by_symbols("uniswap")) == ["7083"]
@@ -0,0 +1,153 @@
+import time
+
+from config.config import ChangeStreamConsts
+from rag.change_stream_listener import ChangeStreamListener, ChangeStreamSubscription
+
+
+class FakeStream:
+    def __init__(self, changes, post_batch_resume_token=None):
+        self.changes = changes
+        self.post_batch_resume_token = post_batch_resume_token
+        self.resume_token = None
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def try_next(self):
+        if self.changes:
+            change = self.changes.pop(0)
+            self.resume_token = change["_id"]
+            return change
+        if self.post_batch_resume_token is not None:
+            self.resume_token = self.post_batch_resume_token
+        return None
+
+
+class FakeCollection:
+    def __init__(self, changes, post_batch_resume_token=None):
+        self.changes = changes
+        self.post_batch_resume_token = post_batch_resume_token
+        self.resumed_after = []
+
+    def watch(self, pipeline, full_document=None, resume_after=None, max_await_time_ms=None):
+        self.resumed_after.append(resume_after)
+        # events up to the resume token were already delivered
+        changes = [change for change in self.changes if resume_after is None or change["_id"]["n"] > resume_after["n"]]
+        return FakeStream(changes, post_batch_resume_token=self.post_batch_resume_token)
+
+
+class FakeResumeTokenStore:
+    def __init__(self, tokens=None):
+        self.tokens = tokens or {}
+        self.saved = []
+
+    def load(self, name):
+        return self.tokens.get(name)
+
+    def save(self, name, resume_token):
+        self.tokens[name] = resume_token
+        self.saved.append(resume_token)
+
+    def clear(self, name):
+        self.tokens.pop(name, None)
+
+
+class FakeDeadLetterStore:
+    def __init__(self):
+        self.dead_letters = []
+
+    def save(self, name, changes, error):
+        self.dead_letters.append((name, changes, error))
+
+
+def run_listener(collection, resume_token_store, batches, expected_events=None, handle_batch=None, until=None, dead_letter_store=None):
+    listener = ChangeStreamListener(
+        subscriptions=[ChangeStreamSubscription(name="agents", collection=lambda: collection, handle_batch=handle_batch or batches.append)],
+        resume_token_store=resume_token_store,
+        change_stream_consts=ChangeStreamConsts(BATCH_SIZE=2, BATCH_WAIT_SECONDS=0, RETRY_SECONDS=0, HANDLE_ATTEMPTS=2, HANDLE_RETRY_SECONDS=0, MAX_BATCH_REDELIVERIES=2),
+        dead_letter_store=dead_letter_store or FakeDeadLetterStore(),
+    )
+    until = until or (lambda: listener.events_handled["agents"] >= expected_events)
+    listener.start()
+    deadline = time.monotonic() + 5
+    while not until() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    listener.stop()
+    return listener
+
+
+def test_listener_batches_events_and_resumes_after_the_last_handled_one():
+    collection = FakeCollection([{"_id": {"n": n}, "fullDocument": {"_id": n}} for n in range(1, 6)])
+    resume_token_store = FakeResumeTokenStore()
+    batches = []
+
+    run_listener(collection, resume_token_store, batches, expected_events=5)
+
+    assert [[change["_id"]["n"] for change in batch] for batch in batches] == [[1, 2], [3, 4], [5]]
+    assert resume_token_store.tokens == {"agents": {"n": 5}}
+
+    # a restarted listener only gets the events written after the persisted token
+    collection.changes.append({"_id": {"n": 6}, "fullDocument": {"_id": 6}})
+    restarted_batches = []
+    run_listener(collection, resume_token_store, restarted_batches, expected_events=1)
+
+    assert collection.resumed_after[-1] == {"n": 5}
+    assert [[change["_id"]["n"] for change in batch] for batch in restarted_batches] == [[6]]
+
+
+def test_listener_delivers_a_failing_batch_again_instead_of_skipping_it():
+    collection = FakeCollection([{"_id": {"n": n}, "fullDocument": {"_id": n}} for n in range(1, 6)])
+    resume_token_store = FakeResumeTokenStore()
+    batches = []
+    failures = []
+
+    def handle_batch(batch):
+        # the batch of event 3 fails both attempts of its first delivery and the first attempt of the next one
+        if batch[0]["_id"]["n"] == 3 and len(failures) < 3:
+            failures.append(batch)
+            raise RuntimeError("chroma is unavailable")
+        batches.append(batch)
+
+    run_listener(collection, resume_token_store, batches, handle_batch=handle_batch, until=lambda: resume_token_store.tokens.get("agents") == {"n": 5})
+
+    assert len(failures) == 3 and [[3, 4]] == [[change["_id"]["n"] for change in batch] for batch in batches if batch[0]["_id"]["n"] == 3]
+    # reopened after the last handled batch, the token never moved past the failed one before it succeeded
+    assert {"n": 2} in collection.resumed_after
+    assert [token["n"] for token in resume_token_store.saved] == sorted(token["n"] for token in resume_token_store.saved)
+    assert resume_token_store.tokens == {"agents": {"n": 5}}
+
+
+def test_listener_dead_letters_a_batch_that_always_fails_and_moves_on():
+    collection = FakeCollection([{"_id": {"n": n}, "fullDocument": {"_id": n}} for n in range(1, 6)])
+    resume_token_store = FakeResumeTokenStore()
+    dead_letter_store = FakeDeadLetterStore()
+    batches = []
+
+    def handle_batch(batch):
+        if any(change["_id"]["n"] == 3 for change in batch):
+            raise ValueError("the embedder rejects agent 3")
+        batches.append(batch)
+
+    run_listener(collection, resume_token_store, batches, handle_batch=handle_batch, dead_letter_store=dead_letter_store, until=lambda: resume_token_store.tokens.get("agents") == {"n": 5})
+
+    # delivered once and redelivered twice from the last handled token before it was skipped
+    assert collection.resumed_after.count({"n": 2}) == 2
+    [(name, changes, error)] = dead_letter_store.dead_letters
+    assert name == "agents" and [change["_id"]["n"] for change in changes] == [3, 4] and "rejects agent 3" in error
+    # the later events are not stalled behind it
+    assert [change["_id"]["n"] for batch in batches for change in batch][-1] == 5
+    assert resume_token_store.tokens == {"agents": {"n": 5}}
+
+
+def test_listener_persists_the_post_batch_token_without_events():
+    # every event since {"n": 1} was filtered out by the pipeline, the server moved the token anyway
+    collection = FakeCollection([], post_batch_resume_token={"n": 7})
+    resume_token_store = FakeResumeTokenStore({"agents": {"n": 1}})
+
+    run_listener(collection, resume_token_store, [], until=lambda: resume_token_store.tokens.get("agents") == {"n": 7})
+
+    assert collection.resumed_after[0] == {"n": 1} and resume_token_store.saved == [{"n": 7}]
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+from rag.chroma_registry import ChromaRegistry
+from rag.embedding_service import EmbeddingService
+from rag.rag_chroma_client import ChromaVectorStoreManager
+from tests.test_embedding_service import FakeEmbedder, make_service
+
+
+@pytest.fixture
+def persist_directory(tmp_path, monkeypatch):
+    service = make_service(FakeEmbedder())
+    monkeypatch.setattr(EmbeddingService, "shared", classmethod(lambda cls, backend=None: service))
+    monkeypatch.chdir(tmp_path)
+    ChromaRegistry.reset()
+    yield str(tmp_path / "chroma")
+    ChromaRegistry.reset()
+    service.close()
+
+
+def test_one_client_and_store_per_directory(persist_directory):
+    relative_path = os.path.relpath(persist_directory)
+
+    assert ChromaRegistry.get_client(persist_directory) is ChromaRegistry.get_client(relative_path)
+    assert ChromaRegistry.get_vector_store("DIANA", persist_directory) is ChromaRegistry.get_vector_store("DIANA", relative_path)
+    assert ChromaRegistry.get_vector_store("DIANA", persist_directory) is not ChromaRegistry.get_vector_store("example_collection", persist_directory)
+    assert ChromaRegistry.get_collection("DIANA", persist_directory) is ChromaRegistry.get_vector_store("DIANA", persist_directory)._collection
+
+
+def test_managers_share_the_collection_handle(persist_directory, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test_api_key")
+    writer = ChromaVectorStoreManager("DIANA")
+    reader = ChromaVectorStoreManager("DIANA")
+
+    ids = writer.add_documents([Document(page_content="gm", metadata={"source": "twitter_posts"})])
+
+    assert reader.vector_store is writer.vector_store and reader.collection is writer.collection
+    assert reader.collection.get(ids=ids)["documents"] == ["gm"]
+    # the default directory is where the langchain store always persisted
+    assert os.path.isdir("chroma_langchain_db")
+
+
+class WiderEmbedder(FakeEmbedder):
+    name = "wider"
+    model = "wider-model"
+
+    def embed_batch(self, texts):
+        return [embedding + [0.0] for embedding in super().embed_batch(texts)]
+
+
+def test_collection_of_another_embedding_model_fails_to_open(persist_directory, monkeypatch):
+    ChromaRegistry.get_vector_store("DIANA", persist_directory).add_texts(["gm"])
+    assert ChromaRegistry.get_collection("DIANA", persist_directory).metadata == {"embedding_backend": "fake", "embedding_model": "fake-model"}
+    ChromaRegistry.reset()
+
+    wider_embedder = WiderEmbedder()
+    wider_service = make_service(wider_embedder)
+    monkeypatch.setattr(EmbeddingService, "shared", classmethod(lambda cls, backend=None: wider_service))
+
+    with pytest.raises(ValueError, match="was embedded with fake"):
+        ChromaRegistry.get_vector_store("DIANA", persist_directory)
+    # decided from the metadata, no embedding request
+    assert wider_embedder.requests == []
+    # a new collection takes the vectors of any backend
+    assert ChromaRegistry.get_vector_store("example_collection", persist_directory) is not None
+    wider_service.close()
+
+
+def test_collection_created_before_models_were_recorded_is_probed_outside_the_lock(persist_directory, monkeypatch):
+    ChromaRegistry.get_client(persist_directory).get_or_create_collection("legacy").add(ids=["1"], embeddings=[[1.0, 2.0]], documents=["gm"])
+
+    unreachable_service = make_service(FakeEmbedder(fail=True))
+    monkeypatch.setattr(EmbeddingService, "shared", classmethod(lambda cls, backend=None: unreachable_service))
+    # a failing probe only warns, local operations on the collection still work
+    assert ChromaRegistry.get_collection("legacy", persist_directory).count() == 1
+    ChromaRegistry.reset()
+
+    wider_service = make_service(WiderEmbedder())
+    monkeypatch.setattr(EmbeddingService, "shared", classmethod(lambda cls, backend=None: wider_service))
+    with pytest.raises(ValueError, match="holds 2 dimensional embeddings"):
+        ChromaRegistry.get_vector_store("legacy", persist_directory)
+    ChromaRegistry.reset()
+
+    matching_service = make_service(FakeEmbedder())
+    monkeypatch.setattr(EmbeddingService, "shared", classmethod(lambda cls, backend=None: matching_service))
+    # a matching probe records the model, the next process reads it from the metadata
+    assert ChromaRegistry.get_collection("legacy", persist_directory).metadata == {"embedding_backend": "fake", "embedding_model": "fake-model"}
+    for service in (unreachable_service, wider_service, matching_service):
+        service.close()
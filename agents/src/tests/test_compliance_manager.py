@@ -0,0 +1,97 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from backtesting.compliance_manager import ComplianceManager
+from backtesting.risk_rules import RiskPolicy, evaluate_policies
+
+
+@pytest.fixture
+def token_stats():
+    return [
+        {"symbol": "SAFE_SMALL", "coinmarketcap_id": 1, "price_usd": 1.0, "percent_change_24h": 5.0, "marketcap": 5e6, "volume_24h": 1e6, "token_address": "0x"},
+        {"symbol": "VOLATILE", "coinmarketcap_id": 2, "price_usd": 2.0, "percent_change_24h": -45.0, "marketcap": 5e9, "volume_24h": 1e9, "token_address": "0x"},
+        {"symbol": "NO_CAP", "coinmarketcap_id": 3, "price_usd": 3.0, "percent_change_24h": 1.0, "marketcap": None, "volume_24h": 1e9, "token_address": "0x"},
+        {"symbol": "SAFE_LARGE", "coinmarketcap_id": 4, "price_usd": 4.0, "percent_change_24h": -1.0, "marketcap": 2e9, "volume_24h": 1e9, "token_address": "0x"},
+    ]
+
+
+def test_evaluate_risk_returns_lowest_market_cap_safe_token(token_stats):
+    compliance_manager = ComplianceManager()
+
+    assert compliance_manager.evaluate_risk(token_stats=token_stats) == {
+        "symbol": "SAFE_SMALL",
+        "coinmarketcap_id": 1,
+        "price_usd": 1.0,
+        "market_cap": 5e6,
+        "token_address": "0x0",
+    }
+    assert compliance_manager.evaluate_risk(token_stats=[]) == {}
+
+
+def test_screen_tokens_partitions_and_ranks(token_stats):
+    screened_tokens = ComplianceManager().screen_tokens(token_stats=token_stats, top_k=1)
+
+    assert screened_tokens["safe"].get_column("symbol").to_list() == ["SAFE_SMALL", "SAFE_LARGE"]
+    assert screened_tokens["risky"].get_column("symbol").to_list() == ["VOLATILE", "NO_CAP"]
+    assert screened_tokens["top_by_market_cap"].get_column("symbol").to_list() == ["SAFE_LARGE"]
+    assert screened_tokens["ranked"].get_column("symbol").to_list() == ["SAFE_LARGE"]
+
+
+def test_screen_tokens_accepts_numpy_columns():
+    token_count = 1000
+    token_stats = {
+        "symbol": np.array([f"T{i}" for i in range(token_count)]),
+        "coinmarketcap_id": np.arange(token_count),
+        "price_usd": np.ones(token_count),
+        "percent_change_24h": np.where(np.arange(token_count) % 2 == 0, 1.0, 50.0),
+        "marketcap": np.full(token_count, 1e8),
+        "volume_24h": np.full(token_count, 1e7),
+    }
+
+    screened_tokens = ComplianceManager().screen_tokens(token_stats=token_stats)
+
+    assert isinstance(screened_tokens["safe"], pl.DataFrame)
+    assert screened_tokens["safe"].height == token_count // 2
+    assert screened_tokens["ranked"].height == 10
+
+
+def test_risk_policy_rules_compile_to_one_mask():
+    token_stats = pl.DataFrame(
+        {
+            "symbol": ["BTC", "LUNA", "THIN", "JUMPY"],
+            "coinmarketcap_id": ["1", "4172", "99", "100"],
+            "market_cap": [1e12, 1e9, 1e9, 1e9],
+            "volume_24h": [1e10, 1e8, 1e5, 1e8],
+            "percent_change_1h": [0.5, 0.1, 0.1, 9.0],
+        }
+    )
+    policy = RiskPolicy(
+        rules=[
+            {"type": "max_abs", "field": "percent_change_1h", "value": 5},
+            {"type": "min_ratio", "numerator": "volume_24h", "denominator": "market_cap", "value": 0.001},
+            {"type": "denylist", "field": "symbol", "values": ["LUNA"]},
+        ]
+    )
+
+    assert policy.evaluate(token_stats).get_column("passes_policy").to_list() == [True, False, False, False]
+
+    policies = {"agent_a": policy, "agent_b": RiskPolicy(rules=[{"type": "allowlist", "field": "coinmarketcap_id", "values": [99]}])}
+    assert evaluate_policies(token_stats, policies).get_column("agent_b").to_list() == [False, False, True, False]
+
+
+def test_risk_policy_cache_recompiles_on_change():
+    rules = [{"type": "min", "field": "volume_24h", "value": 1}]
+    policy = RiskPolicy.cached(agent_id="agent_a", rules=rules)
+
+    assert RiskPolicy.cached(agent_id="agent_a", rules=list(rules)) is policy
+    assert RiskPolicy.cached(agent_id="agent_a", rules=[{"type": "min", "field": "volume_24h", "value": 2}]) is not policy
+    with pytest.raises(ValueError):
+        RiskPolicy(rules=[{"type": "unknown", "field": "volume_24h"}])
+
+
+def test_compliance_manager_uses_policy(token_stats):
+    policy = RiskPolicy(rules=[{"type": "denylist", "field": "symbol", "values": ["SAFE_LARGE"]}])
+    screened_tokens = ComplianceManager(policy=policy).screen_tokens(token_stats=token_stats)
+
+    assert "SAFE_LARGE" in screened_tokens["risky"].get_column("symbol").to_list()
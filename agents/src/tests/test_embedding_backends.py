@@ -0,0 +1,76 @@
+from dataclasses import replace
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from config.config import LocalEmbeddingConsts
+from rag.embedding_backends import EmbeddingBackend, OnnxEmbeddingBackend, OpenAIEmbeddingBackend, embedding_backend
+from rag.embedding_service import EmbeddingService
+
+
+class FakeTokenizer:
+    """Encodes a text as one token per word, padded to the longest text of the batch."""
+
+    def encode_batch(self, texts):
+        longest = max(len(text.split()) for text in texts)
+        return [
+            SimpleNamespace(
+                ids=[len(word) for word in text.split()] + [0] * (longest - len(text.split())),
+                attention_mask=[1] * len(text.split()) + [0] * (longest - len(text.split())),
+            )
+            for text in texts
+        ]
+
+
+class FakeSession:
+    """Embeds token id t as [t, 1], padding tokens as [100, 100]."""
+
+    def __init__(self, input_names=("input_ids", "attention_mask")):
+        self.input_names = input_names
+        self.inputs = None
+
+    def get_inputs(self):
+        return [SimpleNamespace(name=name) for name in self.input_names]
+
+    def run(self, output_names, inputs):
+        self.inputs = inputs
+        ids = inputs["input_ids"].astype(np.float32)
+        hidden = np.stack([ids, np.ones_like(ids)], axis=-1)
+        hidden[ids == 0] = 100
+        return [hidden]
+
+
+def test_embedding_backend_by_name():
+    assert isinstance(embedding_backend("openai"), OpenAIEmbeddingBackend)
+    assert isinstance(embedding_backend("onnx"), OnnxEmbeddingBackend)
+    with pytest.raises(ValueError):
+        embedding_backend("word2vec")
+    # a backend has to implement embed_batch
+    with pytest.raises(TypeError):
+        EmbeddingBackend()
+
+
+def test_onnx_backend_mean_pools_without_padding_and_normalizes():
+    session = FakeSession()
+    backend = OnnxEmbeddingBackend(session=session, tokenizer=FakeTokenizer())
+
+    embeddings = backend.embed_batch(["abc abc abc", "abcd"])
+
+    # only the inputs the model declares are passed
+    assert set(session.inputs) == {"input_ids", "attention_mask"}
+    assert embeddings[0] == pytest.approx([3 / np.sqrt(10), 1 / np.sqrt(10)])
+    assert embeddings[1] == pytest.approx([4 / np.sqrt(17), 1 / np.sqrt(17)])
+
+
+def test_local_backend_is_not_rate_limited_and_quantized_vectors_are_cached_apart():
+    backend = OnnxEmbeddingBackend(session=FakeSession(), tokenizer=FakeTokenizer())
+    quantized = OnnxEmbeddingBackend(local_embedding_consts=replace(LocalEmbeddingConsts(), QUANTIZE_INT8=True))
+
+    service = EmbeddingService(backend=backend)
+
+    assert service.rate_limiter is None
+    assert service.max_batch_inputs == LocalEmbeddingConsts().BATCH_SIZE
+    assert quantized.model != backend.model
+    assert service.embed(["ab"]) == [pytest.approx([2 / np.sqrt(5), 1 / np.sqrt(5)])]
+    service.close()
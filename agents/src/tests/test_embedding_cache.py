@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+import pytest
+
+from rag.embedding_cache import EmbeddingCache
+from rag.embedding_service import EmbeddingService
+from tests.test_embedding_service import FakeEmbedder, make_service
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def sqlite_path():
+    directory = tempfile.mkdtemp()
+    yield os.path.join(directory, "embeddings.sqlite3")
+
+
+def test_embeddings_persist_across_restarts(sqlite_path):
+    cache = EmbeddingCache(max_bytes=1024 * 1024, sqlite_path=sqlite_path)
+    cache.set_many("model-a", {"hello": [0.5, 0.25], "world": [1.0, 2.0]})
+    cache.close()
+
+    cache = EmbeddingCache(max_bytes=1024 * 1024, sqlite_path=sqlite_path)
+    assert cache.get_many("model-a", ["hello", "world", "missing"]) == {"hello": [0.5, 0.25], "world": [1.0, 2.0]}
+    # the model is part of the key
+    assert cache.get("model-b", "hello") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["disk_bytes"] == 16
+    cache.close()
+
+
+def test_least_recently_used_vectors_are_evicted_above_the_size_cap(sqlite_path):
+    # 2 float32 vectors of 4 dimensions fit in 32 bytes
+    cache = EmbeddingCache(max_bytes=32, sqlite_path=sqlite_path, memory_entries=1, clock=FakeClock())
+    cache.set_many("model", {"a": [1.0] * 4, "b": [2.0] * 4})
+    cache.get("model", "a")
+    cache.set_many("model", {"c": [3.0] * 4})
+
+    assert set(cache.get_many("model", ["a", "b", "c"])) == {"a", "c"}
+    assert cache.stats()["disk_bytes"] == 32
+    cache.close()
+
+
+def test_memory_only_cache_applies_the_size_cap_in_memory():
+    cache = EmbeddingCache(max_bytes=32, clock=FakeClock())
+    cache.set_many("model", {"a": [1.0] * 4, "b": [2.0] * 4, "c": [3.0] * 4})
+
+    assert set(cache.get_many("model", ["a", "b", "c"])) == {"b", "c"}
+
+
+def test_service_requests_only_uncached_texts():
+    embedder = FakeEmbedder()
+    service = make_service(embedder)
+    service.cache = EmbeddingCache(max_bytes=1024 * 1024)
+
+    first = service.embed(["persona", "knowledge base"])
+    second = service.embed(["persona", "knowledge base", "new tweet"])
+
+    assert embedder.requests == [["persona", "knowledge base"], ["new tweet"]]
+    assert second[:2] == first
+    service.close()
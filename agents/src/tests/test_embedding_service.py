@@ -0,0 +1,128 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+import pytest
+
+from config.config import EmbeddingServiceConsts
+from ica.rate_limiter import RateLimiter
+from rag.embedding_backends import EmbeddingBackend
+from rag.embedding_cache import EmbeddingCache
+from rag.embedding_service import EmbeddingService
+
+
+class BadRequestError(Exception):
+    status_code = 400
+
+
+class FakeEmbedder(EmbeddingBackend):
+    """Records every request and embeds a text as [len(text), request number]."""
+
+    name = "fake"
+    model = "fake-model"
+
+    def __init__(self, fail: bool = False, max_batch_inputs: int = 2048, max_batch_tokens: int = 250000, bad_text: str = None):
+        self.bad_text = bad_text
+        self.max_batch_inputs = max_batch_inputs
+        self.max_batch_tokens = max_batch_tokens
+        self.requests = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def embed_batch(self, texts):
+        with self.lock:
+            self.requests.append(list(texts))
+            request_number = len(self.requests)
+        if self.fail:
+            raise RuntimeError("provider unavailable")
+        if self.bad_text in texts:
+            raise BadRequestError("invalid input")
+        return [[float(len(text)), float(request_number)] for text in texts]
+
+
+def make_service(embedder, coalesce_window_seconds=0.05):
+    embedding_service_consts = replace(EmbeddingServiceConsts(), COALESCE_WINDOW_SECONDS=coalesce_window_seconds)
+    return EmbeddingService(backend=embedder, rate_limiter=RateLimiter(rate=1000, capacity=1000), embedding_service_consts=embedding_service_consts)
+
+
+def test_concurrent_submissions_share_one_request():
+    embedder = FakeEmbedder()
+    # a wide window, so every thread submits before it closes
+    service = make_service(embedder, coalesce_window_seconds=0.5)
+    texts = [f"text {index}" for index in range(20)]
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+        embeddings = list(pool.map(service.embed_one, texts))
+
+    assert len(embedder.requests) == 1
+    assert sorted(embedder.requests[0]) == sorted(texts)
+    assert embeddings == [[float(len(text)), 1.0] for text in texts]
+    service.close()
+
+
+def test_duplicate_texts_are_sent_once():
+    embedder = FakeEmbedder()
+    service = make_service(embedder)
+
+    embeddings = service.embed(["same", "other", "same"])
+
+    assert embedder.requests == [["same", "other"]]
+    assert embeddings[0] == embeddings[2]
+    service.close()
+
+
+def test_batches_respect_input_and_token_limits():
+    service = make_service(FakeEmbedder(max_batch_inputs=2, max_batch_tokens=10))
+    pending = [(text, None) for text in ["a", "b", "c", "x" * 40, "d"]]
+
+    batches = service.make_batches(pending)
+
+    # "x" * 40 is estimated at 11 tokens, larger than a request, so it is sent on its own
+    assert [list(batch) for batch in batches] == [["a", "b"], ["c"], ["x" * 40], ["d"]]
+    service.close()
+
+
+def test_failed_request_raises_from_every_future():
+    service = make_service(FakeEmbedder(fail=True))
+
+    futures = service.submit_many(["a", "b"])
+
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    service.close()
+
+
+def test_rejected_text_only_fails_its_own_callers():
+    embedder = FakeEmbedder(bad_text="bad")
+    service = make_service(embedder)
+
+    futures = service.submit_many(["a", "bb", "bad", "cccc"])
+
+    with pytest.raises(BadRequestError):
+        futures[2].result(timeout=5)
+    assert [future.result(timeout=5)[0] for future in futures[:2] + futures[3:]] == [1.0, 2.0, 4.0]
+    # split in halves until the rejected text was sent alone
+    assert embedder.requests == [["a", "bb", "bad", "cccc"], ["a", "bb"], ["bad", "cccc"], ["bad"], ["cccc"]]
+    service.close()
+
+
+def test_forked_process_builds_its_own_shared_services():
+    EmbeddingService._shared["fake"] = make_service(FakeEmbedder())
+    EmbeddingCache._shared = EmbeddingCache(max_bytes=1024)
+
+    EmbeddingService._reset_after_fork()
+    EmbeddingCache._reset_after_fork()
+
+    assert EmbeddingService._shared == {} and EmbeddingCache._shared is None
+
+
+def test_langchain_adapter_embeds_through_the_service():
+    embedder = FakeEmbedder()
+    service = make_service(embedder)
+    embeddings = service.as_langchain()
+
+    assert embeddings.embed_documents(["ab", "abc"]) == [[2.0, 1.0], [3.0, 1.0]]
+    assert embeddings.embed_query("abcd") == [4.0, 2.0]
+    assert service.requests_sent == 2
+    service.close()
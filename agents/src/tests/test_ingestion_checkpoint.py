@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+from rag.ingestion_checkpoint import IngestionCheckpoint
+
+
+def matches(document, query):
+    if "$or" in query:
+        return any(matches(document, branch) for branch in query["$or"])
+    for field, condition in query.items():
+        if isinstance(condition, dict):
+            if not document[field] > condition["$gt"]:
+                return False
+        elif document[field] != condition:
+            return False
+    return True
+
+
+class FakeCursor(list):
+    def sort(self, keys):
+        return sorted(self, key=lambda document: tuple(document[field] for field, _ in keys))
+
+
+class FakeCollection:
+    def __init__(self, documents=None):
+        self.documents = documents or []
+        self.name = "opportunities"
+        self.database = SimpleNamespace(name="nfa")
+
+    def find(self, query, projection=None, batch_size=None):
+        return FakeCursor(document for document in self.documents if matches(document, query))
+
+    def find_one(self, query):
+        return next((document for document in self.documents if document["_id"] == query["_id"]), None)
+
+    def update_one(self, query, update, upsert=False):
+        self.documents = [document for document in self.documents if document["_id"] != query["_id"]]
+        self.documents.append({**query, **update["$set"]})
+
+    def create_index(self, keys):
+        pass
+
+
+def test_checkpoint_streams_only_new_documents():
+    now = datetime.now()
+    opportunities = FakeCollection([
+        {"_id": 1, "createdAt": now - timedelta(hours=3), "data": "too old"},
+        {"_id": 2, "createdAt": now - timedelta(minutes=30), "data": "a"},
+        {"_id": 3, "createdAt": now - timedelta(minutes=30), "data": "b"},
+    ])
+    checkpoints = FakeCollection()
+    checkpoint = IngestionCheckpoint(name="test:opportunities", checkpoints_collection=lambda: checkpoints)
+
+    def stream():
+        return [document["_id"] for document in checkpoint.stream(collection=opportunities, time_field="createdAt", since=now - timedelta(hours=1))]
+
+    assert stream() == [2, 3]
+    checkpoint.rollback()
+    assert stream() == [2, 3]
+    checkpoint.commit()
+
+    opportunities.documents.append({"_id": 4, "createdAt": now - timedelta(minutes=30), "data": "same time, later id"})
+    assert stream() == [4]
+    checkpoint.commit()
+
+    # a new process resumes from the persisted mark
+    restarted_checkpoint = IngestionCheckpoint(name="test:opportunities", checkpoints_collection=lambda: checkpoints)
+    assert restarted_checkpoint.load() == {"time": now - timedelta(minutes=30), "_id": 4}
+    assert list(restarted_checkpoint.stream(collection=opportunities, time_field="createdAt", since=now - timedelta(hours=1))) == []
+
+
+def test_checkpoint_on_id_streams_documents_backdated_by_their_time_field():
+    now = datetime.now()
+    tweets = FakeCollection([
+        {"_id": ObjectId.from_datetime((now - timedelta(hours=3)).astimezone()), "created_at": now - timedelta(hours=3)},
+        {"_id": ObjectId(), "created_at": now - timedelta(minutes=5)},
+    ])
+    checkpoints = FakeCollection()
+    checkpoint = IngestionCheckpoint(name="test:twitterposts", checkpoints_collection=lambda: checkpoints)
+
+    def stream():
+        return [document["_id"] for document in checkpoint.stream(collection=tweets, time_field="_id", since=now - timedelta(hours=1))]
+
+    assert stream() == [tweets.documents[1]["_id"]]
+    checkpoint.commit()
+
+    # scraped now but posted before the last ingested tweet, a created_at mark would skip it
+    backdated = {"_id": ObjectId(), "created_at": now - timedelta(minutes=30)}
+    tweets.documents.append(backdated)
+    assert stream() == [backdated["_id"]]
+    checkpoint.commit()
+    assert stream() == []
@@ -0,0 +1,36 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from bson.objectid import ObjectId
+
+from config.config import KnowledgeIngestionConsts
+from rag.knowledge_ingestion import KnowledgeIngestionDaemon
+from tests.test_rag_chroma_client import InMemoryManager
+
+
+def test_knowledge_ingestion_embeds_latest_documents_of_a_batch():
+    manager = InMemoryManager()
+    daemon = KnowledgeIngestionDaemon(manager=manager, database=lambda: None, knowledge_ingestion_consts=KnowledgeIngestionConsts(BATCH_SIZE=2, BATCH_WAIT_SECONDS=0), resume_token_store=SimpleNamespace())
+    opportunity_id = ObjectId()
+    tweet_id = ObjectId()
+
+    assert [subscription.name for subscription in daemon.subscriptions()] == ["knowledge_ingestion:twitterposts", "knowledge_ingestion:opportunities", "knowledge_ingestion:tokens"]
+
+    ids = daemon.ingest_changes("opportunities", [
+        {"fullDocument": {"_id": opportunity_id, "data": {"token": "UNI"}, "createdAt": datetime(2025, 2, 1)}},
+        {"fullDocument": {"_id": opportunity_id, "data": {"token": "UNI", "score": 9}, "createdAt": datetime(2025, 2, 1)}},
+    ])
+    stored = manager.vector_store.get(where={"mongo_id": str(opportunity_id)})
+    # the second change of the opportunity replaced the first one
+    assert ids == stored["ids"] and len(ids) == 1
+    assert "'score': 9" in stored["documents"][0]
+    assert stored["metadatas"][0] == {"source": "nfa_opportunities", "collection": "opportunities", "mongo_id": str(opportunity_id), "created_at": datetime(2025, 2, 1).timestamp()}
+
+    # an unchanged document is not embedded again
+    embedded = len(manager.embeddings.embedded)
+    assert daemon.ingest_changes("opportunities", [{"fullDocument": {"_id": opportunity_id, "data": {"token": "UNI", "score": 9}}}]) == ids
+    assert len(manager.embeddings.embedded) == embedded
+
+    daemon.ingest_changes("twitterposts", [{"fullDocument": {"_id": tweet_id, "text": "gm", "created_at": datetime(2025, 2, 1)}}])
+    tweet_document = manager.vector_store.get(where={"mongo_id": str(tweet_id)})
+    assert tweet_document["metadatas"][0]["source"] == "twitter_posts" and "2025-02-01T00:00:00" in tweet_document["documents"][0]
@@ -0,0 +1,37 @@
+import time
+from dataclasses import replace
+
+from langchain_core.documents import Document
+
+from config.config import ShortTermMemoryConsts
+from rag.memory_compactor import MemoryCompactor
+from tests.test_rag_chroma_client import InMemoryManager
+
+
+def test_compact_deletes_expired_memory_of_every_collection():
+    managers = {"DIANA": InMemoryManager(), "agent-1": InMemoryManager()}
+    managers["DIANA"].remember([Document(page_content="eth up", metadata={"source": "nfa_opportunities"})], ttl_seconds=60)
+    managers["agent-1"].remember([Document(page_content="gm", metadata={"source": "twitter_posts"})], agent_id="agent-1", ttl_seconds=60)
+    live_ids = managers["agent-1"].remember([Document(page_content="wagmi", metadata={"source": "twitter_posts"})], agent_id="agent-1", ttl_seconds=3600)
+    compactor = MemoryCompactor(managers=managers, clock=lambda: time.time() + 120)
+
+    assert compactor.compact() == {"DIANA": 1, "agent-1": 1}
+    assert managers["DIANA"].vector_store.get(include=[])["ids"] == []
+    assert managers["agent-1"].vector_store.get(include=[])["ids"] == live_ids
+    assert compactor.compact() == {"DIANA": 0, "agent-1": 0}
+    assert compactor.documents_deleted == 2
+
+
+def test_compactor_thread_compacts_on_start():
+    manager = InMemoryManager()
+    manager.remember([Document(page_content="eth up", metadata={"source": "nfa_opportunities"})], ttl_seconds=0)
+    compactor = MemoryCompactor(managers={"DIANA": manager}, short_term_memory_consts=replace(ShortTermMemoryConsts(), COMPACTION_INTERVAL_SECONDS=60))
+
+    compactor.start()
+    deadline = time.monotonic() + 5
+    while compactor.documents_deleted == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    compactor.stop(timeout=5)
+
+    assert compactor.documents_deleted == 1
+    assert manager.vector_store.get(include=[])["ids"] == []
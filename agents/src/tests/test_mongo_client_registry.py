@@ -0,0 +1,50 @@
+import asyncio
+
+from config.config import MongoClientConsts
+from rag.mongo_client_registry import MongoClientRegistry
+
+
+def test_registry_shares_one_lazy_client_per_uri():
+    MongoClientRegistry.close_all()
+    settings = MongoClientConsts(MAX_POOL_SIZE=7)
+
+    client = MongoClientRegistry.get_client("mongodb://localhost:27017", mongo_client_consts=settings)
+
+    assert MongoClientRegistry.get_client("mongodb://localhost:27017") is client
+    assert MongoClientRegistry.get_client("mongodb://localhost:27018") is not client
+    assert client.options.pool_options.max_pool_size == 7
+    assert MongoClientRegistry.get_database("mongodb://localhost:27017", "privex").client is client
+
+    MongoClientRegistry.close_all()
+    assert MongoClientRegistry.get_client("mongodb://localhost:27017") is not client
+    MongoClientRegistry.close_all()
+
+
+def test_registry_shares_async_clients_per_event_loop():
+    async def get_clients():
+        client = MongoClientRegistry.get_async_client("mongodb://localhost:27017")
+        assert MongoClientRegistry.get_async_client("mongodb://localhost:27017") is client
+        await MongoClientRegistry.aclose_all()
+        return client
+
+    assert asyncio.run(get_clients()) is not asyncio.run(get_clients())
+
+
+def test_async_clients_are_closed_when_their_loop_shuts_down():
+    closed = []
+
+    async def get_client():
+        client = MongoClientRegistry.get_async_client("mongodb://localhost:27017")
+        close = client.close
+
+        async def record_close():
+            closed.append(client)
+            await close()
+
+        client.close = record_close
+        return client
+
+    client = asyncio.run(get_client())
+
+    assert closed == [client]
+    assert len(MongoClientRegistry._async_clients) == 0
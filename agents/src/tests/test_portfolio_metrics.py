@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pytest
+
+from backtesting.portfolio_metrics import PortfolioMetricsEngine
+from backtesting.token_prices import TokenPrices
+
+
+@pytest.fixture
+def portfolio():
+    return {
+        "LINK": {
+            "symbol": "LINK",
+            "token_id": 1975,
+            "amount": 0.1,
+            "signal_price": 20.0,
+            "last_price": 22.0,
+            "signal_timestamp": "2025-02-20 10:00:00",
+        },
+        "OP": {
+            "symbol": "OP",
+            "token_id": 11840.0,
+            "amount": -0.1,
+            "signal_price": 1.5,
+            "last_price": 1.2,
+            "signal_timestamp": "2025-02-25 09:00:00",
+        },
+    }
+
+
+@pytest.fixture
+def token_stats_by_id():
+    return {
+        "1975": {"price_usd": 22.0, "percent_change_7d": 10.0},
+        "11840": {"price_usd": 1.2, "percent_change_7d": -20.0},
+    }
+
+
+def test_portfolio_metrics_match_per_token_formulas(portfolio, token_stats_by_id):
+    current_time = datetime(2025, 2, 25, 12, 0, 0)
+    engine = PortfolioMetricsEngine()
+
+    records = {record["symbol"]: record for record in engine.calculate_records(portfolio, token_stats_by_id, current_time)}
+
+    link = records["LINK"]
+    assert link["PnL"] == pytest.approx(0.2)
+    assert link["cumulative_return"] == pytest.approx(0.1)
+    assert link["holding_duration_days"] == 5
+    assert link["daily_return"] == pytest.approx(0.02)
+    assert link["max_drawdown"] == pytest.approx(2.0 / 22.0)
+
+    op = records["OP"]
+    assert op["cumulative_return"] == pytest.approx(0.2)
+    assert op["holding_duration_days"] == 1
+
+    token_prices = TokenPrices()
+    for symbol, token_id in (("LINK", "1975"), ("OP", "11840")):
+        returns = token_prices.get_weekly_returns(
+            current_price=token_stats_by_id[token_id]["price_usd"],
+            percent_change_7d=token_stats_by_id[token_id]["percent_change_7d"],
+        ).pct_change().drop_nulls()
+        assert records[symbol]["volatility"] == pytest.approx(returns.std(), abs=1e-12)
+
+
+def test_portfolio_metrics_missing_quote_and_empty_portfolio(portfolio):
+    engine = PortfolioMetricsEngine()
+
+    records = engine.calculate_records(portfolio, {}, datetime(2025, 2, 25, 12, 0, 0))
+    assert [record["volatility"] for record in records] == [0.0, 0.0]
+    assert [record["sharpe_ratio"] for record in records] == [0.0, 0.0]
+
+    assert engine.calculate_records({}, {}) == []
+
+
+def test_implied_price_paths_are_closed_form_geometric():
+    token_prices = TokenPrices()
+
+    prices, return_stats = token_prices.get_implied_price_paths(current_prices=[100.0, 2.0], percent_changes=[10.0, -50.0], horizon="30d")
+
+    assert prices.shape == (2, 31)
+    assert prices[:, -1] == pytest.approx([100.0, 2.0])
+    assert prices[:, 0] == pytest.approx([100.0 / 1.1, 4.0])
+    assert return_stats["total_return"] == pytest.approx([0.1, -0.5])
+    assert prices[0, 1] / prices[0, 0] - 1 == pytest.approx(return_stats["period_return"][0])
+
+    with pytest.raises(ValueError):
+        token_prices.get_implied_price_paths(current_prices=[1.0], percent_changes=[1.0], horizon="90d")
@@ -0,0 +1,82 @@
+from backtesting.portfolio_state import PortfolioState
+from config.config import PortfolioStateConsts
+
+
+AGENT_ID = "67b0c7f2a1b2c3d4e5f60718"
+
+
+class FakeMongoDBHandler:
+    def __init__(self, portfolio_details):
+        self.portfolio_details = portfolio_details
+        self.reads = 0
+        self.writes = []
+
+    def get_portfolio_details(self, agent_id):
+        self.reads += 1
+        return self.portfolio_details
+
+    def write_portfolio_holdings(self, agent_id, holdings=None, increments=None, portfolio_metrics=None):
+        self.writes.append((holdings, increments, portfolio_metrics))
+
+
+def test_portfolio_state_reads_once_and_flushes_pending_writes():
+    handler = FakeMongoDBHandler({"ETH": {"symbol": "ETH", "amount": 0.1, "last_price": 2500.0}})
+    portfolio_state = PortfolioState(agent_id=AGENT_ID, mongo_db_handler=handler, portfolio_state_consts=PortfolioStateConsts(WATCH_CHANGES=False))
+
+    portfolio_state.update(symbol="ETH", fields={"last_price": 2700.0}, increments={"amount": 0.1})
+    portfolio_state.update(symbol="BTC", fields={"amount": 0.0, "last_price": 95000.0})
+    portfolio_state.update(symbol="BTC", increments={"amount": 0.1})
+    portfolio_state.set_metrics([{"symbol": "ETH"}])
+
+    holdings = portfolio_state.holdings()
+    assert holdings["ETH"] == {"symbol": "ETH", "amount": 0.2, "last_price": 2700.0}
+    assert holdings["BTC"]["amount"] == 0.1
+    assert portfolio_state.holdings() == holdings and handler.reads == 1
+
+    assert portfolio_state.flush() and not portfolio_state.dirty
+    # the increment after a set is folded into the set
+    assert handler.writes == [(
+        {"ETH": {"last_price": 2700.0}, "BTC": {"amount": 0.1, "last_price": 95000.0}},
+        {"ETH": {"amount": 0.1}},
+        [{"symbol": "ETH"}],
+    )]
+    assert portfolio_state.flush() and len(handler.writes) == 1
+
+
+def test_portfolio_state_change_events_keep_pending_writes():
+    handler = FakeMongoDBHandler({})
+    portfolio_state = PortfolioState(agent_id=AGENT_ID, mongo_db_handler=handler, portfolio_state_consts=PortfolioStateConsts(WATCH_CHANGES=False))
+    portfolio_state.update(symbol="ETH", increments={"amount": 0.1})
+
+    # another agent wrote the holding meanwhile
+    portfolio_state.handle_change({"operationType": "update", "fullDocument": {"portfolioDetails": {"ETH": {"symbol": "ETH", "amount": 1.0}}}})
+
+    assert portfolio_state.holdings()["ETH"]["amount"] == 1.1
+    assert handler.reads == 0
+
+
+def test_for_agent_shares_one_state_until_every_user_closed_it():
+    handler = FakeMongoDBHandler({})
+    settings = PortfolioStateConsts(WATCH_CHANGES=False, FLUSH_INTERVAL_SECONDS=60)
+
+    first = PortfolioState.for_agent(agent_id=AGENT_ID, mongo_db_handler=handler, portfolio_state_consts=settings)
+    second = PortfolioState.for_agent(agent_id=AGENT_ID, mongo_db_handler=FakeMongoDBHandler({}))
+    assert first is second and first._threads["flush"].is_alive()
+
+    first.update(symbol="ETH", increments={"amount": 0.1})
+    first.close()
+    # the other user still holds the state, its threads keep running
+    assert first._threads["flush"].is_alive() and handler.writes == [({"ETH": {}}, {"ETH": {"amount": 0.1}}, None)]
+
+    second.close()
+    first._threads["flush"].join(timeout=5)
+    assert not first._threads["flush"].is_alive()
+    assert PortfolioState.for_agent(agent_id=AGENT_ID, mongo_db_handler=handler, portfolio_state_consts=settings) is not first
+    PortfolioState.for_agent(agent_id=AGENT_ID, mongo_db_handler=handler).close()
+
+
+def test_state_without_agent_id_starts_no_threads():
+    portfolio_state = PortfolioState.for_agent(agent_id="", mongo_db_handler=FakeMongoDBHandler({}))
+
+    assert portfolio_state._threads == {}
+    portfolio_state.close()
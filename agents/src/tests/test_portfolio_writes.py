@@ -0,0 +1,78 @@
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+
+from config.config import PrivexMongodbConsts
+from rag.mongodb_handler import MongoDBHandler
+
+
+AGENT_ID = "67b0c7f2a1b2c3d4e5f60718"
+
+
+def test_portfolio_write_operations_upsert_dotted_fields():
+    operations = MongoDBHandler.portfolio_write_operations(
+        agent_id=AGENT_ID,
+        holdings={"ETH": {"amount": 0.1, "last_price": 2700.0}, "BTC": {"last_price": 95000.0}},
+        increments={"ETH": {"amount": 0.1}},
+        portfolio_metrics=[{"symbol": "ETH"}],
+    )
+
+    eth, btc, metrics = [operation._doc for operation in operations]
+    assert all(operation._filter == {"agentId": ObjectId(AGENT_ID)} and operation._upsert for operation in operations)
+    # an incremented field is never also $set, the server applies the increment atomically
+    assert eth == {
+        "$set": {"portfolioDetails.ETH.last_price": 2700.0, "portfolioDetails.ETH.symbol": "ETH"},
+        "$inc": {"portfolioDetails.ETH.amount": 0.1},
+    }
+    assert btc == {"$set": {"portfolioDetails.BTC.last_price": 95000.0, "portfolioDetails.BTC.symbol": "BTC"}}
+    assert metrics == {"$set": {"portfolioMetrics": [{"symbol": "ETH"}]}}
+
+
+def test_portfolio_write_operations_rejects_dotted_symbols():
+    assert MongoDBHandler.portfolio_write_operations(agent_id=AGENT_ID) == []
+    with pytest.raises(ValueError):
+        MongoDBHandler.portfolio_write_operations(agent_id=AGENT_ID, holdings={"USDC.E": {"last_price": 1.0}})
+
+
+class RacingPortfolioCollection:
+    """agent_portfolio whose first bulk write loses the insert race at the given operation."""
+
+    full_name = "privex.agent_portfolio"
+
+    def __init__(self, failed_index):
+        self.failed_index = failed_index
+        self.indexes = []
+        self.bulk_writes = []
+
+    def create_index(self, keys, **kwargs):
+        self.indexes.append((keys, kwargs))
+
+    def bulk_write(self, operations, ordered=True):
+        self.bulk_writes.append(list(operations))
+        if len(self.bulk_writes) == 1:
+            raise BulkWriteError({"writeErrors": [{"index": self.failed_index, "code": 11000, "errmsg": "E11000 duplicate key error"}]})
+        return "result"
+
+
+def make_handler(collection):
+    handler = MongoDBHandler.__new__(MongoDBHandler)
+    handler.privex_mongodb = PrivexMongodbConsts(PRIVEX_MONGDB_URI=f"mongodb://test-{id(collection)}")
+    handler.agent_portfolio = collection
+    return handler
+
+
+def test_portfolio_write_retries_the_upserts_that_lost_the_insert_race():
+    collection = RacingPortfolioCollection(failed_index=1)
+    handler = make_handler(collection)
+
+    result = handler.write_portfolio_holdings(agent_id=AGENT_ID, holdings={"ETH": {"last_price": 2700.0}, "BTC": {"last_price": 95000.0}})
+    handler.write_portfolio_holdings(agent_id=AGENT_ID, holdings={"ETH": {"last_price": 2800.0}})
+
+    assert result == "result"
+    # the ETH upsert was applied, only BTC is written again and now updates the stored portfolio
+    assert [[operation._doc for operation in operations] for operations in collection.bulk_writes[:2]] == [
+        [{"$set": {"portfolioDetails.ETH.last_price": 2700.0, "portfolioDetails.ETH.symbol": "ETH"}}, {"$set": {"portfolioDetails.BTC.last_price": 95000.0, "portfolioDetails.BTC.symbol": "BTC"}}],
+        [{"$set": {"portfolioDetails.BTC.last_price": 95000.0, "portfolioDetails.BTC.symbol": "BTC"}}],
+    ]
+    # the unique index is created once per process
+    assert collection.indexes == [("agentId", {"unique": True, "name": "agentId_unique"})]
@@ -0,0 +1,62 @@
+import os
+import tempfile
+
+import pytest
+
+from backtesting.quote_cache import QuoteCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_quote_cache_ttl_and_counters(clock):
+    cache = QuoteCache(ttl_seconds=60, max_entries=10, clock=clock)
+    cache.set_many({"1": {"symbol": "BTC"}, "1027": {"symbol": "ETH"}})
+
+    found, missing = cache.get_many(["1", "1027", "74"])
+    assert set(found) == {"1", "1027"}
+    assert missing == ["74"]
+
+    clock.now += 61
+    found, missing = cache.get_many(["1"])
+    assert found == {}
+    assert missing == ["1"]
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["size"] == 1
+
+
+def test_quote_cache_lru_eviction(clock):
+    cache = QuoteCache(ttl_seconds=60, max_entries=2, clock=clock)
+    cache.set_many({"1": {"symbol": "BTC"}, "2": {"symbol": "LTC"}})
+    cache.get("1")
+    cache.set_many({"3": {"symbol": "XRP"}})
+
+    found, missing = cache.get_many(["1", "2", "3"])
+    assert set(found) == {"1", "3"}
+    assert missing == ["2"]
+
+
+def test_quote_cache_sqlite_starts_warm(clock):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sqlite_path = os.path.join(tmp_dir, "quotes.sqlite")
+        cache = QuoteCache(ttl_seconds=60, max_entries=10, sqlite_path=sqlite_path, clock=clock)
+        cache.set_many({"1": {"symbol": "BTC", "price_usd": 100.0}})
+        cache.close()
+
+        clock.now += 30
+        restarted_cache = QuoteCache(ttl_seconds=60, max_entries=10, sqlite_path=sqlite_path, clock=clock)
+        assert restarted_cache.get("1") == {"symbol": "BTC", "price_usd": 100.0}
+        restarted_cache.close()
@@ -0,0 +1,154 @@
+import time
+from datetime import datetime
+from uuid import uuid4
+
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from rag.rag_chroma_client import ChromaVectorStoreManager
+
+
+class CountingEmbeddings(Embeddings):
+    """Embeds a text as [len(text), 1.0] and records every text embedded."""
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class VectorEmbeddings(Embeddings):
+    """Embeds the texts of a fixed text -> vector mapping."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+class InMemoryManager(ChromaVectorStoreManager):
+    """ChromaVectorStoreManager over an ephemeral collection, without OpenAI or a persistent client."""
+
+    def __init__(self, embeddings=None):
+        self.embeddings = embeddings or CountingEmbeddings()
+        self.vector_store = Chroma(collection_name=f"test-{uuid4()}", embedding_function=self.embeddings, client=chromadb.EphemeralClient())
+        self.collection = self.vector_store._collection
+
+
+def test_document_ids_depend_on_source_and_content_only():
+    document = Document(page_content='{"price": 1}', metadata={"source": "nfa_opportunities"})
+
+    assert ChromaVectorStoreManager.document_id(document) == ChromaVectorStoreManager.document_id(
+        Document(page_content='{"price": 1}', metadata={"source": "nfa_opportunities", "start_index": 3})
+    )
+    assert ChromaVectorStoreManager.document_id(document) != ChromaVectorStoreManager.document_id(
+        Document(page_content='{"price": 1}', metadata={"source": "twitter_posts"})
+    )
+    assert ChromaVectorStoreManager.document_id(document) != ChromaVectorStoreManager.document_id(
+        Document(page_content='{"price": 2}', metadata={"source": "nfa_opportunities"})
+    )
+
+
+def test_unchanged_snapshots_are_not_embedded_again():
+    manager = InMemoryManager()
+    snapshot = [Document(page_content=f'{{"id": {index}, "price": 1}}', metadata={"source": "nfa_opportunities"}) for index in range(3)]
+
+    first_ids = manager.add_documents(snapshot + snapshot[:1])
+    second_ids = manager.add_documents(snapshot[:2] + [Document(page_content='{"id": 2, "price": 2}', metadata={"source": "nfa_opportunities"})])
+
+    assert len(first_ids) == 3
+    assert second_ids[:2] == first_ids[:2] and second_ids[2] != first_ids[2]
+    # only the changed chunk was embedded by the second cycle
+    assert manager.embeddings.embedded[3:] == ['{"id": 2, "price": 2}']
+    assert len(manager.vector_store.get(include=[])["ids"]) == 4
+
+
+def test_replace_documents_where_deletes_chunks_a_document_no_longer_has():
+    manager = InMemoryManager()
+    key_fields = ("source", "mongo_id")
+    old_chunks = [Document(page_content=text, metadata={"source": "twitter_posts", "mongo_id": "a"}) for text in ["gm", "wagmi"]]
+    other_document = [Document(page_content="gm", metadata={"source": "twitter_posts", "mongo_id": "b"})]
+    manager.upsert_documents(old_chunks + other_document, key_fields=key_fields)
+
+    new_ids = manager.replace_documents_where(
+        filters={"mongo_id": "a"},
+        documents=[Document(page_content=text, metadata={"source": "twitter_posts", "mongo_id": "a"}) for text in ["gm", "ngmi"]],
+        key_fields=key_fields,
+    )
+
+    stored = manager.vector_store.get(where={"mongo_id": "a"})
+    assert sorted(stored["documents"]) == ["gm", "ngmi"] and sorted(stored["ids"]) == sorted(new_ids)
+    assert manager.vector_store.get(where={"mongo_id": "b"})["documents"] == ["gm"]
+    assert manager.embeddings.embedded[3:] == ["ngmi"]
+
+
+def test_search_pre_filters_on_metadata_and_returns_ids_and_distances_only():
+    manager = InMemoryManager()
+    manager.add_documents([
+        Document(page_content="eth up", metadata={"source": "nfa_opportunities", "symbol": "ETH", "created_at": datetime(2025, 2, 1).timestamp()}),
+        Document(page_content="eth is up", metadata={"source": "nfa_opportunities", "symbol": "ETH", "created_at": datetime(2025, 2, 20).timestamp()}),
+        Document(page_content="uni up", metadata={"source": "nfa_opportunities", "symbol": "UNI", "created_at": datetime(2025, 2, 20).timestamp()}),
+        Document(page_content="eth up", metadata={"source": "twitter_posts", "symbol": "ETH", "created_at": datetime(2025, 2, 20).timestamp()}),
+    ])
+
+    hits = manager.search("eth up", k=10, source="nfa_opportunities", symbol="ETH", since=datetime(2025, 2, 10))
+
+    assert len(hits) == 1 and hits[0].document is None
+    assert [document.page_content for document in manager.fetch_documents([hit.id for hit in hits])] == ["eth is up"]
+
+    hits = manager.search("eth up", k=10, source="nfa_opportunities", include_content=True)
+    # "eth up" and "uni up" embed alike, "eth is up" is further away
+    assert sorted(hit.document.page_content for hit in hits[:2]) == ["eth up", "uni up"] and hits[2].document.page_content == "eth is up"
+    assert [hit.distance for hit in hits] == sorted(hit.distance for hit in hits)
+
+
+def test_mmr_search_skips_near_duplicates():
+    vectors = {"query": [1.0, 0.3], "eth up": [1.0, 0.0], "eth up!": [1.0, 0.05], "uni listing": [0.5, 1.0]}
+    manager = InMemoryManager(embeddings=VectorEmbeddings(vectors))
+    ids = dict(zip(["eth up", "eth up!", "uni listing"], manager.add_documents([Document(page_content=text, metadata={"source": "twitter_posts"}) for text in ["eth up", "eth up!", "uni listing"]])))
+
+    assert [hit.id for hit in manager.search("query", k=2)] == [ids["eth up!"], ids["eth up"]]
+    assert [hit.id for hit in manager.search("query", k=2, mmr=True)] == [ids["eth up!"], ids["uni listing"]]
+
+
+def test_short_term_memory_is_namespaced_refreshed_and_hidden_once_expired():
+    manager = InMemoryManager()
+    snapshot = [Document(page_content=f'{{"symbol": "ETH", "price": {price}}}', metadata={"source": "nfa_opportunities"}) for price in (1, 2)]
+
+    shared_ids = manager.remember(snapshot, ttl_seconds=-1)
+    agent_ids = manager.remember(snapshot[:1], agent_id="agent-1", ttl_seconds=3600)
+
+    # the same chunk is stored once per namespace
+    assert set(shared_ids).isdisjoint(agent_ids)
+    assert manager.vector_store.get(ids=agent_ids)["metadatas"][0]["namespace"] == "agent-1/nfa_opportunities"
+    assert [hit.id for hit in manager.search("ETH", k=10)] == agent_ids
+    assert len(manager.search("ETH", k=10, include_expired=True)) == 3
+    assert manager.search("ETH", k=10, namespace=ChromaVectorStoreManager.namespace(source="nfa_opportunities")) == []
+    assert len(manager.similarity_search("ETH", k=10)) == 1
+
+    # remembering an unchanged chunk again pushes its expiry back without embedding it
+    embedded = len(manager.embeddings.embedded)
+    assert manager.remember(snapshot[:1], ttl_seconds=3600) == shared_ids[:1]
+    assert len(manager.embeddings.embedded) == embedded
+    assert sorted(hit.id for hit in manager.search("ETH", k=10)) == sorted(shared_ids[:1] + agent_ids)
+
+
+def test_delete_expired_removes_only_expired_short_term_memory():
+    manager = InMemoryManager()
+    long_term_ids = manager.add_documents([Document(page_content="uni listing", metadata={"source": "PDF"})])
+    expired_ids = manager.remember([Document(page_content=f"tweet {index}", metadata={"source": "twitter_posts"}) for index in range(5)], ttl_seconds=60)
+    live_ids = manager.remember([Document(page_content="tweet live", metadata={"source": "twitter_posts"})], ttl_seconds=3600)
+
+    assert manager.delete_expired(now=time.time() + 120, batch_size=2) == len(expired_ids)
+    assert sorted(manager.vector_store.get(include=[])["ids"]) == sorted(long_term_ids + live_ids)
@@ -0,0 +1,41 @@
+from langchain_core.documents import Document
+
+from rag.rag_pipeline import RagPipeline
+
+
+class FakeTokenPrices:
+    def get_coinmarketcap_latest_token_stats(self, ids_list):
+        return [{"symbol": "UNI", "price": 7.5}]
+
+
+class FakeEmbeddingModel:
+    def __init__(self):
+        self.stored = []
+
+    def split_multiple_json(self, json_data_list, metadata_source):
+        return [Document(page_content=str(json_data), metadata={"source": metadata_source}) for json_data in json_data_list]
+
+    def generate_embeddings_chroma(self, text_chunks):
+        self.stored.extend(text_chunks)
+
+
+class FakeManager:
+    def __init__(self):
+        self.remembered = []
+
+    def remember(self, documents, agent_id=None):
+        self.remembered.extend(documents)
+        return [str(index) for index, _ in enumerate(documents)]
+
+
+def test_portfolio_market_data_is_only_short_term_memory():
+    pipeline = RagPipeline.__new__(RagPipeline)
+    pipeline.agent_id = "agent"
+    pipeline.token_prices = FakeTokenPrices()
+    pipeline.embed_model = FakeEmbeddingModel()
+    pipeline.manager = FakeManager()
+
+    assert pipeline.process_and_update_portfolio() == ["0"]
+    assert [document.metadata["source"] for document in pipeline.manager.remembered] == ["nfa_opportunities"]
+    # nothing is written to the knowledge base collection, where it would never expire
+    assert pipeline.embed_model.stored == []
@@ -0,0 +1,124 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import polars as pl
+import pytest
+
+from backtesting.price_store import PriceStore
+from backtesting.token_prices import TokenPrices
+from backtesting.signal_backtester import SignalBacktester
+from backtesting.parameter_sweep import ParameterSweep
+
+
+@pytest.fixture
+def price_store(tmp_path):
+    price_store = PriceStore(root_path=str(tmp_path / "price_store"), session=object())
+    rows = [
+        {"asset": asset, "time": (datetime(2025, 2, 20) + timedelta(days=day)).strftime("%Y-%m-%dT%H:%M:%S.000000000Z"), "PriceUSD": str(price), "volume_reported_spot_usd_1d": "1000"}
+        for asset, prices in {"grt": [1.0, 1.1, 1.21, 1.331, 1.4641], "uni": [10.0, 9.0, 8.0, 7.0, 6.0]}.items()
+        for day, price in enumerate(prices)
+    ]
+    price_store.write_bars(price_store.coinmetrics_rows_to_bars(rows))
+    return price_store
+
+
+def test_price_store_merges_partitions(price_store):
+    price_store.record_coinmarketcap_snapshot([{"symbol": "grt", "price_usd": 2.0, "volume_24h": 5.0}], timestamp=datetime(2025, 2, 24, 12))
+    price_store.record_coinmarketcap_snapshot([{"symbol": "GRT", "price_usd": 2.5, "volume_24h": 5.0}], timestamp=datetime(2025, 2, 24, 12))
+
+    assert price_store.assets() == ["GRT", "UNI"]
+    assert price_store.last_timestamp("grt") == datetime(2025, 2, 24, 12)
+    assert os.path.exists(price_store.partition_path(asset="GRT", day="2025-02-24"))
+
+    bars = price_store.load(assets=["GRT"], start=datetime(2025, 2, 24))
+    assert bars.get_column("close").to_list() == [1.4641, 2.5]
+    assert bars.get_column("source").to_list() == ["coinmetrics", "coinmarketcap"]
+
+
+def test_last_coinmetrics_bar_ignores_coinmarketcap_snapshots(price_store):
+    price_store.record_coinmarketcap_snapshot([{"symbol": "GRT", "price_usd": 2.0, "volume_24h": 5.0}], timestamp=datetime(2025, 3, 1, 12))
+
+    assert price_store.last_timestamp("GRT") == datetime(2025, 3, 1, 12)
+    assert price_store.last_timestamp("GRT", source="coinmetrics") == datetime(2025, 2, 24)
+    assert price_store.last_timestamp("ETH", source="coinmetrics") is None
+
+
+def test_concurrent_writers_of_a_partition_keep_every_bar(price_store):
+    other_store = PriceStore(root_path=price_store.root_path, session=object())
+    snapshots = [
+        (store, [{"symbol": "LINK", "price_usd": float(minute), "volume_24h": 1.0}], datetime(2025, 3, 1, 12, minute))
+        for minute, store in enumerate([price_store, other_store] * 10)
+    ]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda snapshot: snapshot[0].record_coinmarketcap_snapshot(snapshot[1], timestamp=snapshot[2]), snapshots))
+
+    assert price_store.load(assets=["LINK"]).height == 20
+    assert not [name for name in os.listdir(os.path.dirname(price_store.partition_path(asset="LINK", day="2025-03-01"))) if name.endswith(".tmp")]
+
+
+def test_coinmetrics_session_does_not_carry_the_coinmarketcap_api_key():
+    assert "X-CMC_PRO_API_KEY" in TokenPrices.get_session().headers
+    assert "X-CMC_PRO_API_KEY" not in PriceStore.get_session().headers
+    assert PriceStore.get_session() is not TokenPrices.get_session()
+
+
+def test_signal_backtester_replays_signals(price_store, tmp_path):
+    signals_path = tmp_path / "generated_trades_for_testing-2025-02-20.json"
+    signals_path.write_text(json.dumps([
+        {"2025-02-20 06:00:00": {"agent_trade_a": [{"token_symbol": "GRT", "direction": "buy"}], "agent_signals_considered": []}},
+        {"2025-02-20 07:00:00": {"agent_trade_b": [{"token_symbol": "UNI", "direction": "Sell"}, {"token_symbol": "UNI", "direction": "hold"}]}},
+        {"2025-02-20 08:00:00": {"agent_trade_b": [{"token_symbol": "0x333", "direction": "buy"}]}},
+    ]))
+
+    backtester = SignalBacktester(price_store=price_store, holding_days=2, position_size=0.5)
+    signals = backtester.load_signals(paths=[str(signals_path)])
+    assert signals.get_column("direction").to_list() == [1, -1, 1]
+
+    result = backtester.run(signals)
+    trades = result["trades"]
+
+    assert trades.get_column("asset").to_list() == ["GRT", "UNI"]
+    assert trades.get_column("entry_time").to_list() == [datetime(2025, 2, 21)] * 2
+    assert trades.get_column("trade_return").to_list() == pytest.approx([0.21, 1 - 7.0 / 9.0])
+    assert result["stats"]["unmatched_signals"] == 1
+    assert result["stats"]["hit_rate"] == 1.0
+    assert result["returns"].get_column("equity")[-1] == pytest.approx(1 + result["stats"]["total_return"])
+    assert result["stats"]["max_drawdown"] == 0.0
+
+
+def test_parameter_sweep_runs_grid_in_process_pool(price_store):
+    signals = pl.DataFrame(
+        {
+            "signal_time": [datetime(2025, 2, 21, 6), datetime(2025, 2, 21, 7)],
+            "agent_id": ["a", "b"],
+            "asset": ["GRT", "UNI"],
+            "direction": [1, 1],
+            "confidence_level": ["high", "low"],
+        },
+        schema=SignalBacktester.SIGNAL_SCHEMA,
+    )
+    grid = {"volatility_threshold": [5, 50], "position_size": [0.1, 0.2], "holding_days": [1, 2]}
+
+    results = ParameterSweep(price_store=price_store, max_workers=2).run(signals=signals, grid=grid)
+
+    assert results.height == 8
+    assert set(results.columns) >= {"volatility_threshold", "position_size", "holding_days", "sharpe_ratio", "max_drawdown"}
+    # GRT and UNI both moved 10% over the 24 hours before the signals, only the 50% limit trades them
+    assert results.filter(pl.col("volatility_threshold") == 50).get_column("trades").to_list() == [2] * 4
+    assert results.filter(pl.col("volatility_threshold") == 5).get_column("trades").to_list() == [0] * 4
+    in_process = ParameterSweep(max_workers=1).run(signals=signals, grid=grid, bars=price_store.load())
+    assert in_process.sort(list(grid)).equals(results.sort(list(grid)))
+
+    with pytest.raises(ValueError):
+        ParameterSweep.expand_grid({"leverage": [2]})
+
+
+def test_parameter_sweep_without_signals_trades_nothing(price_store):
+    signals = pl.DataFrame(schema=SignalBacktester.SIGNAL_SCHEMA)
+
+    results = ParameterSweep(price_store=price_store, max_workers=1).run(signals=signals, grid={"holding_days": [1, 2]})
+
+    assert results.get_column("trades").to_list() == [0, 0]
@@ -0,0 +1,109 @@
+import time
+
+from rag.token_id_resolver import TokenIdResolver
+
+
+class FakeTokenStream:
+    """Change stream positioned at len(changes) already written, yielding the changes written after resume_after."""
+
+    def __init__(self, changes, resume_after):
+        self.changes = [change for change in changes if resume_after is None or change["_id"] > resume_after]
+        self.resume_token = resume_after if resume_after is not None else len(changes)
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def try_next(self):
+        if not self.changes:
+            time.sleep(0.01)
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = change["_id"]
+        return change
+
+
+class FakeTokensCollection:
+    def __init__(self, documents, changes=None):
+        self.documents = documents
+        self.changes = changes
+        self.resumed_after = []
+        self.indexes = []
+
+    def watch(self, full_document=None, resume_after=None, max_await_time_ms=None):
+        if self.changes is None:
+            raise RuntimeError("not a replica set")
+        self.resumed_after.append(resume_after)
+        return FakeTokenStream(self.changes, resume_after)
+
+    def find(self, query, projection=None):
+        documents = list(self.documents)
+        if self.changes is not None:
+            # a token written while the collection is read
+            self.changes.append({"_id": len(self.changes) + 1, "operationType": "insert", "documentKey": {"_id": 9}, "fullDocument": {"_id": 9, "symbol": "HYPE", "cmc_info": [{"id": 32196}]}})
+        return documents
+
+    def create_index(self, field):
+        self.indexes.append(field)
+
+
+def test_token_id_resolver_resolves_from_memory_and_applies_changes():
+    tokens = FakeTokensCollection([
+        {"_id": 1, "symbol": "UNI", "cmc_info": [{"id": 7083, "slug": "uniswap", "platform": {"token_address": "0x1F9840a85d5aF5bf1D1762F925BDADdC4201F984"}}]},
+        {"_id": 2, "symbol": "NOIDS", "cmc_info": []},
+    ])
+    resolver = TokenIdResolver(tokens_collection=lambda: tokens)
+    resolver.ensure_indexes()
+    assert resolver.load() and tokens.indexes == list(TokenIdResolver.INDEXES)
+
+    assert resolver.resolve_many(["uni", "uniswap", "0x1f9840a85d5af5bf1d1762f925bdaddc4201f984", "NOIDS"]) == {
+        "uni": ["7083"],
+        "uniswap": ["7083"],
+        "0x1f9840a85d5af5bf1d1762f925bdaddc4201f984": ["7083"],
+        "NOIDS": [],
+    }
+
+    resolver.handle_change({"operationType": "insert", "documentKey": {"_id": 3}, "fullDocument": {"_id": 3, "symbol": "UNI", "cmc_info": [{"id": 99999}]}})
+    # the first inserted document sharing the symbol wins, its ids are not mixed with the others
+    assert resolver.resolve("UNI") == ["7083"]
+
+    resolver.handle_change({"operationType": "delete", "documentKey": {"_id": 1}})
+    assert resolver.resolve("UNI") == ["99999"] and resolver.resolve("uniswap") == []
+
+    resolver.remember(symbol="hype", ids=[32196])
+    assert resolver.resolve("HYPE") == ["32196"]
+
+
+def test_token_id_resolver_keeps_the_first_document_of_a_shared_symbol():
+    tokens = FakeTokensCollection([
+        {"_id": 12, "symbol": "PEPE", "cmc_info": [{"id": 33333, "slug": "pepe-bsc"}]},
+        {"_id": 10, "symbol": "PEPE", "cmc_info": [{"id": 24478, "slug": "pepe"}]},
+        {"_id": 11, "symbol": "pepe", "cmc_info": [{"id": 11111}]},
+    ])
+    resolver = TokenIdResolver(tokens_collection=lambda: tokens)
+    assert resolver.load()
+
+    # ranked by _id rather than by load order, and the slug still finds the other document
+    assert resolver.resolve("PEPE") == ["24478"] and resolver.resolve("pepe-bsc") == ["33333"]
+
+    resolver.handle_change({"operationType": "delete", "documentKey": {"_id": 10}})
+    assert resolver.resolve("PEPE") == ["11111"]
+
+
+def test_token_id_resolver_applies_the_changes_written_while_it_loaded():
+    tokens = FakeTokensCollection([{"_id": 1, "symbol": "UNI", "cmc_info": [{"id": 7083}]}], changes=[])
+    resolver = TokenIdResolver(tokens_collection=lambda: tokens)
+    assert resolver.load() and resolver.resolve("HYPE") == []
+
+    resolver.start_watcher()
+    deadline = time.monotonic() + 5
+    while resolver.resolve("HYPE") == [] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    resolver.stop_watcher()
+
+    # the watcher resumed from the position taken before the collection was read
+    assert tokens.resumed_after[:2] == [None, 0]
+    assert resolver.resolve("HYPE") == ["32196"] and resolver.resolve("UNI") == ["7083"]
@@ -10,10 +10,10 @@ import textwrap
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
 from langchain_core.documents import Document
-from langchain_openai import OpenAIEmbeddings
 from sklearn.metrics.pairwise import cosine_similarity
 
 from rag.embedding_model import EmbeddingModel
+from rag.embedding_service import EmbeddingService
 from twitter.twitter_api import TwitterAPI
 from rag.rag_chroma_client import ChromaVectorStoreManager
 from config.config import HubPull, OpenAiConsts, TwitterApiConsts
@@ -59,7 +59,7 @@ class TweetGenerator:
         self.tweet_similarity_threshold = twitter_consts.MAX_SIMILARITY_THRESHOLD
         self._load_api_key()
         open_ai_consts = OpenAiConsts()
-        self.open_ai_embedding_function = OpenAIEmbeddings(model=open_ai_consts.DEFAULT_EMBEDDING_MODEL)
+        self.open_ai_embedding_function = EmbeddingService.shared().as_langchain()
         self.llm = ChatOpenAI(model=open_ai_consts.DEFAULT_MODEL_NAME)
 
         # since chroma is only going to be used for short term data which diana class gets from nfa database and market data ChromaVectorStoreManager collection name is DIANA
@@ -190,8 +190,8 @@ class TweetGenerator:
         """
         embeddings = self.open_ai_embedding_function
         
-        vector1 = embeddings.embed_query(text1)
-        vector2 = embeddings.embed_query(text2)
+        # both texts go out in one embeddings request
+        vector1, vector2 = embeddings.embed_documents([text1, text2])
         similarity = cosine_similarity([vector1], [vector2])[0][0]
         return similarity
 
@@ -333,17 +333,18 @@ class TweetGenerator:
         Parameters
         ----------
         num_docs : int, optional
-            The number of random documents to retrieve, by default 5.
+            The number of random documents to retrieve, by default 10.
 
         Returns
         -------
         List[Document]
             A list of randomly selected documents.
         """
-        search_results = self.manager.similarity_search(query, k=200, filters={"source": similarity_search_filter})
-        sampled_results = random.sample(search_results, min(num_docs, len(search_results)))
-    
-        return sampled_results
+        # the 200 nearest candidates are sampled by id, only the content of the sampled documents is loaded
+        search_hits = self.manager.search(query, k=200, source=similarity_search_filter)
+        sampled_hits = random.sample(search_hits, min(num_docs, len(search_hits)))
+
+        return self.manager.fetch_documents([hit.id for hit in sampled_hits])
 
     def normalize_tweets_to_comment(self, recent_tweets: List[Document]) -> List[str]:
         """